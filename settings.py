@@ -3,6 +3,12 @@ from chihiro import ROOT_DIR
 LOGGER_NAME = "chihiro"
 LOG_DIR = ROOT_DIR / "logs"
 MAX_WORKERS = 6  # Set this high and your PC dies
+SIMULATION_PROCESSES = 1  # Processes used to run random trials, 1 runs them in the calling thread
+COMPILED_CHART_CACHE_SIZE = 32  # Number of compiled charts kept in memory
+TRIAL_BONUS_CACHE_VALUES = 20000000  # Per note trial bonuses kept to rescale simulations for other appeals
+BONUS_MEMO_SIZE = 65536  # Bonus evaluations remembered per state machine, for each phase
+CARD_PROTOTYPE_CACHE_SIZE = 1024  # Built cards kept to copy instead of querying the DB again
+MASTERDB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes of master.db memory-mapped by each connection
 
 DATA_PATH = ROOT_DIR / "data"
 BACKUP_PATH = DATA_PATH / "backup"
@@ -12,9 +18,11 @@ IMAGE_PATH32 = DATA_PATH / "img32"
 IMAGE_PATH64 = DATA_PATH / "img64"
 ZIP_PATH = ROOT_DIR / "img.zip"
 MUSICSCORES_PATH = DATA_PATH / "musicscores"
+CHART_STORE_PATH = DATA_PATH / "charts"
 CACHEDB_PATH = DB_PATH / "chihiro.db"
 MANIFEST_PATH = DB_PATH / "manifest.db"
 MASTERDB_PATH = DB_PATH / "master.db"
+MASTER_SNAPSHOT_PATH = DB_PATH / "master.snapshot"
 
 PROFILE_PATH = DATA_PATH / "profiles"
 
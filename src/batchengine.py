@@ -0,0 +1,243 @@
+import numpy as np
+
+import customlogger as logger
+from statemachine import jitter_note_times
+from static.song_difficulty import PERFECT_TAP_RANGE
+
+BLOCK_SIZE = 256  # Trials whose draws are jittered and sorted together
+MAX_STATES = 200000  # Skill states remembered before trials with new states always fall back
+MAX_BONUSES = 1000000  # Evaluated bonuses remembered before new ones stop being recorded
+WARMUP_TRIALS = 64  # Trials after which the engine gives up if most of them needed the state machine
+
+
+class BatchTrialEngine:
+    """
+    Runs perfect-only random trials without stepping the state machine through every note.
+
+    With perfect judgements, the bonuses of a note only depend on the skill state it falls into, its note class
+    (flick/long/slide) and, with life sparkle, its life. The skill events of a trial are fully determined by which
+    activations succeed, so each trial is reduced to a state per note from its activation draws and its jittered,
+    sorted note times. Bonuses are looked up from the ones the state machine already evaluated in earlier trials and a
+    trial only falls back to the state machine when it needs a bonus that has not been seen yet. Scores are identical
+    to running every trial through the state machine.
+    """
+
+    def __init__(self, simulator, impl):
+        self.simulator = simulator
+        self.impl = impl
+        self.chart = simulator.chart
+        self.random_range = PERFECT_TAP_RANGE[impl.difficulty] / 2E6
+        self.base_score = impl.base_score
+        self.weights = np.array(impl.weights)
+        self.note_classes = self.chart.is_flick.astype(int) + 2 * self.chart.is_long + 4 * self.chart.is_slide
+
+        skills = [card.skill for card in impl.live.unit.all_cards()]
+        # Encore and alternate/mutual/refrain depend on what activated before them, so their states are identified by
+        # the whole event history instead of the set of active skills
+        self.history_free = not any(skill.is_encore or skill.is_alternate or skill.is_mutual or skill.is_refrain
+                                    for skill in skills)
+        self.track_life = any(skill.is_sparkle for skill in skills)
+        self.start_life = impl.live.get_start_life(doublelife=impl.doublelife)
+        self.max_life = impl.live.get_start_life(doublelife=True)
+        self.life_buckets = int(self.max_life // 10) + 1 if self.track_life else 1
+
+        self._build_events(skills)
+
+        self.bonuses = dict()
+        self.heals = dict()
+        self.histories = dict()
+        self.reused = 0
+        self.fallbacks = 0
+
+    @staticmethod
+    def supports(live):
+        """
+        Overload and spike drain life on activation, so whether they activate depends on the notes before them.
+        """
+        return not any(card.skill.is_ol or card.skill.is_spike for card in live.unit.all_cards())
+
+    def _build_events(self, skills):
+        """
+        Lay out every activation and deactivation a trial can have, in the order the state machine sorts them.
+        """
+        impl = self.impl
+        times = list()
+        indices = list()
+        slots = list()
+        uncertain = list()
+        for unit_idx, unit in enumerate(impl.live.unit.all_units):
+            magics = list()
+            cached_classes = list()
+            others = list()
+            for card_idx, card in enumerate(unit.all_cards()):
+                if card.skill.is_magic:
+                    magics.append(card_idx)
+                elif card.skill.is_alternate or card.skill.is_mutual or card.skill.is_refrain:
+                    cached_classes.append(card_idx)
+                else:
+                    others.append(card_idx)
+            for card_idx in magics + others + cached_classes:
+                idx = unit_idx * 5 + card_idx
+                skill = skills[idx]
+                probability = impl.probabilities[idx]
+                if probability == 0:
+                    continue
+                skill_times = int((impl.song_duration - 3) // skill.interval)
+                for act_idx in range(skill.offset + 1, skill_times + 1, impl.unit_offset):
+                    if probability < 1:
+                        slot = len(uncertain)
+                        uncertain.append((idx, act_idx, probability))
+                    else:
+                        slot = -1
+                    act = act_idx * skill.interval
+                    deact = act_idx * skill.interval + skill.duration
+                    times.extend((int(act * 1E6), int(deact * 1E6)))
+                    indices.extend((idx + 1, -idx - 1))
+                    slots.extend((slot, slot))
+        sorted_indices = np.argsort(np.array(times, dtype=np.int64), kind='stable')
+        self.event_times = np.array(times, dtype=np.int64)[sorted_indices]
+        self.event_indices = np.array(indices, dtype=int)[sorted_indices]
+        self.event_slots = np.array(slots, dtype=int)[sorted_indices]
+        self.event_certain = self.event_slots < 0
+        # Whether the event is handled before a note at the same time
+        self.event_first = np.logical_or(
+            np.logical_and(self.event_indices > 0, impl.left_inclusive),
+            np.logical_and(self.event_indices < 0, not impl.right_inclusive))
+        self.uncertain_cards = np.array([_[0] for _ in uncertain], dtype=int)
+        self.uncertain_acts = np.array([_[1] for _ in uncertain], dtype=int)
+        self.uncertain_probabilities = np.array([_[2] for _ in uncertain])
+
+    def run(self, trials, seed, bonuses=None):
+        """
+        :param bonuses: list to append the final bonus multipliers of every trial to, None to skip them
+        """
+        scores = list()
+        trials = list(trials)
+        for start in range(0, len(trials), BLOCK_SIZE):
+            block = trials[start:start + BLOCK_SIZE]
+            draws = [self.simulator._draw_trial_uniforms(seed, trial) for trial in block]
+            jitter_uniforms = np.array([_[0] for _ in draws])
+            activation_uniforms = np.array([_[1] for _ in draws])
+            note_time_stacks, _ = jitter_note_times(self.chart, jitter_uniforms, self.random_range)
+            sorted_indices = np.argsort(note_time_stacks, axis=1)
+            sorted_times = np.take_along_axis(note_time_stacks, sorted_indices, axis=1)
+            activations = activation_uniforms[:, self.uncertain_cards, self.uncertain_acts] \
+                          <= self.uncertain_probabilities
+            for row in range(len(block)):
+                if self._given_up():
+                    score, final_bonus = self._run_state_machine(draws[row])
+                else:
+                    score, final_bonus = self._run_trial(draws[row], activations[row], sorted_indices[row],
+                                                         sorted_times[row])
+                scores.append(score)
+                if bonuses is not None:
+                    bonuses.append(final_bonus)
+        logger.debug("Batch engine: {} trials reused bonuses, {} used the state machine".format(
+            self.reused, self.fallbacks))
+        return scores
+
+    def _given_up(self):
+        return self.reused + self.fallbacks >= WARMUP_TRIALS and self.fallbacks > self.reused
+
+    def _run_trial(self, draws, activations, sorted_indices, sorted_times):
+        note_states = self._get_note_states(activations, sorted_times)
+        # Special note types are looked up by note index in the time-sorted list, same as the state machine
+        classes = self.note_classes[sorted_indices[sorted_indices]]
+        keys = self._get_keys(note_states, classes)
+        if keys is not None:
+            bonuses = [self.bonuses.get(key) for key in keys.tolist()]
+            if None not in bonuses:
+                self.reused += 1
+                bonuses = np.array(bonuses)
+                final_bonus = 1 + bonuses[:, 0] / 100
+                final_bonus[1:] *= 1 + bonuses[1:, 1] / 100
+                return int(np.round(self.base_score * self.weights * final_bonus).sum()), final_bonus
+        score, final_bonus = self._run_state_machine(draws)
+        self._record(note_states, classes)
+        return score, final_bonus
+
+    def _run_state_machine(self, draws):
+        self.fallbacks += 1
+        jitter_uniforms, activation_uniforms = draws
+        self.impl.reset_machine(perfect_play=False, perfect_only=True,
+                                jitter_uniforms=jitter_uniforms, activation_uniforms=activation_uniforms)
+        return self.impl.simulate_impl()[0], self.impl.get_final_bonus()
+
+    def _get_note_states(self, activations, sorted_times):
+        """
+        :return: the skill state of every note in hit order, -1 if it is not remembered
+        """
+        keep = self.event_certain.copy()
+        keep[~keep] = activations[self.event_slots[~keep]]
+        times = self.event_times[keep]
+        indices = self.event_indices[keep]
+        first = self.event_first[keep]
+
+        # Events at the same time as a note are handled before it up to the first one that is not
+        leading = np.zeros(len(times) + 1, dtype=int)
+        for event in range(len(times) - 1, -1, -1):
+            if first[event]:
+                same_time = event + 1 < len(times) and times[event + 1] == times[event]
+                leading[event] = 1 + (leading[event + 1] if same_time else 0)
+        before = np.searchsorted(times, sorted_times, side='left')
+        until = np.searchsorted(times, sorted_times, side='right')
+        handled = before + np.where(until > before, leading[before], 0)
+
+        states = np.empty(len(times) + 1, dtype=np.int64)
+        states[0] = 0
+        if self.history_free:
+            active = 0
+            for event, skill_idx in enumerate(indices.tolist()):
+                if skill_idx > 0:
+                    active |= 1 << (skill_idx - 1)
+                else:
+                    active &= ~(1 << (-skill_idx - 1))
+                states[event + 1] = active
+        else:
+            node = 0
+            event_ids = np.flatnonzero(keep).tolist()
+            for event, event_id in enumerate(event_ids):
+                if node >= 0:
+                    child = self.histories.get((node, event_id))
+                    if child is None and len(self.histories) < MAX_STATES:
+                        child = len(self.histories) + 1
+                        self.histories[(node, event_id)] = child
+                    node = -1 if child is None else child
+                states[event + 1] = node
+        return states[handled]
+
+    def _get_keys(self, note_states, classes, lives=None):
+        if (note_states < 0).any():
+            return None
+        if self.track_life:
+            if lives is None:
+                heals = np.array([self.heals.get(state, np.nan) for state in note_states.tolist()])
+                if np.isnan(heals).any():
+                    return None
+                lives = np.minimum(self.max_life, self.start_life + np.cumsum(heals))
+            buckets = (np.asarray(lives) // 10).astype(np.int64)
+        else:
+            buckets = 0
+        return (note_states * 8 + classes) * self.life_buckets + buckets
+
+    def _record(self, note_states, classes):
+        impl = self.impl
+        if self.track_life:
+            lives = np.array(impl.lives)
+            previous = np.concatenate([[self.start_life], lives[:-1]])
+            # Healing is only known where life did not hit the cap
+            for state, life, heal in zip(note_states.tolist(), lives.tolist(), (lives - previous).tolist()):
+                if state >= 0 and life < self.max_life:
+                    self.heals[state] = heal
+        else:
+            lives = None
+        if len(self.bonuses) >= MAX_BONUSES:
+            return
+        valid = note_states >= 0
+        if not valid.all():
+            note_states = np.where(valid, note_states, 0)
+        keys = self._get_keys(note_states, classes, lives)
+        for key, score_bonus, combo_bonus, is_valid in zip(keys.tolist(), impl.score_bonuses, impl.combo_bonuses,
+                                                          valid.tolist()):
+            if is_valid:
+                self.bonuses[key] = (score_bonus, combo_bonus)
@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from settings import TRIAL_BONUS_CACHE_VALUES
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class TrialBonuses:
+    """
+    Final bonus multipliers of every note of a simulation, for the perfect play and every random trial.
+
+    Note scores are the base score times the note weight times these, and nothing else in a simulation depends on the
+    total appeal. Another total appeal is answered by rescaling with the same rounding, which gives exactly the scores
+    a new simulation with the same trials would.
+    """
+
+    def __init__(self, seed, weights, perfect_bonus, full_roll_chance, trial_bonuses):
+        self.seed = seed
+        self.weights = np.array(weights)
+        self.perfect_bonus = perfect_bonus
+        self.full_roll_chance = full_roll_chance
+        self.trial_bonuses = trial_bonuses
+
+    @property
+    def size(self):
+        return self.trial_bonuses.size + self.perfect_bonus.size
+
+    def get_perfect_scores(self, base_score):
+        return np.round(base_score * self.weights * self.perfect_bonus)
+
+    def get_trial_scores(self, base_score):
+        if len(self.trial_bonuses) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.round(base_score * self.weights * self.trial_bonuses).sum(axis=1).astype(np.int64)
+
+
+def get_trial_bonuses(key, seed=None):
+    """
+    :param key: everything but the total appeal the simulation depends on
+    :param seed: base seed of the trials, None for any
+    """
+    with _cache_lock:
+        bonuses = _cache.get(key)
+        if bonuses is None or seed is not None and bonuses.seed != seed:
+            return None
+        _cache.move_to_end(key)
+        return bonuses
+
+
+def put_trial_bonuses(key, bonuses: TrialBonuses):
+    if bonuses.size > TRIAL_BONUS_CACHE_VALUES:
+        return
+    with _cache_lock:
+        _cache[key] = bonuses
+        _cache.move_to_end(key)
+        while sum(_.size for _ in _cache.values()) > TRIAL_BONUS_CACHE_VALUES:
+            _cache.popitem(last=False)
+
+
+def clear_trial_bonuses():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,164 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import customlogger as logger
+from settings import CHART_STORE_PATH
+from static.note_type import NoteType
+from utils import storage
+
+# Columns of the chart CSVs, id aside, and the dtype they are stored as
+COLUMNS = (
+    ("sec", np.float64),
+    ("type", np.int64),
+    ("startPos", np.int64),
+    ("finishPos", np.int64),
+    ("status", np.int64),
+    ("sync", np.int64),
+    ("groupId", np.int64),
+    ("visible", np.float64),
+)
+INDEX_DTYPE = np.dtype([
+    ("live_id", np.int32),
+    ("difficulty", np.int32),
+    ("start", np.int64),
+    ("stop", np.int64),
+    ("duration", np.float64),
+    ("columns", np.int32),  # Bit i set if the chart has COLUMNS[i]
+])
+NOTE_TYPES = np.array(list(NoteType), dtype=object)
+
+
+class ChartStore:
+    """
+    Notes of every chart in one array per column, charts one after another, with an index of the rows of every
+    (live ID, difficulty). The arrays are memory-mapped, so loading a chart only copies its rows instead of parsing its
+    CSV. Built from the musicscores databases whenever they are updated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.index = None
+        self.columns = None
+
+    def _load(self):
+        if self.index is not None:
+            return
+        self.index = dict()
+        self.columns = dict()
+        if not (self.path / "index.npy").exists():
+            return
+        for name, _ in COLUMNS + (("note_type", None),):
+            self.columns[name] = np.load(self.path / "{}.npy".format(name), mmap_mode="r")
+        for row in np.load(self.path / "index.npy").tolist():
+            live_id, difficulty, start, stop, duration, columns = row
+            self.index[(live_id, difficulty)] = (start, stop, duration, columns)
+
+    def close(self):
+        with self.lock:
+            self.index = None
+            self.columns = None
+
+    def exists(self):
+        return (self.path / "index.npy").exists()
+
+    def keys(self):
+        with self.lock:
+            self._load()
+            return list(self.index.keys())
+
+    def __contains__(self, key):
+        with self.lock:
+            self._load()
+            return key in self.index
+
+    def get(self, live_id, difficulty):
+        """
+        :return: notes of the chart the same as parsed from its CSV, and its duration. None if it is not stored.
+        """
+        with self.lock:
+            self._load()
+            entry = self.index.get((live_id, difficulty))
+            if entry is None:
+                return None
+            start, stop, duration, columns = entry
+            notes_data = pd.DataFrame({
+                name: np.array(self.columns[name][start:stop])
+                for bit, (name, _) in enumerate(COLUMNS)
+                if columns >> bit & 1
+            })
+            notes_data["note_type"] = NOTE_TYPES[self.columns["note_type"][start:stop]]
+        return notes_data, duration
+
+    def write(self, charts):
+        """
+        Replace the store with the given charts. Charts with columns that cannot be stored as is are left out, they
+        are parsed from their CSV when loaded.
+        :param charts: (live ID, difficulty) to notes and duration
+        """
+        index = list()
+        columns = {name: list() for name, _ in COLUMNS + (("note_type", None),)}
+        start = 0
+        for (live_id, difficulty), (notes_data, duration) in sorted(charts.items()):
+            converted = self._convert(notes_data)
+            if converted is None:
+                logger.debug("Chart {} difficulty {} has columns that cannot be stored".format(live_id, difficulty))
+                continue
+            present = 0
+            for bit, (name, dtype) in enumerate(COLUMNS):
+                if name in converted:
+                    present |= 1 << bit
+                    columns[name].append(converted[name])
+                else:
+                    columns[name].append(np.zeros(len(notes_data), dtype=dtype))
+            columns["note_type"].append(converted["note_type"])
+            stop = start + len(notes_data)
+            index.append((live_id, difficulty, start, stop, duration, present))
+            start = stop
+
+        dtypes = dict(COLUMNS + (("note_type", np.int8),))
+        with self.lock:
+            # Mapped files cannot be replaced on Windows
+            self.index = None
+            self.columns = None
+            # The index is written last, a store without it is ignored
+            if (self.path / "index.npy").exists():
+                (self.path / "index.npy").unlink()
+            for name, arrays in columns.items():
+                self._save(name, np.concatenate(arrays) if arrays else np.zeros(0, dtype=dtypes[name]))
+            self._save("index", np.array(index, dtype=INDEX_DTYPE))
+        logger.info("Stored {} charts, {} notes".format(len(index), start))
+
+    def _save(self, name, array):
+        path = self.path / "{}.npy".format(name)
+        temp_path = self.path / "{}.tmp.npy".format(name)
+        with storage.get_writer(temp_path, "wb") as fwb:
+            np.save(fwb, array)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _convert(notes_data):
+        converted = dict()
+        names = dict(COLUMNS)
+        for name in notes_data.columns:
+            if name == "note_type":
+                converted[name] = np.array([_.value for _ in notes_data[name]], dtype=np.int8)
+                continue
+            if name not in names:
+                return None
+            values = notes_data[name].to_numpy()
+            if values.dtype.kind not in "iuf" or names[name] is np.int64 and not np.isfinite(values).all():
+                return None
+            array = values.astype(names[name])
+            if not np.array_equal(array, values, equal_nan=names[name] is np.float64):
+                return None
+            converted[name] = array
+        if "note_type" not in converted:
+            return None
+        return converted
+
+
+chart_store = ChartStore(CHART_STORE_PATH)
@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from settings import COMPILED_CHART_CACHE_SIZE
+from static.live_values import WEIGHT_RANGE
+from static.note_type import NoteType
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class CompiledChart:
+    """
+    Everything the simulator derives from a chart, computed once as arrays/lists.
+    Instances are shared between simulations and must not be mutated.
+    """
+
+    def __init__(self, notes_data, mirror=False, grand_chart=False):
+        self.note_count = len(notes_data)
+        self.song_duration = notes_data.iloc[-1].sec
+        self.sec = notes_data['sec'].to_numpy(dtype=float)
+        self.note_times = (self.sec * 1E6).astype(np.int64).tolist()
+        self.note_types = notes_data['note_type'].to_list()
+        self.note_type_array = notes_data['note_type'].to_numpy()
+
+        finish_pos = notes_data['finishPos'].to_numpy(dtype=int)
+        status = notes_data['status'].to_numpy(dtype=int)
+        if mirror and grand_chart:
+            finish_pos = 16 - (finish_pos + status - 1)
+        self.finish_pos = finish_pos.tolist()
+        self.status = status.tolist()
+        group_ids = notes_data['groupId'].to_numpy(dtype=int)
+        self.group_ids = group_ids.tolist()
+
+        self.is_flick = self.note_type_array == NoteType.FLICK
+        self.is_long = self.note_type_array == NoteType.LONG
+        self.is_slide = np.logical_or(self.note_type_array == NoteType.SLIDE,
+                                      np.logical_and(notes_data['type'].to_numpy() == 3, self.is_flick))
+        self._mark_long_ends(finish_pos)
+        self.checkpoints_array = self._get_slide_checkpoints(group_ids)
+        self.checkpoints = self.checkpoints_array.tolist()
+        self.weights = self._get_weights()
+
+        self.special_note_types = list()
+        for is_flick, is_long, is_slide in zip(self.is_flick, self.is_long, self.is_slide):
+            temp = list()
+            if is_flick:
+                temp.append(NoteType.FLICK)
+            if is_long:
+                temp.append(NoteType.LONG)
+            if is_slide:
+                temp.append(NoteType.SLIDE)
+            self.special_note_types.append(temp)
+
+    def _mark_long_ends(self, finish_pos):
+        # Flicks and taps that release a long note on the same lane count as long notes as well
+        stack = dict()
+        for idx in np.flatnonzero(np.logical_or(self.is_long, self.is_flick)):
+            lane = finish_pos[idx]
+            if self.note_types[idx] == NoteType.LONG and lane not in stack:
+                stack[lane] = idx
+            elif lane in stack:
+                stack.pop(lane)
+                self.is_long[idx] = True
+
+    def _get_slide_checkpoints(self, group_ids):
+        checkpoints = self.note_type_array == NoteType.SLIDE
+        slide_groups = np.unique(group_ids[checkpoints])
+        grouped = np.flatnonzero(group_ids != 0)
+        unique_groups, first_indices = np.unique(group_ids[grouped], return_index=True)
+        _, last_indices = np.unique(group_ids[grouped][::-1], return_index=True)
+        last_indices = len(grouped) - 1 - last_indices
+        # Slide heads and tails are judged normally, only the notes in between are checkpoints
+        in_slide_group = np.isin(unique_groups, slide_groups)
+        checkpoints[grouped[first_indices[in_slide_group]]] = False
+        checkpoints[grouped[last_indices[in_slide_group]]] = False
+        return checkpoints
+
+    def _get_weights(self):
+        weights = np.zeros(self.note_count)
+        bounds = np.trunc(WEIGHT_RANGE[:, 0] / 100 * self.note_count - 1).astype(int)
+        for idx, (bound_l, bound_r) in enumerate(zip(bounds[:-1], bounds[1:])):
+            weights[max(bound_l, 0):bound_r + 1] = WEIGHT_RANGE[idx][1]
+        return weights.tolist()
+
+
+def get_compiled_chart(live, mirror=False):
+    """
+    Get the compiled chart of a live, cached by (score_id, difficulty, mirror).
+    Lives without a score ID (e.g. fetched by name) are compiled without caching.
+    """
+    mirror = mirror and live.is_grand_chart
+    if live.score_id is None:
+        return CompiledChart(live.notes, mirror, live.is_grand_chart)
+    key = (live.score_id, live.difficulty, mirror)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    chart = CompiledChart(live.notes, mirror, live.is_grand_chart)
+    with _cache_lock:
+        _cache[key] = chart
+        while len(_cache) > COMPILED_CHART_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return chart
+
+
+def clear_compiled_charts():
+    with _cache_lock:
+        _cache.clear()
@@ -1,69 +1,166 @@
 import sqlite3
 import threading
+import weakref
 from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
 
 from network import meta_updater
+from settings import MASTERDB_MMAP_SIZE
 
-mutex = threading.Lock()
+
+class _ThreadConnection(object):
+    """
+    Connection of one thread, closed once the thread is gone and its thread-local holder with it.
+    """
+
+    def __init__(self, connection, generation):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.generation = generation
+        self.close = weakref.finalize(self, connection.close)
 
 
 class CustomDB(object):
+    """
+    SQLite database with a connection per thread, so threads read in parallel. Writers take a lock of this database
+    only, from their first write until they commit or roll back, readers never wait for it. Writes must be committed
+    by the thread that made them, a failed write rolls back the whole transaction.
+    """
 
-    def __init__(self, path):
-        self._db_connection = sqlite3.connect(path, check_same_thread=False)
-        self._db_cur = self._db_connection.cursor()
+    def __init__(self, path, read_only=False, wal=False):
+        """
+        :param read_only: open as immutable and memory-mapped, for databases only ever replaced as a whole
+        :param wal: use write-ahead logging, so readers and a writer do not block each other
+        """
+        self._path = path
+        self._read_only = read_only
+        self._wal = wal
+        self._local = threading.local()
+        self._generation = 0
+        # Holders of the live connections, pruned as threads exit
+        self._holders = weakref.WeakSet()
+        self._wal_set = False
+        self._connections_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._get_connection()
 
     def __enter__(self):
         return self
 
     def __exit__(self, type, value, traceback):
-        self._db_connection.rollback()
-        self._db_cur.close()
-        self._db_connection.close()
+        self.rollback()
+        self.close()
+
+    def _connect(self):
+        if self._read_only:
+            uri = "{}?mode=ro&immutable=1".format(Path(self._path).resolve().as_uri())
+            connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            connection.execute("PRAGMA mmap_size = {}".format(MASTERDB_MMAP_SIZE))
+        else:
+            connection = sqlite3.connect(self._path, check_same_thread=False)
+        with self._connections_lock:
+            if self._wal and not self._wal_set:
+                # Persistent, the first connection sets it for the file
+                connection.execute("PRAGMA journal_mode = WAL")
+                self._wal_set = True
+            holder = _ThreadConnection(connection, self._generation)
+            self._holders.add(holder)
+        return holder
+
+    def _get_holder(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None or holder.generation != self._generation:
+            holder = self._local.holder = self._connect()
+        return holder
+
+    def _get_connection(self):
+        return self._get_holder().connection
+
+    def _execute(self, query, params=None):
+        cursor = self._get_holder().cursor
+        if params is None:
+            cursor.execute(query)
+        else:
+            cursor.execute(query, params)
+        return cursor
 
     def execute_and_fetchone(self, query, params=None, out_dict=False):
-        self.execute(query, params, let_me_unlock=True)
-        result = self._db_cur.fetchone()
+        cursor = self._execute(query, params)
+        result = cursor.fetchone()
         if out_dict:
-            description = self._db_cur.description
+            description = cursor.description
             res = OrderedDict({key[0]: value for key, value in zip(description, result)})
         else:
             res = result
-        mutex.release()
         return res
 
     def execute_and_fetchall(self, query, params=None, out_dict=False):
-        self.execute(query, params, let_me_unlock=True)
-        result = self._db_cur.fetchall()
+        cursor = self._execute(query, params)
+        result = cursor.fetchall()
         if out_dict:
-            description = self._db_cur.description
+            description = cursor.description
             res = [OrderedDict({key[0]: value for key, value in zip(description, _)}) for _ in result]
         else:
             res = result
-        mutex.release()
         return res
 
-    def execute(self, query, params=None, let_me_unlock=False):
-        mutex.acquire()
+    def execute(self, query, params=None):
+        if not getattr(self._local, "writing", False):
+            self._write_lock.acquire()
+            self._local.writing = True
         try:
-            if params is None:
-                self._db_cur.execute(query)
-            else:
-                self._db_cur.execute(query, params)
-        except sqlite3.OperationalError as e:
-            mutex.release()
-            raise e
-        if not let_me_unlock:
-            mutex.release()
+            self._execute(query, params)
+        except Exception:
+            # Other writers would wait forever on a transaction nobody commits
+            self.rollback()
+            raise
+        # Statements outside of a transaction, e.g. DDL or ATTACH, are done already
+        if not self._get_connection().in_transaction:
+            self._release_writer()
 
     def commit(self):
-        mutex.acquire()
-        self._db_connection.commit()
-        mutex.release()
+        try:
+            self._get_connection().commit()
+        finally:
+            self._release_writer()
+
+    def rollback(self):
+        try:
+            self._get_connection().rollback()
+        finally:
+            self._release_writer()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Writes of the block, committed at its end or rolled back if it raises.
+        """
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
+    def _release_writer(self):
+        if getattr(self._local, "writing", False):
+            self._local.writing = False
+            self._write_lock.release()
 
     def get_connection(self):
-        return self._db_connection
+        return self._get_connection()
+
+    def close(self):
+        """
+        Close the connections of all threads, they reconnect on their next query.
+        """
+        with self._connections_lock:
+            self._generation += 1
+            holders = list(self._holders)
+        for holder in holders:
+            holder.close()
 
 
-masterdb = CustomDB(meta_updater.get_masterdb_path())
-cachedb = CustomDB(meta_updater.get_cachedb_path())
+masterdb = CustomDB(meta_updater.get_masterdb_path(), read_only=True)
+cachedb = CustomDB(meta_updater.get_cachedb_path(), wal=True)
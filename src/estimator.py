@@ -0,0 +1,350 @@
+import heapq
+from itertools import product
+
+import numpy as np
+
+import customlogger as logger
+from statemachine import UnitCacheBonus
+
+MAX_ENUMERATED_ACTIVATIONS = 12  # Uncertain activations per segment above which only the likeliest outcomes are used
+MAX_ENCORE_TARGETS = 16  # Earlier activations considered as the one an encore copies
+MIN_PROBABILITY_MASS = 1 - 1E-6  # Outcome probability to cover before the rest is left out
+UNIT_CACHE_FIELDS = ("tap", "flick", "longg", "slide", "combo", "ref_tap", "ref_flick", "ref_long", "ref_slide",
+                     "ref_combo", "alt_tap", "alt_flick", "alt_long", "alt_slide", "alt_combo")
+
+
+class ExpectedScoreEstimator:
+    """
+    Expected score of random simulations without running trials.
+
+    Activations succeed independently with the probability of their card, so the notes between two skill events
+    (a segment) are covered by a fixed set of activations that each may or may not have succeeded. The expected score
+    of a segment is the probability-weighted score over the outcomes of its uncertain activations, with the bonuses of
+    each outcome evaluated by replaying only those activations through the state machine. An encore with nothing
+    activated before it in the segment copies an activation that already ended, weighted by the chance of it being
+    the last one to succeed. The variance is the first order approximation sum p (1 - p) d^2 over the activations, d
+    being how much the expected score changes with it.
+
+    Notes are at their chart timing, not jittered. Units whose bonuses depend on the skill history or on life are
+    approximated: alternate/mutual/refrain use the unit bonuses of the perfect play, overload/spike always
+    activate and life sparkle uses the life of the perfect play.
+    """
+
+    def __init__(self, simulator, impl, max_subsets=4096):
+        self.simulator = simulator
+        self.impl = impl
+        self.chart = simulator.chart
+        self.base_score = impl.base_score
+        self.weights = np.array(impl.weights)
+        self.max_subsets = max_subsets
+
+        skills = [card.skill for card in impl.live.unit.all_cards()]
+        self.is_encore = [skill.is_encore for skill in skills]
+        # Magic copies the encores of its unit too
+        self.copies_last = [skill.is_encore or skill.is_magic and any(self.is_encore[(idx // 5) * 5:(idx // 5) * 5 + 5])
+                            for idx, skill in enumerate(skills)]
+        self.history_free = not any(skill.is_encore or skill.is_alternate or skill.is_mutual or skill.is_refrain
+                                    or skill.is_ol or skill.is_spike for skill in skills)
+        self.track_life = any(skill.is_sparkle for skill in skills)
+        self.has_amr = any(skill.is_alternate or skill.is_mutual or skill.is_refrain for skill in skills)
+        self.truncated = False
+        self.bonuses = dict()
+
+        self.activation_cards = list()
+        self.activation_times = list()
+        self.probabilities = None
+        self.unit_bonuses = None
+
+    @property
+    def exact(self):
+        """
+        Whether the estimate is the exact expectation for notes at their chart timing.
+        """
+        return self.history_free and not self.track_life and not self.truncated
+
+    def estimate(self):
+        """
+        :return: expected score and its approximate variance
+        """
+        impl = self.impl
+        impl.reset_machine(perfect_play=True, perfect_only=True)
+        impl.initialize_activation_arrays()
+        skill_times = list(impl.skill_times)
+        skill_indices = list(impl.skill_indices)
+        impl.simulate_impl(skip_activation_initialization=True)
+        lives = list(impl.lives)
+        if self.has_amr:
+            self.unit_bonuses = self._get_unit_bonuses(lives)
+
+        note_activations = self._get_note_activations(skill_times, skill_indices)
+        self.probabilities = np.array([impl.probabilities[card_idx] for card_idx in self.activation_cards])
+
+        expected = 0.0
+        deltas = np.zeros(len(self.activation_cards))
+        start = 0
+        for end in range(1, self.chart.note_count + 1):
+            if end < self.chart.note_count and note_activations[end] == note_activations[start]:
+                continue
+            activations = note_activations[start]
+            uncertain = [_ for _ in activations if self.probabilities[_] < 1]
+            notes = np.arange(start, end)
+            subsets, subset_probabilities = self._get_subsets(self.probabilities[uncertain])
+            scores = list()
+            for subset in subsets:
+                succeeded = [_ for _ in activations if _ not in uncertain or subset[uncertain.index(_)]]
+                scores.append(sum(probability * self._get_segment_score(notes, ended, succeeded, lives)
+                                  for ended, probability in self._get_encore_targets(activations, succeeded)))
+            scores = np.array(scores)
+            subset_probabilities = subset_probabilities / subset_probabilities.sum()
+            expected += float(subset_probabilities @ scores)
+            for column, activation in enumerate(uncertain):
+                mask = subsets[:, column]
+                p_on = subset_probabilities[mask].sum()
+                p_off = subset_probabilities[~mask].sum()
+                if p_on > 0 and p_off > 0:
+                    deltas[activation] += (subset_probabilities[mask] @ scores[mask]) / p_on \
+                                          - (subset_probabilities[~mask] @ scores[~mask]) / p_off
+            start = end
+        variance = float((self.probabilities * (1 - self.probabilities) * deltas ** 2).sum())
+        logger.debug("Estimator: {} bonus states evaluated, exact: {}".format(len(self.bonuses), self.exact))
+        return expected, variance
+
+    def _get_note_activations(self, skill_times, skill_indices):
+        """
+        Number the activations in timeline order, keeping their card index and time.
+        :return: the activations covering every note
+        """
+        impl = self.impl
+        active = dict()
+        note_activations = list()
+        event = 0
+        for note_time in self.chart.note_times:
+            while event < len(skill_times):
+                skill_time = skill_times[event]
+                skill_idx = skill_indices[event]
+                if skill_time > note_time:
+                    break
+                if skill_time == note_time and not (skill_idx > 0 and impl.left_inclusive
+                                                    or skill_idx < 0 and not impl.right_inclusive):
+                    break
+                if skill_idx > 0:
+                    active[skill_idx] = len(self.activation_cards)
+                    self.activation_cards.append(skill_idx - 1)
+                    self.activation_times.append(skill_time)
+                else:
+                    active.pop(-skill_idx, None)
+                event += 1
+            note_activations.append(tuple(sorted(active.values())))
+        # Activations after the last note do not cover anything
+        return note_activations
+
+    def _get_unit_bonuses(self, lives):
+        """
+        Replay the skills of the perfect play to get the unit caches alternate, mutual and refrain read before every
+        note.
+        """
+        impl = self.impl
+        impl.reset_machine(perfect_play=True, perfect_only=True)
+        impl.initialize_activation_arrays()
+        unit_bonuses = list()
+        for note_idx, note_time in enumerate(self.chart.note_times):
+            impl.life = lives[note_idx - 1] if note_idx > 0 else impl.live.get_start_life(doublelife=impl.doublelife)
+            while impl.skill_cursor < len(impl.skill_times):
+                skill_time = impl.skill_times[impl.skill_cursor]
+                skill_idx = impl.skill_indices[impl.skill_cursor]
+                if skill_time > note_time:
+                    break
+                if skill_time == note_time and not (skill_idx > 0 and impl.left_inclusive
+                                                    or skill_idx < 0 and not impl.right_inclusive):
+                    break
+                impl.handle_skill()
+            unit_bonuses.append(tuple(tuple(getattr(cache, field) for field in UNIT_CACHE_FIELDS)
+                                      for cache in impl.unit_caches))
+        return unit_bonuses
+
+    def _get_subsets(self, probabilities):
+        """
+        Outcomes of the given activations, all of them or the likeliest ones if there are too many.
+        :return: boolean array of outcomes (success per activation) and their probabilities
+        """
+        count = len(probabilities)
+        if count <= MAX_ENUMERATED_ACTIVATIONS:
+            subsets = ((np.arange(2 ** count)[:, None] >> np.arange(count)) & 1).astype(bool)
+        else:
+            subsets = self._get_likeliest_subsets(probabilities)
+        subset_probabilities = np.where(subsets, probabilities, 1 - probabilities).prod(axis=1)
+        return subsets, subset_probabilities
+
+    def _get_likeliest_subsets(self, probabilities):
+        """
+        Best-first enumeration of outcomes by probability: start from the likeliest outcome of every activation and
+        flip the ones that cost the least probability first.
+        """
+        likeliest = probabilities >= 0.5
+        costs = np.abs(np.log(probabilities) - np.log1p(-probabilities))
+        order = np.argsort(costs)
+        sorted_costs = costs[order]
+        subsets = [likeliest.copy()]
+        mass = float(np.where(likeliest, probabilities, 1 - probabilities).prod())
+        heap = [(sorted_costs[0], (0,))]
+        while heap and len(subsets) < self.max_subsets and mass < MIN_PROBABILITY_MASS:
+            cost, flipped = heapq.heappop(heap)
+            subset = likeliest.copy()
+            subset[order[list(flipped)]] = ~subset[order[list(flipped)]]
+            subsets.append(subset)
+            mass += float(np.where(subset, probabilities, 1 - probabilities).prod())
+            last = flipped[-1]
+            if last + 1 < len(order):
+                heapq.heappush(heap, (cost + sorted_costs[last + 1], flipped + (last + 1,)))
+                heapq.heappush(heap, (cost - sorted_costs[last] + sorted_costs[last + 1], flipped[:-1] + (last + 1,)))
+        if mass < MIN_PROBABILITY_MASS:
+            self.truncated = True
+        return np.array(subsets)
+
+    def _get_encore_targets(self, activations, succeeded):
+        """
+        Ended activations copied by the succeeded encores, when the last activation before them is not in the segment.
+        Magic counts as an encore if its unit has one.
+        :return: list of (ended activations, probability)
+        """
+        choices = [self._get_last_succeeded(self.activation_times[encore], activations, succeeded)
+                   for encore in succeeded if self.copies_last[self.activation_cards[encore]]]
+        targets = list()
+        for choice in product(*choices):
+            ended = tuple(sorted({activation for activation, _ in choice if activation is not None}))
+            targets.append((ended, float(np.prod([probability for _, probability in choice]))))
+        return targets
+
+    def _get_last_succeeded(self, before, activations, succeeded):
+        """
+        Distribution of the last activation to succeed before the given time. Among activations at the same time, the
+        card that comes first wins. The outcomes of the activations of the segment are already known.
+        :return: list of (ended activation or None, probability)
+        """
+        candidates = [_ for _ in range(len(self.activation_cards))
+                      if self.activation_times[_] < before and not self.is_encore[self.activation_cards[_]]]
+        distribution = list()
+        remaining = 1.0
+        idx = len(candidates)
+        while idx > 0 and remaining > 1 - MIN_PROBABILITY_MASS and len(distribution) < MAX_ENCORE_TARGETS:
+            group_time = self.activation_times[candidates[idx - 1]]
+            group = list()
+            while idx > 0 and self.activation_times[candidates[idx - 1]] == group_time:
+                idx -= 1
+                group.append(candidates[idx])
+            none_before = 1.0
+            for activation in sorted(group, key=lambda _: self.activation_cards[_]):
+                if activation in activations:
+                    # Replayed with the segment already, known to have succeeded or not
+                    probability = 1.0 if activation in succeeded else 0.0
+                    target = None
+                else:
+                    probability = float(self.probabilities[activation])
+                    target = activation
+                if probability > 0:
+                    distribution.append((target, remaining * none_before * probability))
+                    none_before *= 1 - probability
+                if none_before == 0:
+                    break
+            remaining *= none_before
+        if remaining > 0:
+            distribution.append((None, remaining))
+        return distribution
+
+    def _get_segment_score(self, notes, ended, activations, lives):
+        """
+        :param ended: activations that ended before the notes, replayed before the ones still active
+        """
+        if self.history_free:
+            history = tuple(sorted(self.activation_cards[_] for _ in activations))
+        else:
+            # Only the order of the activation times matters to the state machine
+            ranks = {activation_time: rank for rank, activation_time in enumerate(
+                sorted({self.activation_times[_] for _ in ended + tuple(activations)}))}
+            events = tuple(sorted([(ranks[self.activation_times[_]], self.activation_cards[_], True) for _ in ended]
+                                  + [(ranks[self.activation_times[_]], self.activation_cards[_], False)
+                                     for _ in activations]))
+            history = (self.unit_bonuses[notes[0]] if self.has_amr else None, events)
+        note_keys, inverse = self._get_note_keys(notes, lives)
+        bonuses = np.array([self._get_bonuses(history, note_key) for note_key in note_keys])[inverse]
+        final_bonus = 1 + bonuses[:, 0] / 100
+        combo = notes > 0
+        final_bonus[combo] *= 1 + bonuses[combo, 1] / 100
+        return np.round(self.base_score * self.weights[notes] * final_bonus).sum()
+
+    def _get_note_keys(self, notes, lives):
+        """
+        :return: distinct (special note types, life) of the notes and the index of every note in them
+        """
+        note_keys = dict()
+        inverse = list()
+        for note in notes.tolist():
+            special_note_types = self.chart.special_note_types[note]
+            life = lives[note] // 10 * 10 if self.track_life else lives[note]
+            inverse.append(note_keys.setdefault((tuple(special_note_types), life), len(note_keys)))
+        return list(note_keys), np.array(inverse, dtype=int)
+
+    def _get_bonuses(self, history, note_key):
+        key = (history, note_key if self.track_life else note_key[0])
+        bonuses = self.bonuses.get(key)
+        if bonuses is None:
+            special_note_types, life = note_key
+            bonuses = self._evaluate(history, list(special_note_types), life)
+            self.bonuses[key] = bonuses
+        return bonuses
+
+    def _evaluate(self, history, special_note_types, life):
+        """
+        Bonuses of a note after the given activations.
+        :param history: card indices of the active cards if the order does not matter, else the unit bonuses before
+        the note and (time rank, card index, ended) of the activations
+        """
+        impl = self.impl
+        if self.history_free:
+            unit_bonuses = None
+            history = [(0, card_idx, False) for card_idx in history]
+        else:
+            unit_bonuses, history = history
+        end_time = len(history) + 1
+        skill_times = list()
+        skill_indices = list()
+        for rank, card_idx, ended in history:
+            skill_times.append(rank)
+            skill_indices.append(card_idx + 1)
+            if ended:
+                skill_times.append(rank)
+                skill_indices.append(-card_idx - 1)
+        # Deactivations of the activations still active are never reached
+        for rank, card_idx, ended in history:
+            if not ended:
+                skill_times.append(end_time)
+                skill_indices.append(-card_idx - 1)
+        impl.skill_times = skill_times
+        impl.skill_indices = skill_indices
+        impl.skill_cursor = 0
+        impl.skill_queue = dict()
+        impl.last_activated_skill = list()
+        impl.last_activated_time = list()
+        impl.has_skill_change = True
+        impl.cache_ls = dict()
+        impl.cache_act = dict()
+        impl.cache_alt = dict()
+        impl.cache_mut = dict()
+        impl.cache_ref = dict()
+        impl.cache_enc = dict()
+        impl.unit_caches = [UnitCacheBonus() for _ in impl.live.unit.all_units]
+        self._set_unit_caches(unit_bonuses)
+        impl.life = life
+        impl.fail_simulate = True
+        while impl.skill_cursor < len(impl.skill_times) and impl.skill_times[impl.skill_cursor] < end_time:
+            impl.handle_skill()
+        # Alternate, mutual and refrain read what the perfect play had, not what the replay got to
+        self._set_unit_caches(unit_bonuses)
+        return impl.evaluate_bonuses(special_note_types, skip_healing=True, fixed_life=life)
+
+    def _set_unit_caches(self, unit_bonuses):
+        if unit_bonuses is None:
+            return
+        for unit_cache, values in zip(self.impl.unit_caches, unit_bonuses):
+            for field, value in zip(UNIT_CACHE_FIELDS, values):
+                setattr(unit_cache, field, value)
@@ -14,7 +14,8 @@ class SimulationEvent:
                  force_encore_amr_cache_to_encore_unit=False,
                  force_encore_magic_to_encore_unit=False,
                  allow_encore_magic_to_escape_max_agg=True,
-                 allow_great=False
+                 allow_great=False,
+                 seed=None
                  ):
         self.uuid = uuid
         self.short_uuid = short_uuid
@@ -41,6 +42,7 @@ class SimulationEvent:
         self.force_encore_magic_to_encore_unit = force_encore_magic_to_encore_unit
         self.allow_encore_magic_to_escape_max_agg = allow_encore_magic_to_escape_max_agg
         self.allow_great = allow_great
+        self.seed = seed
 
 
 class DisplaySimulationResultEvent:
@@ -4,7 +4,6 @@ import threading
 from abc import abstractmethod
 from datetime import datetime
 
-import numpy as np
 from PyQt5.QtCore import QSize, Qt, QMimeData
 from PyQt5.QtGui import QDrag, QFont, QFontMetrics
 from PyQt5.QtWidgets import QHBoxLayout, QAbstractItemView, QTableWidget, QApplication, QTableWidgetItem, \
@@ -625,12 +624,12 @@ class CalculatorModel:
         self.view.fill_column(False, 1, row, int(results.total_life))
         self.view.fill_column(False, 2, row, int(results.perfect_score))
         self.view.fill_column(False, 3, row, int(results.base))
-        self.view.fill_column(False, 4, row, int(results.base + results.deltas.max()))
-        self.view.fill_column(False, 5, row, int(results.base + results.deltas.min()))
+        self.view.fill_column(False, 4, row, int(results.max_score))
+        self.view.fill_column(False, 5, row, int(results.min_score))
         self.view.fill_column(False, 6, row, int(results.fans))
-        self.view.fill_column(False, 7, row, int(results.base + np.percentile(results.deltas, 90)))
-        self.view.fill_column(False, 8, row, int(results.base + np.percentile(results.deltas, 75)))
-        self.view.fill_column(False, 9, row, int(results.base + np.percentile(results.deltas, 50)))
+        self.view.fill_column(False, 7, row, int(results.percentile(90)))
+        self.view.fill_column(False, 8, row, int(results.percentile(75)))
+        self.view.fill_column(False, 9, row, int(results.percentile(50)))
         if results.abuse_data is not None:
             self.view.fill_column(False, 10, row, int(results.abuse_score))
         self.view.fill_column(False, 11, row, float(int(results.full_roll_chance * 10000) / 100))
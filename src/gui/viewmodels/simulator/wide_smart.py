@@ -1,5 +1,6 @@
 from typing import List
 
+import numpy as np
 from PyQt5 import QtWidgets
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QObject
 from PyQt5.QtGui import QIntValidator
@@ -247,6 +248,8 @@ class MainModel(QObject):
             logger.info("Nothing to simulate")
             return
         extra_return = None
+        # All units of a batch share the random trials so their scores differ only because of the units
+        seed = int(np.random.randint(0, 2 ** 31))
 
         # Initialize song first because SQLite DB thread lock
         # Live objects are mutable so create one for each simulation
@@ -314,7 +317,8 @@ class MainModel(QObject):
                                 force_encore_amr_cache_to_encore_unit,
                                 force_encore_magic_to_encore_unit,
                                 allow_encore_magic_to_escape_max_agg,
-                                allow_great
+                                allow_great,
+                                seed
                                 ),
                 high_priority=True, asynchronous=True)
 
@@ -359,7 +363,7 @@ class MainModel(QObject):
                                   special_option=event.special_option, special_value=event.special_value,
                                   doublelife=event.doublelife, abuse=event.theoretical_simulation,
                                   perfect_only=not event.allow_great,
-                                  output=event.theoretical_simulation)
+                                  output=event.theoretical_simulation, seed=event.seed)
         self.process_simulation_results_signal.emit(
             BaseSimulationResultWithUuid(event.uuid, event.unit.all_cards(), result, event.abuse_load))
 
@@ -31,6 +31,8 @@ def setup(update=False):
     music_updater.update_musicscores()
     from network import chart_cache_updater
     chart_cache_updater.update_cache_scores()
+    from logic.music_index import music_index
+    music_index.build()
     from network import image_updater
     assert image_updater
     from logic.profile import profile_manager
@@ -1,9 +1,12 @@
+import copy
+
 import pyximport
 
 from db import db
 from logic.leader import Leader
 from logic.search import card_query
 from logic.skill import Skill
+from masterdata import master_data
 from static.color import Color
 
 pyximport.install(language_level=3)
@@ -87,9 +90,7 @@ class Card:
         for idx, key in enumerate(attributes):
             if potentials[idx] == 0:
                 continue
-            bonuses[idx] += db.masterdb.execute_and_fetchone("""
-                    SELECT value_rare_{} FROM potential_value_{} WHERE potential_level = ?
-                """.format(rarity, key), [potentials[idx]])[0]
+            bonuses[idx] += cls.get_potential_bonus(key, rarity, potentials[idx])
 
         if custom_info is None:
             owned = db.cachedb.execute_and_fetchall("""
@@ -100,6 +101,22 @@ class Card:
         else:
             owned = 1
 
+        return cls.from_data(card_data, potentials, bonuses, owned,
+                             sk=Skill.from_id(card_data['skill_id'], bonuses[4]),
+                             le=Leader.from_id(card_data['leader_skill_id']),
+                             card_id=card_id)
+
+    @classmethod
+    def from_data(cls, card_data, potentials, bonuses, owned, sk, le, card_id=None):
+        """
+        :param card_data: row of card_data
+        :param potentials: vo, vi, da, li, sk potentials
+        :param bonuses: vo, vi, da, li, sk bonuses of the card and its potentials
+        :param owned: number of copies owned, at least 1
+        :param card_id: ID of the card, the ID of card_data if None
+        """
+        if card_id is None:
+            card_id = card_data['id']
         return cls(vo=card_data['vocal_max'] + bonuses[0],
                    vi=card_data['visual_max'] + bonuses[1],
                    da=card_data['dance_max'] + bonuses[2],
@@ -115,12 +132,34 @@ class Card:
                    li_pots=potentials[3],
                    sk_pots=potentials[4],
                    star=owned,
-                   sk=Skill.from_id(card_data['skill_id'], bonuses[4]),
-                   le=Leader.from_id(card_data['leader_skill_id']),
+                   sk=sk,
+                   le=le,
                    color=Color(card_data['attribute'] - 1),
                    card_id=card_id,
                    chara_id=card_data['chara_id'])
 
+    @staticmethod
+    def get_potential_bonus(key, rarity, potential):
+        """
+        :param key: vo, vi, da, li or sk
+        :param rarity: odd rarity of the card
+        :param potential: potential level, at least 1
+        """
+        potential_value = master_data.get("potential_value_{}".format(key), potential)
+        if potential_value is not None:
+            return potential_value["value_rare_{}".format(rarity)]
+        return db.masterdb.execute_and_fetchone("""
+            SELECT value_rare_{} FROM potential_value_{} WHERE potential_level = ?
+        """.format(rarity, key), [potential])[0]
+
+    def copy(self):
+        """
+        Copy without querying the DB. The skill is copied since it is mutated per unit, the leader is shared.
+        """
+        card = copy.copy(self)
+        card.sk = copy.copy(self.sk)
+        return card
+
     def clone_card(self):
         clone_card = Card.from_id(self.card_id)
         clone_card.color = self.color
@@ -157,9 +196,7 @@ class Card:
         for idx, key in enumerate(attributes):
             if potentials[idx] == 0:
                 continue
-            bonuses[idx] += db.masterdb.execute_and_fetchone("""
-                            SELECT value_rare_{} FROM potential_value_{} WHERE potential_level = ?
-                        """.format(rarity, key), [potentials[idx]])[0]
+            bonuses[idx] += self.get_potential_bonus(key, rarity, potentials[idx])
         self.vo = self.base_vo + bonuses[0]
         self.vi = self.base_vi + bonuses[1]
         self.da = self.base_da + bonuses[2]
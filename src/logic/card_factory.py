@@ -0,0 +1,266 @@
+import threading
+from collections import OrderedDict
+
+from db import db
+from logic.card import Card
+from logic.leader import Leader
+from logic.skill import Skill, BOOST_TYPES
+from masterdata import master_data, POTENTIAL_KEYS
+from settings import CARD_PROTOTYPE_CACHE_SIZE
+
+
+def _placeholders(values):
+    return ",".join("?" * len(values))
+
+
+def _custom_info_key(custom_info):
+    if custom_info is None:
+        return None
+    return tuple(sorted(custom_info.items()))
+
+
+class CardFactory:
+    """
+    Builds cards the same as Card.from_id, with the rows of all requested cards fetched in a few batched queries.
+
+    Built cards are kept as prototypes keyed by card ID, potentials and custom info, and only copies of them are
+    handed out. Master data only changes when update_database replaces master.db, which clears the prototypes, so
+    once they are built a unit only needs one query for the potentials and owned numbers of its cards. Skill, leader
+    and potential rows come from the master data snapshot when it has them.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.prototypes = OrderedDict()
+        self.chara_ids = dict()
+
+    def clear(self):
+        with self.lock:
+            self.prototypes.clear()
+            self.chara_ids.clear()
+
+    def get_card(self, card_id, custom_pots=None, custom_info=None):
+        return self.get_cards([card_id], custom_pots, [custom_info])[0]
+
+    def get_cards(self, card_ids, custom_pots=None, custom_infos=None):
+        """
+        :param card_ids: card IDs, None entries stay None
+        :param custom_pots: potentials of all cards, None to use the saved potentials
+        :param custom_infos: custom info of every card as for Card.from_id, None if no card has any
+        :return: a new card for every ID
+        """
+        if custom_pots:
+            assert len(custom_pots) == 5
+            custom_pots = tuple(custom_pots)
+        if custom_infos is None:
+            custom_infos = [None] * len(card_ids)
+        entries = [(int(card_id), custom_info) for card_id, custom_info in zip(card_ids, custom_infos)
+                   if card_id is not None]
+        card_data = dict()
+
+        # Saved potentials are per character, custom cards have their own
+        if not custom_pots:
+            with self.lock:
+                missing = {card_id for card_id, custom_info in entries
+                           if custom_info is None and card_id not in self.chara_ids}
+            card_data.update(self._fetch_card_data(missing))
+            with self.lock:
+                for card_id, data in card_data.items():
+                    self.chara_ids[card_id] = data['chara_id']
+                chara_ids = [self.chara_ids[card_id] if custom_info is None else custom_info["chara_id"]
+                             for card_id, custom_info in entries]
+        else:
+            chara_ids = list()
+        owned, potentials = self._fetch_owned_and_potentials(
+            {card_id for card_id, custom_info in entries if custom_info is None}, set(chara_ids))
+
+        keys = list()
+        for idx, (card_id, custom_info) in enumerate(entries):
+            pots = custom_pots if custom_pots else potentials[chara_ids[idx]]
+            keys.append((card_id, pots, _custom_info_key(custom_info)))
+        with self.lock:
+            prototypes = {key: self.prototypes[key] for key in keys if key in self.prototypes}
+            for key in prototypes:
+                self.prototypes.move_to_end(key)
+        missing = OrderedDict((key, custom_info) for key, (_, custom_info) in zip(keys, entries)
+                              if key not in prototypes)
+        if missing:
+            prototypes.update(self._build(missing, card_data))
+
+        results = iter(keys)
+        cards = list()
+        for card_id in card_ids:
+            if card_id is None:
+                cards.append(None)
+                continue
+            key = next(results)
+            card = prototypes[key].copy()
+            if key[2] is None:
+                card.star = owned[key[0]] if owned[key[0]] != 0 else 1
+            cards.append(card)
+        return cards
+
+    def _build(self, missing, card_data):
+        """
+        :param missing: keys of the prototypes to build to their custom info
+        :param card_data: rows of card_data already fetched
+        """
+        card_data = dict(card_data)
+        card_data.update(self._fetch_card_data({key[0] for key, custom_info in missing.items()
+                                                if custom_info is None and key[0] not in card_data}))
+        plain = [key for key, custom_info in missing.items() if custom_info is None]
+        skills = self._fetch_skill_data({card_data[key[0]]['skill_id'] for key in plain})
+        leaders = self._fetch_leader_data({card_data[key[0]]['leader_skill_id'] for key in plain})
+
+        prototypes = dict()
+        for key, custom_info in missing.items():
+            card_id, pots, _ = key
+            if custom_info is not None:
+                # Custom cards are rare and need their growth parameters, build them as is
+                prototypes[key] = Card.from_id(card_id, pots, custom_info)
+                continue
+            data = card_data[card_id]
+            bonuses = [data['bonus_vocal'], data['bonus_visual'], data['bonus_dance'], data['bonus_hp'], 0]
+            rarity = data['rarity'] if data['rarity'] % 2 == 1 else data['rarity'] - 1
+            for idx, potential_key in enumerate(POTENTIAL_KEYS):
+                if pots[idx] == 0:
+                    continue
+                bonuses[idx] += Card.get_potential_bonus(potential_key, rarity, pots[idx])
+            if data['skill_id'] == 0:
+                skill = Skill.from_id(0, bonuses[4])
+            else:
+                skill_data, boost_values = skills[data['skill_id']]
+                skill = Skill.from_data(skill_data, bonuses[4], boost_values)
+            if data['leader_skill_id'] == 0:
+                leader = Leader.from_id(0)
+            else:
+                leader = Leader.from_data(leaders[data['leader_skill_id']])
+            # The owned number is set on every copy
+            prototypes[key] = Card.from_data(data, pots, bonuses, 1, skill, leader, card_id)
+
+        with self.lock:
+            self.prototypes.update(prototypes)
+            for key in prototypes:
+                self.prototypes.move_to_end(key)
+            while len(self.prototypes) > self.size:
+                self.prototypes.popitem(last=False)
+        return prototypes
+
+    @staticmethod
+    def _fetch_card_data(card_ids):
+        if not card_ids:
+            return dict()
+        card_ids = list(card_ids)
+        rows = db.masterdb.execute_and_fetchall(
+            """
+            SELECT * FROM card_data WHERE id IN ({})
+            """.format(_placeholders(card_ids)),
+            params=card_ids,
+            out_dict=True)
+        return {row['id']: row for row in rows}
+
+    @staticmethod
+    def _fetch_owned_and_potentials(card_ids, chara_ids):
+        """
+        :return: owned number by card ID and potentials by chara ID, in one query
+        """
+        queries = list()
+        params = list()
+        if card_ids:
+            queries.append("SELECT 0, card_id, number, 0, 0, 0, 0 FROM owned_card WHERE card_id IN ({})".format(
+                _placeholders(card_ids)))
+            params.extend(card_ids)
+        if chara_ids:
+            queries.append("SELECT 1, chara_id, vo, vi, da, li, sk FROM potential_cache WHERE chara_id IN ({})".format(
+                _placeholders(chara_ids)))
+            params.extend(chara_ids)
+        owned = dict()
+        potentials = dict()
+        if not queries:
+            return owned, potentials
+        for row in db.cachedb.execute_and_fetchall(" UNION ALL ".join(queries), params=params):
+            if row[0] == 0:
+                owned[row[1]] = row[2]
+            else:
+                potentials[row[1]] = tuple(row[2:])
+        return owned, potentials
+
+    @staticmethod
+    def _fetch_skill_data(skill_ids):
+        """
+        :return: skill_id to the row of Skill._fetch_skill_data_from_db and its boost values
+        """
+        skills = dict()
+        for skill_id in skill_ids:
+            skill_data = master_data.get("skill_data", skill_id)
+            if skill_data is not None:
+                skills[skill_id] = (skill_data, CardFactory._get_boost_values(skill_data))
+        skill_ids = [_ for _ in skill_ids if _ != 0 and _ not in skills]
+        custom = [_ for _ in skill_ids if _ > 5000000]
+        normal = [_ for _ in skill_ids if _ <= 5000000]
+        rows = list()
+        if custom:
+            rows += db.masterdb.execute_and_fetchall(
+                """
+                SELECT skill_data.*,
+                    4 attribute,
+                    probability_type.probability_max,
+                    available_time_type.available_time_max
+                FROM skill_data, probability_type, available_time_type
+                WHERE skill_data.id IN ({}) AND
+                    probability_type.probability_type = skill_data.probability_type AND
+                    available_time_type.available_time_type = skill_data.available_time_type
+                """.format(_placeholders(custom)),
+                params=custom,
+                out_dict=True)
+        if normal:
+            rows += db.masterdb.execute_and_fetchall(
+                """
+                SELECT skill_data.*,
+                    card_data.attribute,
+                    probability_type.probability_max,
+                    available_time_type.available_time_max
+                FROM card_data, skill_data, probability_type, available_time_type
+                WHERE skill_data.id IN ({}) AND
+                    card_data.skill_id = skill_data.id AND
+                    probability_type.probability_type = skill_data.probability_type AND
+                    available_time_type.available_time_type = skill_data.available_time_type
+                """.format(_placeholders(normal)),
+                params=normal,
+                out_dict=True)
+        for row in rows:
+            if row['id'] in skills:
+                continue
+            skills[row['id']] = (row, CardFactory._get_boost_values(row))
+        return skills
+
+    @staticmethod
+    def _get_boost_values(skill_data):
+        if skill_data['skill_type'] not in BOOST_TYPES:
+            return None
+        return Skill._fetch_boost_value_from_db(skill_data['value'])
+
+    @staticmethod
+    def _fetch_leader_data(leader_ids):
+        leaders = dict()
+        for leader_id in leader_ids:
+            leader_data = master_data.get("leader_skill_data", leader_id)
+            if leader_data is not None:
+                leaders[leader_id] = leader_data
+        leader_ids = [_ for _ in leader_ids if _ != 0 and _ not in leaders]
+        if not leader_ids:
+            return leaders
+        rows = db.masterdb.execute_and_fetchall(
+            """
+            SELECT leader_skill_data.*
+            FROM leader_skill_data
+            WHERE id IN ({})
+            """.format(_placeholders(leader_ids)),
+            params=leader_ids,
+            out_dict=True)
+        leaders.update({row['id']: row for row in rows})
+        return leaders
+
+
+card_factory = CardFactory(CARD_PROTOTYPE_CACHE_SIZE)
@@ -20,10 +20,11 @@ class GrandUnit(BaseUnit):
 
     @classmethod
     def from_list(cls, card_list, custom_pots=None):
+        cards = Unit.load_cards(card_list, custom_pots)
         return cls(
-            Unit.from_list(card_list[0:5], custom_pots),
-            Unit.from_list(card_list[5:10], custom_pots),
-            Unit.from_list(card_list[10:15], custom_pots))
+            Unit.from_list(cards[0:5]),
+            Unit.from_list(cards[5:10]),
+            Unit.from_list(cards[10:15]))
 
     def get_unit(self, idx):
         return self._units[idx]
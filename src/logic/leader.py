@@ -2,6 +2,7 @@ import numpy as np
 import pyximport
 
 from db import db
+from masterdata import master_data
 
 pyximport.install(language_level=3)
 
@@ -36,6 +37,9 @@ class Leader:
     def from_id(cls, leader_id):
         if leader_id == 0:
             return cls()  # Default leader with 0 bonus
+        leader_data = master_data.get("leader_skill_data", leader_id)
+        if leader_data is not None:
+            return cls.from_data(leader_data)
         leader_data = db.masterdb.execute_and_fetchone(
             """
             SELECT leader_skill_data.*
@@ -44,7 +48,13 @@ class Leader:
             """,
             params=[leader_id],
             out_dict=True)
+        return cls.from_data(leader_data)
 
+    @classmethod
+    def from_data(cls, leader_data):
+        """
+        :param leader_data: row of leader_skill_data
+        """
         bonuses = np.zeros((5, 3))
         for i in range(2):
             target_attribute_key = "target_attribute_2" if i == 1 else "target_attribute"
@@ -7,10 +7,13 @@ import pandas as pd
 import pyximport
 
 import customlogger as logger
+from chartstore import chart_store
 from db import db
 from exceptions import NoLiveFoundException
+from logic.music_index import music_index
 from logic.search import card_query
 from logic.unit import BaseUnit, Unit
+from masterdata import master_data
 from settings import MUSICSCORES_PATH
 from static.appeal_presets import APPEAL_PRESETS
 from static.color import Color
@@ -47,6 +50,24 @@ def classify_note_vectorized(row):
         NoteType.TAP, NoteType.SLIDE, NoteType.FLICK, NoteType.FLICK, NoteType.DAMAGE], mode="clip")
 
 
+def parse_chart(csv_data, difficulty):
+    """
+    :param csv_data: chart CSV blob of a musicscores database
+    :return: notes without damage and hidden notes, and the duration of the chart
+    """
+    notes_data = pd.read_csv(io.StringIO(csv_data.decode()))
+    duration = notes_data.iloc[-1]['sec']
+    if difficulty == 6:
+        notes_data = notes_data[
+            (notes_data["type"] < 8) & ((notes_data["visible"].isna()) | (notes_data["visible"] >= 0))].reset_index(
+            drop=True)
+    else:
+        notes_data = notes_data[notes_data["type"] < 8].reset_index(drop=True)
+    notes_data = notes_data.drop(["id"], axis=1)
+    notes_data['note_type'] = classify_note_vectorized(notes_data)
+    return notes_data, duration
+
+
 def get_score_color(score_id):
     color = db.masterdb.execute_and_fetchall("SELECT live_data.type FROM live_data WHERE live_data.id = ?",
                                              [score_id])
@@ -57,7 +78,11 @@ def fetch_chart(base_music_name, base_score_id, base_difficulty, event=False, sk
     assert base_difficulty in Difficulty
     difficulty = base_difficulty.value
 
-    if not base_score_id:
+    if not base_score_id and not ("%" in base_music_name or "_" in base_music_name):
+        music_name = base_music_name.strip()
+        score_ids = music_index.find(music_name, difficulty, event)
+    elif not base_score_id:
+        # Names with LIKE wildcards of their own are matched by the master DB
         event_test_conditions = (int(event), int(not event))
         music_name = base_music_name.strip()
         music_name_test_conditions = [music_name] + ["{}%{}".format(music_name[:i], music_name[i + 1:])
@@ -76,6 +101,8 @@ def fetch_chart(base_music_name, base_score_id, base_difficulty, event=False, sk
                 )
                 if score_ids:
                     break
+            if score_ids:
+                break
     else:
         if difficulty is not None:
             score_ids = db.masterdb.execute_and_fetchall(
@@ -87,8 +114,14 @@ def fetch_chart(base_music_name, base_score_id, base_difficulty, event=False, sk
                 """, [base_score_id, difficulty]
             )
 
+    flag = False
+    stored = None
     for score_id, color, level in score_ids:
-        flag = False
+        # Charts converted by the music updater are loaded without opening their musicscores database
+        stored = chart_store.get(score_id, difficulty)
+        if stored is not None:
+            flag = True
+            break
         with db.CustomDB(MUSICSCORES_PATH / "musicscores_m{:03d}.db".format(score_id)) as score_conn:
             row_data = score_conn.execute_and_fetchone(
                 """
@@ -104,16 +137,10 @@ def fetch_chart(base_music_name, base_score_id, base_difficulty, event=False, sk
         raise NoLiveFoundException("Music {} difficulty {} not found".format(music_name, str(base_difficulty)))
     if skip_load_notes:
         return None, Color(color - 1), level, None
-    notes_data = pd.read_csv(io.StringIO(row_data[1].decode()))
-    duration = notes_data.iloc[-1]['sec']
-    if difficulty == 6:
-        notes_data = notes_data[
-            (notes_data["type"] < 8) & ((notes_data["visible"].isna()) | (notes_data["visible"] >= 0))].reset_index(
-            drop=True)
+    if stored is not None:
+        notes_data, duration = stored
     else:
-        notes_data = notes_data[notes_data["type"] < 8].reset_index(drop=True)
-    notes_data = notes_data.drop(["id"], axis=1)
-    notes_data['note_type'] = notes_data.apply(classify_note, axis=1)
+        notes_data, duration = parse_chart(row_data[1], difficulty)
     return notes_data, Color(color - 1), level, duration
 
 
@@ -389,9 +416,7 @@ class Live(BaseLive):
         elif self.special_option == APPEAL_PRESETS["Scale with Life"]:
             life_bonuses = 1 + self.bonuses[:, 3, :] / 100
             total_life = np.ceil(self.unit.base_attributes[:, 3, :] * life_bonuses).sum()
-            booth_life_value = db.masterdb.execute_and_fetchall("""
-                SELECT param, value FROM carnival_booth_life_value ORDER BY param
-            """)
+            booth_life_value = master_data.fetch_all("carnival_booth_life_value")
             last_bonus = 0
             for life, bonus in booth_life_value[1:]:
                 if total_life < life:
@@ -400,9 +425,7 @@ class Live(BaseLive):
                 else:
                     last_bonus = bonus - 100
         elif self.special_option == APPEAL_PRESETS["Scale with Star Rank"]:
-            starrank_value = db.masterdb.execute_and_fetchall("""
-                SELECT param, value_1, value_2, value_3, value_4 FROM carnival_booth_starrank_value ORDER BY param
-            """)
+            starrank_value = master_data.fetch_all("carnival_booth_starrank_value")
             starrank_value_array = list()
             for i in range(20):
                 temp = list()
@@ -0,0 +1,95 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+import customlogger as logger
+from db import db
+
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+_MAX_CHAR = chr(0x10FFFF)
+
+
+def normalize_name(name):
+    """
+    Same case folding as SQLite LIKE, which only folds ASCII letters.
+    """
+    return name.translate(_ASCII_LOWER)
+
+
+class MusicIndex:
+    """
+    Lives of every music name, to look charts up by name without querying the master DB.
+
+    Names match the same way as the LIKE patterns fetch_chart used to query: the name itself first, then the name with
+    one character replaced by a wildcard, i.e. any name with the same prefix and suffix around it. Names are kept
+    sorted forwards and reversed, so the names with a prefix or a suffix are a range found by bisection.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lives = None  # Normalized name to (live ID, color, level, event type, difficulty) of its lives
+        self.names = None
+        self.reversed_names = None
+
+    def build(self):
+        with self.lock:
+            self._build()
+
+    def _build(self):
+        rows = db.masterdb.execute_and_fetchall(
+            """
+            SELECT music_data.name, live_data.id, live_data.type, live_detail.level_vocal, live_data.event_type,
+                   live_detail.difficulty_type
+            FROM music_data
+            INNER JOIN live_data ON live_data.music_data_id = music_data.id
+            INNER JOIN live_detail ON live_detail.live_data_id = live_data.id
+            """
+        )
+        lives = defaultdict(list)
+        for name, live_id, color, level, event_type, difficulty in rows:
+            lives[normalize_name(name)].append((live_id, color, level, event_type, difficulty))
+        self.lives = dict(lives)
+        self.names = sorted(lives)
+        self.reversed_names = sorted(name[::-1] for name in lives)
+        logger.debug("Indexed {} music names".format(len(self.names)))
+
+    def find(self, music_name, difficulty, event=False):
+        """
+        :param difficulty: difficulty value
+        :param event: look for event lives before the others
+        :return: (live ID, color, level) of the lives of the first matching names with the difficulty, empty if none
+        """
+        name = normalize_name(music_name.strip())
+        with self.lock:
+            if self.lives is None:
+                self._build()
+            candidates = [[name] if name in self.lives else []]
+            for idx in range(len(name)):
+                candidates.append(self._find_names(name[:idx], name[idx + 1:]))
+            for names in candidates:
+                for event_type in (int(event), int(not event)):
+                    score_ids = sorted(
+                        (live_id, color, level)
+                        for _ in names
+                        for live_id, color, level, live_event_type, live_difficulty in self.lives[_]
+                        if live_event_type >= event_type and live_difficulty == difficulty
+                    )
+                    if score_ids:
+                        return score_ids
+        return []
+
+    def _find_names(self, prefix, suffix):
+        low = bisect_left(self.names, prefix)
+        high = bisect_left(self.names, prefix + _MAX_CHAR)
+        reversed_suffix = suffix[::-1]
+        reversed_low = bisect_left(self.reversed_names, reversed_suffix)
+        reversed_high = bisect_left(self.reversed_names, reversed_suffix + _MAX_CHAR)
+        if high - low <= reversed_high - reversed_low:
+            names = [_ for _ in self.names[low:high] if _.endswith(suffix)]
+        else:
+            names = [_[::-1] for _ in self.reversed_names[reversed_low:reversed_high]]
+            names = [_ for _ in names if _.startswith(prefix)]
+        return [_ for _ in names if len(_) >= len(prefix) + len(suffix)]
+
+
+music_index = MusicIndex()
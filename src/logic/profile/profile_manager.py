@@ -30,14 +30,14 @@ def import_from_gameid(game_id):
         card_dict = defaultdict(int)
         for card in cards:
             card_dict[card] += 1
-        for card_id, number in card_dict.items():
-            z = list(zip(*db.cachedb.execute_and_fetchall("SELECT number FROM owned_card WHERE card_id = ? OR card_id = ?", [card_id, card_id - 1])))[0]
-            if z[0] + z[1] < number:
-                db.cachedb.execute("""
-                    INSERT OR REPLACE INTO owned_card (card_id, number)
-                    VALUES (?,?)
-                """, [card_id, number - z[0]])
-        db.cachedb.commit()
+        with db.cachedb.transaction():
+            for card_id, number in card_dict.items():
+                z = list(zip(*db.cachedb.execute_and_fetchall("SELECT number FROM owned_card WHERE card_id = ? OR card_id = ?", [card_id, card_id - 1])))[0]
+                if z[0] + z[1] < number:
+                    db.cachedb.execute("""
+                        INSERT OR REPLACE INTO owned_card (card_id, number)
+                        VALUES (?,?)
+                    """, [card_id, number - z[0]])
         logger.info("Imported {} cards successfully".format(len(card_dict)))
         return list(card_dict.keys())
     except:
@@ -141,6 +141,7 @@ class ProfileManager:
                     INSERT OR REPLACE INTO personal_units (unit_name, grand, cards)
                     VALUES (?,?,?)
                 """, row)
+        db.cachedb.commit()
 
     def _write_units(self):
         personal_units = db.cachedb.execute_and_fetchall("SELECT * FROM personal_units", out_dict=True)
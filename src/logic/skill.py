@@ -1,7 +1,10 @@
+from operator import attrgetter
+
 import numpy as np
 import pyximport
 
 from db import db
+from masterdata import master_data
 from static.color import Color
 from static.note_type import NoteType
 from static.skill import SKILL_BASE
@@ -15,8 +18,34 @@ COMBO_SUPPORT_TYPES = {9, 14}
 COMMON_TIMERS = [(7, 4.5, 'h'), (9, 6, 'h'), (11, 7.5, 'h'), (12, 7.5, 'm'),
                  (6, 4.5, 'm'), (9, 7.5, 'm'), (11, 9, 'm'), (13, 9, 'h')]
 
+# Skill type flags, computed once per skill
+FLAG_SUPPORT = 1 << 0
+FLAG_GUARD = 1 << 1
+FLAG_OL = 1 << 2
+FLAG_CC = 1 << 3
+FLAG_ENCORE = 1 << 4
+FLAG_FOCUS = 1 << 5
+FLAG_SPARKLE = 1 << 6
+FLAG_TUNING = 1 << 7
+FLAG_MOTIF = 1 << 8
+FLAG_ALTERNATE = 1 << 9
+FLAG_REFRAIN = 1 << 10
+FLAG_MAGIC = 1 << 11
+FLAG_MUTUAL = 1 << 12
+FLAG_OD = 1 << 13
+FLAG_SPIKE = 1 << 14
+FLAG_AMR = FLAG_ALTERNATE | FLAG_MUTUAL | FLAG_REFRAIN
+TYPE_FLAGS = {5: FLAG_SUPPORT, 6: FLAG_SUPPORT, 7: FLAG_SUPPORT, 12: FLAG_GUARD, 14: FLAG_OL, 15: FLAG_CC,
+              16: FLAG_ENCORE, 21: FLAG_FOCUS, 22: FLAG_FOCUS, 23: FLAG_FOCUS, 25: FLAG_SPARKLE, 31: FLAG_TUNING,
+              35: FLAG_MOTIF, 36: FLAG_MOTIF, 37: FLAG_MOTIF, 39: FLAG_ALTERNATE, 40: FLAG_REFRAIN, 41: FLAG_MAGIC,
+              42: FLAG_MUTUAL, 43: FLAG_OD, 44: FLAG_SPIKE}
+
 
 class Skill:
+    __slots__ = ("color", "duration", "probability", "cached_probability", "max_probability", "interval", "values",
+                 "offset", "boost", "color_target", "act", "skill_type", "min_requirements", "max_requirements",
+                 "song_color_requirement", "life_requirement", "targets", "original_unit_idx", "flags")
+
     def __init__(self, color=Color.CUTE, duration=0, probability=0, interval=999,
                  values=None, v0=0, v1=0, v2=0, v3=0, offset=0,
                  boost=False, color_target=False, act=None, bonus_skill=2000, skill_type=None,
@@ -40,8 +69,10 @@ class Skill:
         self.cached_probability = self.probability
         self.max_probability = probability
         self.interval = interval
-        self.v0, self.v1, self.v2, self.v3 = tuple(values)
-        self.values = [self.v0, self.v1, self.v2, self.v3]
+        if values is None:
+            values = (v0, v1, v2, v3)
+        self.values = tuple(values)
+        assert len(self.values) == 4
         self.offset = offset
         self.boost = boost
         self.color_target = color_target
@@ -52,8 +83,36 @@ class Skill:
         self.song_color_requirement = song_color_requirement
         self.life_requirement = life_requirement
         self.targets = self._generate_targets()
-        self.normalized = False
         self.original_unit_idx = None
+        self.flags = TYPE_FLAGS.get(skill_type, 0)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        # Skills pickled before __slots__ also carry v0..v3 and normalized, which are derived or unused now
+        for name in self.__slots__:
+            if name in state:
+                setattr(self, name, state[name])
+        self.values = tuple(state["values"])
+        self.original_unit_idx = state.get("original_unit_idx")
+        self.flags = TYPE_FLAGS.get(self.skill_type, 0)
+
+    @property
+    def v0(self):
+        return self.values[0]
+
+    @property
+    def v1(self):
+        return self.values[1]
+
+    @property
+    def v2(self):
+        return self.values[2]
+
+    @property
+    def v3(self):
+        return self.values[3]
 
     def set_original_unit_idx(self, idx):
         self.original_unit_idx = idx
@@ -69,66 +128,69 @@ class Skill:
 
     @property
     def is_support(self):
-        return self.skill_type in SUPPORT_TYPES
+        return bool(self.flags & FLAG_SUPPORT)
 
     @property
     def is_guard(self):
-        return self.skill_type == 12
+        return bool(self.flags & FLAG_GUARD)
 
     @property
     def is_ol(self):
-        return self.skill_type == 14
+        return bool(self.flags & FLAG_OL)
 
     @property
     def is_cc(self):
-        return self.skill_type == 15
+        return bool(self.flags & FLAG_CC)
 
     @property
     def is_encore(self):
-        return self.skill_type == 16
+        return bool(self.flags & FLAG_ENCORE)
 
     @property
     def is_focus(self):
-        return 21 <= self.skill_type <= 23
+        return bool(self.flags & FLAG_FOCUS)
 
     @property
     def is_sparkle(self):
-        return self.skill_type == 25
+        return bool(self.flags & FLAG_SPARKLE)
 
     @property
     def is_tuning(self):
-        return self.skill_type == 31
+        return bool(self.flags & FLAG_TUNING)
 
     @property
     def is_motif(self):
-        return 35 <= self.skill_type <= 37
+        return bool(self.flags & FLAG_MOTIF)
 
     @property
     def is_alternate(self):
-        return self.skill_type == 39
+        return bool(self.flags & FLAG_ALTERNATE)
 
     @property
     def is_refrain(self):
-        return self.skill_type == 40
+        return bool(self.flags & FLAG_REFRAIN)
 
     @property
     def is_magic(self):
-        return self.skill_type == 41
+        return bool(self.flags & FLAG_MAGIC)
 
     @property
     def is_mutual(self):
-        return self.skill_type == 42
+        return bool(self.flags & FLAG_MUTUAL)
 
     @property
     def is_od(self):
-        return self.skill_type == 43
+        return bool(self.flags & FLAG_OD)
 
     @property
     def is_spike(self):
-        return self.skill_type == 44
+        return bool(self.flags & FLAG_SPIKE)
 
     @classmethod
     def _fetch_skill_data_from_db(cls, skill_id):
+        skill_data = master_data.get("skill_data", skill_id)
+        if skill_data is not None:
+            return skill_data
         if skill_id > 5000000:
             return db.masterdb.execute_and_fetchone(
                 """
@@ -161,6 +223,9 @@ class Skill:
 
     @classmethod
     def _fetch_boost_value_from_db(cls, skill_value):
+        values = master_data.get("skill_boost_values", skill_value)
+        if values is not None:
+            return list(values)
         values = db.masterdb.execute_and_fetchone(
             """
             SELECT  sbt1.boost_value_1 as v0, 
@@ -204,7 +269,17 @@ class Skill:
         if skill_id == 0:
             return cls(values=[0, 0, 0, 0])  # Default skill that has 0 duration
         skill_data = cls._fetch_skill_data_from_db(skill_id)
+        boost_values = None
+        if skill_data['skill_type'] in BOOST_TYPES:
+            boost_values = cls._fetch_boost_value_from_db(skill_data['value'])
+        return cls.from_data(skill_data, bonus_skill, boost_values)
 
+    @classmethod
+    def from_data(cls, skill_data, bonus_skill=2000, boost_values=None):
+        """
+        :param skill_data: row as fetched by _fetch_skill_data_from_db
+        :param boost_values: values as fetched by _fetch_boost_value_from_db, for boost skills
+        """
         min_requirements, max_requirements, song_color_requirement = None, None, None
         if skill_data['skill_trigger_type'] == 2:
             min_requirements = np.array([0, 0, 0])
@@ -221,7 +296,7 @@ class Skill:
 
         is_boost = skill_data['skill_type'] in BOOST_TYPES
         if is_boost:
-            values = cls._fetch_boost_value_from_db(skill_data['value'])
+            values = list(boost_values)
         else:
             values = cls._handle_skill_type(skill_data['skill_type'],
                                             (skill_data['value'], skill_data['value_2'], skill_data['value_3']))
@@ -254,3 +329,34 @@ class Skill:
                                                   self.v0, self.v1, self.v2, self.v3)
         except:
             return None
+
+
+class ActiveSkill:
+    """
+    A skill while it is active in the state machine. The Skill it was activated from is shared and never mutated,
+    only v0, v1 and normalized change during the activation. Everything else is read from the Skill.
+    """
+    __slots__ = ("skill", "v0", "v1", "normalized")
+
+    def __init__(self, skill: Skill):
+        self.skill = skill
+        self.v0 = skill.v0
+        self.v1 = skill.v1
+        self.normalized = False
+
+    def __eq__(self, other):
+        if isinstance(other, ActiveSkill):
+            other = other.skill
+        return self.skill == other
+
+    def __str__(self):
+        return str(self.skill)
+
+
+# Everything but v0, v1 and normalized is read from the shared Skill
+for _name in ("flags", "color", "duration", "probability", "cached_probability", "max_probability", "interval", "v2", "v3",
+              "values", "offset", "boost", "color_target", "act", "skill_type", "min_requirements", "max_requirements",
+              "song_color_requirement", "life_requirement", "targets", "original_unit_idx",
+              "is_support", "is_guard", "is_ol", "is_cc", "is_encore", "is_focus", "is_sparkle", "is_tuning",
+              "is_motif", "is_alternate", "is_refrain", "is_magic", "is_mutual", "is_od", "is_spike"):
+    setattr(ActiveSkill, _name, property(attrgetter("skill." + _name)))
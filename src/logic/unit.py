@@ -3,10 +3,11 @@ from abc import ABC, abstractmethod
 import numpy as np
 import pyximport
 
-from db import db
 from exceptions import InvalidUnit
 from logic.card import Card
+from logic.card_factory import card_factory
 from logic.search import card_query
+from masterdata import master_data
 from static.color import Color
 
 pyximport.install(language_level=3)
@@ -71,12 +72,21 @@ class Unit(BaseUnit):
     def from_list(cls, cards, custom_pots=None):
         if len(cards) < 5 or len(cards) > 6:
             raise InvalidUnit("Invalid number of cards: {}".format(cards))
+        return cls(*cls.load_cards(cards, custom_pots))
+
+    @staticmethod
+    def load_cards(cards, custom_pots=None):
+        """
+        Cards of a list of cards and card IDs, the IDs are built together by the card factory.
+        """
+        cards = [int(card) if isinstance(card, str) else card for card in cards]
+        card_ids = [card for card in cards if isinstance(card, int)]
+        built = iter(card_factory.get_cards(card_ids, custom_pots))
         results = list()
-        for c_idx, card in enumerate(cards):
-            if isinstance(card, str):
-                card = int(card)
+        for card in cards:
             if isinstance(card, int):
-                card = Card.from_id(card, custom_pots)
+                results.append(next(built))
+                continue
             if card is not None:
                 assert isinstance(card, Card)
             if card is not None and custom_pots is not None:
@@ -87,7 +97,7 @@ class Unit(BaseUnit):
                 card.sk_pots = custom_pots[4]
                 card.refresh_values()
             results.append(card)
-        return cls(*results)
+        return results
 
     def get_card(self, idx):
         return self._cards[idx]
@@ -212,11 +222,8 @@ class Unit(BaseUnit):
         self.motif_visual = self._get_motif_visual()
         self.motif_visual_trimmed = self.motif_visual // 1000
 
-        self._motif_values_wide = [_[0] for _ in
-                                   db.masterdb.execute_and_fetchall(
-                                       "SELECT type_01_value FROM skill_motif_value_grand")]
-        self._motif_values_grand = [_[0] for _ in
-                                    db.masterdb.execute_and_fetchall("SELECT type_01_value FROM skill_motif_value")]
+        self._motif_values_wide = [_[0] for _ in master_data.fetch_all("skill_motif_value_grand")]
+        self._motif_values_grand = [_[0] for _ in master_data.fetch_all("skill_motif_value")]
 
         if self.motif_vocal_trimmed >= len(self._motif_values_wide):
             self.motif_vocal_trimmed = len(self._motif_values_wide) - 1
@@ -0,0 +1,204 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+
+import customlogger as logger
+from db import db
+from settings import MASTER_SNAPSHOT_PATH, MASTERDB_PATH
+from utils import storage
+
+SNAPSHOT_VERSION = 1
+
+# Tables kept as their rows, in the order of the query
+QUERIES = {
+    "skill_life_value": "SELECT life_value / 10, type_01_value, type_02_value FROM skill_life_value "
+                        "ORDER BY life_value",
+    "skill_life_value_grand": "SELECT life_value / 10, type_01_value, type_02_value FROM skill_life_value_grand "
+                              "ORDER BY life_value",
+    "skill_motif_value": "SELECT type_01_value FROM skill_motif_value",
+    "skill_motif_value_grand": "SELECT type_01_value FROM skill_motif_value_grand",
+    "carnival_booth_life_value": "SELECT param, value FROM carnival_booth_life_value ORDER BY param",
+    "carnival_booth_starrank_value": "SELECT param, value_1, value_2, value_3, value_4 "
+                                     "FROM carnival_booth_starrank_value ORDER BY param",
+}
+POTENTIAL_KEYS = ('vo', 'vi', 'da', 'li', 'sk')
+
+
+def _hash_file(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fr:
+        for chunk in iter(lambda: fr.read(1 << 20), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _fetch_skill_data():
+    rows = db.masterdb.execute_and_fetchall(
+        """
+        SELECT skill_data.*,
+            card_data.attribute,
+            probability_type.probability_max,
+            available_time_type.available_time_max
+        FROM card_data, skill_data, probability_type, available_time_type
+        WHERE card_data.skill_id = skill_data.id AND
+            skill_data.id <= 5000000 AND
+            probability_type.probability_type = skill_data.probability_type AND
+            available_time_type.available_time_type = skill_data.available_time_type
+        """,
+        out_dict=True)
+    rows += db.masterdb.execute_and_fetchall(
+        """
+        SELECT skill_data.*,
+            4 attribute,
+            probability_type.probability_max,
+            available_time_type.available_time_max
+        FROM skill_data, probability_type, available_time_type
+        WHERE skill_data.id > 5000000 AND
+            probability_type.probability_type = skill_data.probability_type AND
+            available_time_type.available_time_type = skill_data.available_time_type
+        """,
+        out_dict=True)
+    skills = dict()
+    for row in rows:
+        skills.setdefault(row['id'], dict(row))
+    return skills
+
+
+def _fetch_skill_boost_values():
+    rows = db.masterdb.execute_and_fetchall(
+        """
+        SELECT  sbt1.skill_value,
+                sbt1.boost_value_1 as v0,
+                sbt1.boost_value_2 as v1,
+                sbt1.boost_value_3 as v2,
+                sbt2.boost_value_2 as v3
+        FROM    skill_boost_type as sbt1,
+                skill_boost_type as sbt2
+        WHERE   sbt1.target_type = 26
+        AND     sbt2.skill_value = sbt1.skill_value
+        AND     sbt2.target_type = 31
+        """)
+    boost_values = dict()
+    for skill_value, *values in rows:
+        boost_values.setdefault(skill_value, values)
+    return boost_values
+
+
+def _fetch_leader_skill_data():
+    rows = db.masterdb.execute_and_fetchall("SELECT * FROM leader_skill_data", out_dict=True)
+    return {row['id']: dict(row) for row in rows}
+
+
+def _fetch_potential_values(key):
+    rows = db.masterdb.execute_and_fetchall("SELECT * FROM potential_value_{}".format(key), out_dict=True)
+    return {row['potential_level']: dict(row) for row in rows}
+
+
+# Tables kept as dicts, to look rows up by key
+FETCHERS = {
+    "skill_data": _fetch_skill_data,
+    "skill_boost_values": _fetch_skill_boost_values,
+    "leader_skill_data": _fetch_leader_skill_data,
+}
+FETCHERS.update({
+    "potential_value_{}".format(key): lambda key=key: _fetch_potential_values(key)
+    for key in POTENTIAL_KEYS
+})
+
+
+class MasterData:
+    """
+    Snapshot of the master data read by simulations, pickled in one file next to master.db so it is loaded in one read
+    instead of many small queries. The snapshot is keyed by the hash of master.db, a missing, stale or older version
+    snapshot is rebuilt from the DB.
+
+    Tables missing from master.db are left out of the snapshot, readers fall back to querying the DB for anything the
+    snapshot does not have.
+    """
+
+    def __init__(self, path, masterdb_path):
+        self.path = path
+        self.masterdb_path = masterdb_path
+        self.lock = threading.Lock()
+        self.data = None
+        self.masterdb_stat = None
+
+    def get(self, name, key=None):
+        """
+        :param name: table name as in QUERIES or FETCHERS
+        :param key: key of the row, None for the whole table
+        :return: the rows or the row, None if not in the snapshot
+        """
+        with self.lock:
+            self._load()
+            table = self.data.get(name)
+        if table is None or key is None:
+            return table
+        return table.get(key)
+
+    def fetch_all(self, name):
+        """
+        Rows of one of QUERIES, from the DB if not in the snapshot.
+        """
+        rows = self.get(name)
+        if rows is None:
+            rows = db.masterdb.execute_and_fetchall(QUERIES[name])
+        return rows
+
+    def close(self):
+        with self.lock:
+            self.data = None
+            self.masterdb_stat = None
+
+    def _load(self):
+        stat = os.stat(self.masterdb_path)
+        stat = (stat.st_size, stat.st_mtime_ns)
+        if self.data is not None and stat == self.masterdb_stat:
+            return
+        master_hash = _hash_file(self.masterdb_path)
+        data = self._read()
+        if data is None or data.get("version") != SNAPSHOT_VERSION or data.get("master_hash") != master_hash:
+            data = self._build(master_hash)
+            self._write(data)
+        self.data = data
+        self.masterdb_stat = stat
+
+    def _read(self):
+        if not self.path.exists():
+            return None
+        try:
+            with open(self.path, "rb") as fr:
+                data = pickle.loads(fr.read())
+        except Exception as e:
+            logger.debug("Failed to read master data snapshot: {}".format(e))
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _build(self, master_hash):
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "master_hash": master_hash,
+        }
+        for name, query in QUERIES.items():
+            try:
+                data[name] = db.masterdb.execute_and_fetchall(query)
+            except sqlite3.OperationalError as e:
+                logger.debug("Master data snapshot without {}: {}".format(name, e))
+        for name, fetcher in FETCHERS.items():
+            try:
+                data[name] = fetcher()
+            except sqlite3.OperationalError as e:
+                logger.debug("Master data snapshot without {}: {}".format(name, e))
+        logger.info("Master data snapshot built for master.db {}".format(master_hash))
+        return data
+
+    def _write(self, data):
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with storage.get_writer(temp_path, "wb") as fwb:
+            pickle.dump(data, fwb, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, self.path)
+
+
+master_data = MasterData(MASTER_SNAPSHOT_PATH, MASTERDB_PATH)
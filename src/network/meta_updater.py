@@ -56,7 +56,13 @@ def get_cachedb_path():
 
 def update_database():
     _update_manifest()
+    # Connections to master.db assume it never changes, reconnect once it is replaced
+    from db import db
+    db.masterdb.close()
     _update_masterdb()
+    # Card prototypes were built from the old master.db
+    from logic.card_factory import card_factory
+    card_factory.clear()
 
 
 if __name__ == '__main__':
@@ -1,7 +1,10 @@
 import logging
+import re
 
 import customlogger as logger
+from chartstore import chart_store
 from db import db
+from logic.live import parse_chart
 from network import cgss_query
 from network import meta_updater
 from settings import MANIFEST_PATH, MUSICSCORES_PATH
@@ -25,6 +28,40 @@ def _initialize_score_cache_db():
     db.cachedb.commit()
 
 
+def _update_chart_store(all_musicscores, changed_scores):
+    """
+    Convert the charts of new and updated musicscores into the chart store, all of them if there is no store yet.
+    """
+    if chart_store.exists():
+        changed_scores = set(changed_scores)
+    else:
+        changed_scores = set(all_musicscores)
+    if not changed_scores:
+        return
+    charts = dict()
+    for live_id, difficulty in chart_store.keys():
+        musicscore_name = "musicscores_m{:03d}".format(live_id)
+        if musicscore_name in all_musicscores and musicscore_name not in changed_scores:
+            charts[(live_id, difficulty)] = chart_store.get(live_id, difficulty)
+    logger.info("Converting {} musicscores into the chart store...".format(len(changed_scores)))
+    for musicscore_name in changed_scores:
+        path = MUSICSCORES_PATH / "{}.db".format(musicscore_name)
+        if not storage.exists(path):
+            continue
+        with db.CustomDB(path) as score_conn:
+            blobs = score_conn.execute_and_fetchall("SELECT * FROM blobs")
+        for blob in blobs:
+            match = re.fullmatch(r"musicscores/m\d+/(\d+)_(\d+)\.csv", blob[0])
+            if match is None:
+                continue
+            live_id, difficulty = int(match.group(1)), int(match.group(2))
+            try:
+                charts[(live_id, difficulty)] = parse_chart(blob[1], difficulty)
+            except (KeyError, IndexError, ValueError):
+                logger.debug("Cannot convert chart {} difficulty {}".format(live_id, difficulty))
+    chart_store.write(charts)
+
+
 def update_musicscores():
     logger.debug("Updating all musicscores")
     if not storage.exists(MANIFEST_PATH):
@@ -37,6 +74,7 @@ def update_musicscores():
             """)
         all_musicscores = {_[0].split(".")[0]: _[1] for _ in all_musicscores}
 
+    deleted_scores = set()
     if not _score_cache_db_exists():
         _initialize_score_cache_db()
         new_scores = all_musicscores.keys()
@@ -73,6 +111,7 @@ def update_musicscores():
             VALUES (?,?)
         """, [musicscore_name, musicscore_hash])
     db.cachedb.commit()
+    _update_chart_store(all_musicscores, set(new_scores).union(set(updated_scores)).union(deleted_scores))
     logger.info("All musicscores updated")
 
 
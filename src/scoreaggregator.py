@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+
+
+class ScoreAggregator:
+    """
+    Online summary of trial scores: count, mean, variance, min and max, a quantile sketch and an optional fixed-bin
+    histogram. Aggregators of disjoint trials can be merged, e.g. the ones returned by worker processes.
+
+    The sketch keeps counts of logarithmic buckets, so any quantile is within relative_accuracy of an actual score.
+
+    Given the trial index of every score, it also keeps the trials of the min and max scores, so they can be replayed
+    without keeping per trial data.
+
+    Trials drawn with variance reduction are not independent within their block, so block totals are kept to estimate
+    the effective sample size from the spread of the block means.
+    """
+
+    def __init__(self, relative_accuracy=1E-4, histogram_bin_width=None, keep_scores=False, block_size=None):
+        """
+        :param relative_accuracy: relative error bound of quantiles
+        :param histogram_bin_width: width of the histogram bins in points, None to skip the histogram
+        :param keep_scores: also keep every score in trial order, e.g. to get the exact deltas
+        :param block_size: trials per block of dependent draws, None if trials are independent
+        """
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.histogram_bin_width = histogram_bin_width
+        self.count = 0
+        self.total = 0  # Exact sum, scores are integers
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.min_trial = None
+        self.max_trial = None
+        self.buckets = dict()
+        self.zero_count = 0
+        self.bins = dict() if histogram_bin_width is not None else None
+        self.scores = list() if keep_scores else None
+        self.block_size = block_size
+        self.blocks = dict() if block_size is not None else None  # Block index to (total, count)
+
+    def copy_empty(self):
+        return ScoreAggregator(self.relative_accuracy, self.histogram_bin_width, self.scores is not None,
+                               self.block_size)
+
+    def add(self, score):
+        self.add_all([score])
+
+    def add_all(self, scores, trials=None):
+        """
+        :param trials: trial index of every score, needed to fill the blocks if the aggregator has a block size and to
+        know the trials of the min and max scores
+        """
+        scores = np.asarray(scores)
+        if len(scores) == 0:
+            return
+        other = self.copy_empty()
+        other.count = len(scores)
+        other.total = int(scores.sum(dtype=np.int64)) if scores.dtype.kind in "iu" else float(scores.sum())
+        other.m2 = float(((scores - scores.mean()) ** 2).sum())
+        other.min = scores.min().item()
+        other.max = scores.max().item()
+        if trials is not None:
+            trials = np.asarray(trials)
+            other.min_trial = trials[scores.argmin()].item()
+            other.max_trial = trials[scores.argmax()].item()
+        positive = scores[scores > 0]
+        other.zero_count = len(scores) - len(positive)
+        keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        other.buckets = dict(zip(keys.tolist(), counts.tolist()))
+        if self.bins is not None:
+            keys, counts = np.unique(np.floor(scores / self.histogram_bin_width).astype(np.int64), return_counts=True)
+            other.bins = dict(zip(keys.tolist(), counts.tolist()))
+        if self.scores is not None:
+            other.scores = scores.tolist()
+        if self.blocks is not None:
+            assert trials is not None, "Scores of an aggregator with blocks need their trial indices"
+            keys, inverse = np.unique(np.asarray(trials) // self.block_size, return_inverse=True)
+            totals = np.bincount(inverse, weights=scores, minlength=len(keys))
+            counts = np.bincount(inverse, minlength=len(keys))
+            other.blocks = {key: (total, count) for key, total, count in zip(keys.tolist(), totals.tolist(),
+                                                                              counts.tolist())}
+        self.merge(other)
+
+    def merge(self, other):
+        """
+        Merge the scores of another aggregator with the same settings into this one.
+        """
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.m2 = other.m2
+        else:
+            # Chan et al. parallel variance
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / (self.count + other.count)
+        self.count += other.count
+        self.total += other.total
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+            self.min_trial = other.min_trial
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+            self.max_trial = other.max_trial
+        for key, count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + count
+        self.zero_count += other.zero_count
+        if self.bins is not None:
+            for key, count in other.bins.items():
+                self.bins[key] = self.bins.get(key, 0) + count
+        if self.scores is not None:
+            self.scores.extend(other.scores)
+        if self.blocks is not None:
+            for key, (total, count) in other.blocks.items():
+                block_total, block_count = self.blocks.get(key, (0, 0))
+                self.blocks[key] = (block_total + total, block_count + count)
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+    @property
+    def variance(self):
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def effective_sample_size(self):
+        """
+        Number of independent trials that would give the mean the same variance, estimated from the spread of the
+        means of the full blocks. Same as count without blocks or with too few of them.
+        """
+        if self.blocks is None or self.count < 2:
+            return self.count
+        block_means = [total / count for total, count in self.blocks.values() if count == self.block_size]
+        if len(block_means) < 2:
+            return self.count
+        block_variance = float(np.var(block_means, ddof=1))
+        if block_variance == 0:
+            return self.count if self.m2 == 0 else math.inf
+        return self.count * self.m2 / (self.count - 1) / self.block_size / block_variance
+
+    def quantile(self, q):
+        """
+        :param q: quantile in [0, 1]
+        """
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return min(0, self.max)
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def percentile(self, percentile):
+        """
+        :param percentile: percentile in [0, 100]
+        """
+        return self.quantile(percentile / 100)
+
+    def quantile_trial(self, q):
+        """
+        Trial of the score at quantile q, scores are kept in trial order starting from trial 0.
+        """
+        assert self.scores is not None, "Aggregator was created without keeping scores"
+        rank = int(round(min(max(q, 0), 1) * (self.count - 1)))
+        return int(np.argsort(self.scores, kind="stable")[rank])
+
+    def histogram(self):
+        """
+        :return: bin edges and counts, empty bins in between included
+        """
+        assert self.bins is not None, "Aggregator was created without a histogram bin width"
+        if not self.bins:
+            return np.zeros(1), np.zeros(0, dtype=int)
+        low = min(self.bins)
+        high = max(self.bins)
+        counts = np.zeros(high - low + 1, dtype=int)
+        for key, count in self.bins.items():
+            counts[key - low] = count
+        edges = np.arange(low, high + 2) * self.histogram_bin_width
+        return edges, counts
@@ -1,31 +1,125 @@
 import csv
 import time
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+import pandas as pd
 import pyximport
 
 import customlogger as logger
-from settings import ABUSE_CHARTS_PATH
+from batchengine import BatchTrialEngine
+from bonuscache import TrialBonuses, get_trial_bonuses, put_trial_bonuses
+from compiledchart import get_compiled_chart
+from estimator import ExpectedScoreEstimator
+from scoreaggregator import ScoreAggregator
+from settings import ABUSE_CHARTS_PATH, SIMULATION_PROCESSES, TRIAL_BONUS_CACHE_VALUES
 from statemachine import StateMachine, AbuseData
-from static.live_values import WEIGHT_RANGE, DIFF_MULTIPLIERS
-from static.note_type import NoteType
+from static.live_values import DIFF_MULTIPLIERS
 from utils.storage import get_writer
 
 pyximport.install(language_level=3)
 SPECIAL_OFFSET = 0.075
-
-
-def check_long(notes_data, mask):
-    stack = dict()
-    for idx, row in notes_data.iterrows():
-        if not mask[idx]:
-            continue
-        lane = row['finishPos']
-        if row['note_type'] == NoteType.LONG and lane not in stack:
-            stack[lane] = idx
-        elif lane in stack:
-            stack.pop(lane)
-            notes_data.loc[idx, 'is_long'] = True
+ADAPTIVE_BATCH_TRIALS = 100  # Trials run between convergence checks when simulating to a target
+STRATIFIED_BLOCK_TRIALS = 100  # Trials whose activation draws are stratified together, even to hold antithetic pairs
+
+
+_process_pool = None
+_process_pool_size = 0
+
+
+def get_process_pool(processes):
+    global _process_pool, _process_pool_size
+    if _process_pool is None or _process_pool_size != processes:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+        _process_pool = ProcessPoolExecutor(max_workers=processes)
+        _process_pool_size = processes
+    return _process_pool
+
+
+def split_trials(trials, chunks):
+    bounds = np.linspace(trials.start, trials.stop, min(chunks, len(trials)) + 1).astype(int)
+    return [range(bound_l, bound_r) for bound_l, bound_r in zip(bounds[:-1], bounds[1:])]
+
+
+def get_auto_special_offset(time_offset, special_offset):
+    """
+    Offset of the non-tap notes in autoplay for a time offset in ms, special_offset is kept below 100 ms.
+    """
+    if time_offset >= 200:
+        return 0
+    elif 125 >= time_offset > 100:
+        return 0.075
+    elif time_offset > 125:
+        return 0.2 - time_offset / 1000
+    return special_offset
+
+
+def get_confidence_intervals(aggregator: ScoreAggregator, confidence=0.95, percentile=None):
+    """
+    Normal approximation interval of the mean score and distribution-free interval of a score percentile.
+    :param percentile: percentile in [0, 100] to get the interval of, None to skip it
+    :return: (low, high) of the mean, (low, high) of the percentile or None
+    """
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    n = aggregator.count
+    mean = aggregator.mean
+    se = np.sqrt(aggregator.m2 / (n - 1) / aggregator.effective_sample_size) if n > 1 else np.inf
+    mean_interval = (float(mean - z * se), float(mean + z * se))
+    if percentile is None:
+        return mean_interval, None
+    # Ranks around the percentile that cover it with the given confidence, from the binomial distribution of the
+    # number of trials below it
+    q = percentile / 100
+    spread = z * np.sqrt(n * q * (1 - q))
+    rank_l = np.clip(np.floor(n * q - spread), 0, n - 1)
+    rank_r = np.clip(np.ceil(n * q + spread), 0, n - 1)
+    quantile_l = rank_l / (n - 1) if n > 1 else 0
+    quantile_r = rank_r / (n - 1) if n > 1 else 1
+    return mean_interval, (float(aggregator.quantile(quantile_l)), float(aggregator.quantile(quantile_r)))
+
+
+def simulate_paired(simulators, times=1000, seed=None, confidence=0.95, **kwargs):
+    """
+    Simulate several units on the same chart with common random numbers: trial i of every unit uses the same note
+    jitter and the same draw for every activation slot (card position and activation index), so the differences
+    between units only come from the units themselves and need far fewer trials to resolve than independent runs.
+    :param simulators: simulators of the units to compare, on the same chart
+    :param kwargs: passed to Simulator.simulate, except the stopping targets which would give the units different
+    numbers of trials, keep_scores as every trial score is kept, and perfect_play which has no trials to pair
+    :return: PairedSimulationResult with the differences from the first unit and their mean intervals
+    """
+    assert "target_se" not in kwargs and "target_ci_width" not in kwargs, "Paired trials need a fixed trial count"
+    assert "keep_scores" not in kwargs and not kwargs.get("perfect_play"), "Paired trials need every trial score"
+    if seed is None:
+        seed = int(np.random.randint(0, 2 ** 31))
+    results = [simulator.simulate(times=times, seed=seed, confidence=confidence, keep_scores=True, **kwargs)
+               for simulator in simulators]
+    first = np.array(results[0].aggregator.scores, dtype=np.int64)
+    differences = list()
+    confidence_intervals = list()
+    for result in results:
+        difference = np.array(result.aggregator.scores, dtype=np.int64) - first
+        aggregator = ScoreAggregator()
+        aggregator.add_all(difference)
+        differences.append(difference)
+        confidence_intervals.append(get_confidence_intervals(aggregator, confidence)[0])
+    return PairedSimulationResult(results, differences, confidence_intervals, seed)
+
+
+def _simulate_trials_worker(simulator, grand, trials, seed, doublelife, perfect_only, batch, aggregator,
+                            keep_bonuses=False):
+    impl = simulator._create_state_machine(grand, doublelife)
+    engine = simulator._get_batch_engine(impl, perfect_only, batch)
+    bonuses = list() if keep_bonuses else None
+    aggregator.add_all(simulator._simulate_trials(impl, trials, seed, perfect_only, engine, bonuses), trials)
+    return aggregator, bonuses
+
+
+def _simulate_auto_worker(simulator, grand, doublelife, offsets, special_offset):
+    impl = simulator._create_state_machine(grand, doublelife)
+    return [simulator._simulate_auto_offset(impl, offset, special_offset) for offset in offsets]
 
 
 class BaseSimulationResult:
@@ -36,7 +130,8 @@ class BaseSimulationResult:
 class SimulationResult(BaseSimulationResult):
     def __init__(self, total_appeal, perfect_score, perfect_score_array, base, deltas, total_life, fans,
                  full_roll_chance,
-                 abuse_score, abuse_data: AbuseData):
+                 abuse_score, abuse_data: AbuseData, trials=1, confidence_interval=None, percentile_interval=None,
+                 aggregator: ScoreAggregator = None, seed=None):
         super().__init__()
         self.total_appeal = total_appeal
         self.perfect_score = perfect_score
@@ -48,6 +143,99 @@ class SimulationResult(BaseSimulationResult):
         self.full_roll_chance = full_roll_chance
         self.abuse_score = abuse_score
         self.abuse_data = abuse_data
+        # Random simulations only: number of trials run, intervals of the mean score and the requested percentile
+        self.trials = trials
+        self.confidence_interval = confidence_interval
+        self.percentile_interval = percentile_interval
+        self.aggregator = aggregator
+        # Base seed of the trials, any of them can be replayed with Simulator.replay_trial
+        self.seed = seed
+
+    @property
+    def max_score(self):
+        return self.aggregator.max
+
+    @property
+    def min_score(self):
+        return self.aggregator.min
+
+    @property
+    def std(self):
+        return self.aggregator.std
+
+    @property
+    def effective_sample_size(self):
+        return self.aggregator.effective_sample_size
+
+    def percentile(self, percentile):
+        return self.aggregator.percentile(percentile)
+
+    def histogram(self):
+        return self.aggregator.histogram()
+
+
+class EstimationResult(BaseSimulationResult):
+    def __init__(self, total_appeal, perfect_score, expected_score, variance, exact):
+        super().__init__()
+        self.total_appeal = total_appeal
+        self.perfect_score = perfect_score
+        self.expected_score = expected_score
+        self.variance = variance
+        # Whether expected_score is exact for notes at their chart timing, see ExpectedScoreEstimator
+        self.exact = exact
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class PairedSimulationResult(BaseSimulationResult):
+    def __init__(self, results, differences, confidence_intervals, seed):
+        super().__init__()
+        self.results = results
+        # Per trial score differences of every unit from the first one, the first entry is all zeros
+        self.differences = differences
+        self.confidence_intervals = confidence_intervals
+        self.seed = seed
+
+    @property
+    def mean_differences(self):
+        return [float(differences.mean()) for differences in self.differences]
+
+
+class ReweightedSimulationResult(BaseSimulationResult):
+    def __init__(self, total_appeal, perfect_score, probabilities, scores, weights, full_roll_chance,
+                 confidence=0.95, resimulated=False):
+        super().__init__()
+        self.total_appeal = total_appeal
+        self.perfect_score = perfect_score
+        self.probabilities = probabilities
+        self.scores = scores
+        self.weights = weights  # Normalized likelihood ratio of every trial
+        self.full_roll_chance = full_roll_chance
+        # Too few effective trials were left to reweight, so the trials were run with these probabilities
+        self.resimulated = resimulated
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        half_width = z * np.sqrt(np.dot(weights ** 2, (scores - self.mean) ** 2))
+        self.confidence_interval = (self.mean - half_width, self.mean + half_width)
+
+    @property
+    def mean(self):
+        return float(np.dot(self.weights, self.scores))
+
+    @property
+    def std(self):
+        return float(np.sqrt(np.dot(self.weights, (self.scores - self.mean) ** 2)))
+
+    @property
+    def effective_sample_size(self):
+        return float(1 / np.sum(self.weights ** 2))
+
+    def percentile(self, percentile):
+        sorted_indices = np.argsort(self.scores, kind="stable")
+        cumulative = np.cumsum(self.weights[sorted_indices])
+        rank = min(np.searchsorted(cumulative, percentile / 100 * cumulative[-1]), len(cumulative) - 1)
+        return self.scores[sorted_indices[rank]]
 
 
 class AutoSimulationResult(BaseSimulationResult):
@@ -69,13 +257,22 @@ class Simulator:
     def __init__(self, live=None, special_offset=None, left_inclusive=False, right_inclusive=True,
                  force_encore_amr_cache_to_encore_unit=False,
                  force_encore_magic_to_encore_unit=False,
-                 allow_encore_magic_to_escape_max_agg=True):
+                 allow_encore_magic_to_escape_max_agg=True,
+                 use_fast_paths=True):
         self.live = live
         self.left_inclusive = left_inclusive
         self.right_inclusive = right_inclusive
         self.force_encore_amr_cache_to_encore_unit = force_encore_amr_cache_to_encore_unit
         self.force_encore_magic_to_encore_unit = force_encore_magic_to_encore_unit
         self.allow_encore_magic_to_escape_max_agg = allow_encore_magic_to_escape_max_agg
+        self.use_fast_paths = use_fast_paths
+        self.stratified = False
+        self.antithetic = False
+        self.strata = None  # Stratum table of the last block, see _get_strata
+        self.probabilities = None  # Activation probabilities instead of the ones of the live
+        self.seed = None
+        self.doublelife = False
+        self.perfect_only = True
         if special_offset is None:
             self.special_offset = 0
         else:
@@ -90,28 +287,10 @@ class Simulator:
             self.live.set_extra_bonus(extra_bonus, special_option, special_value)
         [unit.get_base_motif_appeals() for unit in self.live.unit.all_units]
         self.notes_data = self.live.notes
-        self.song_duration = self.notes_data.iloc[-1].sec
-        self.note_count = len(self.notes_data)
-
-        if mirror and self.live.is_grand_chart:
-            start_lanes = 16 - (self.notes_data['finishPos'] + self.notes_data['status'] - 1)
-            self.notes_data['finishPos'] = start_lanes
-
-        is_flick = self.notes_data['note_type'] == NoteType.FLICK
-        is_long = self.notes_data['note_type'] == NoteType.LONG
-        is_slide = self.notes_data['note_type'] == NoteType.SLIDE
-        is_slide = np.logical_or(is_slide, np.logical_and(self.notes_data['type'] == 3, is_flick))
-        self.notes_data['is_flick'] = is_flick
-        self.notes_data['is_long'] = is_long
-        self.notes_data['is_slide'] = is_slide
-        check_long(self.notes_data, np.logical_or(is_long, is_flick))
-        self._helper_mark_slide_checkpoints()
-
-        weight_range = np.array(WEIGHT_RANGE)
-        weight_range[:, 0] = np.trunc(WEIGHT_RANGE[:, 0] / 100 * len(self.notes_data) - 1)
-        for idx, (bound_l, bound_r) in enumerate(zip(weight_range[:-1, 0], weight_range[1:, 0])):
-            self.notes_data.loc[int(bound_l):int(bound_r), 'weight'] = weight_range[idx][1]
-        self.weight_range = self.notes_data['weight'].to_list()
+        self.chart = get_compiled_chart(self.live, mirror)
+        self.song_duration = self.chart.song_duration
+        self.note_count = self.chart.note_count
+        self.weight_range = self.chart.weights
 
         if support is not None:
             self.support = support
@@ -121,22 +300,39 @@ class Simulator:
             self.total_appeal = appeals
         else:
             self.total_appeal = self.live.get_appeals() + self.support
-        self.base_score = DIFF_MULTIPLIERS[self.live.level] * self.total_appeal / len(self.notes_data)
-        self.helen_base_score = DIFF_MULTIPLIERS[self.live.level] * self.total_appeal / len(self.notes_data)
-
-    def _helper_mark_slide_checkpoints(self):
-        self.notes_data['checkpoints'] = False
-        self.notes_data.loc[self.notes_data['note_type'] == NoteType.SLIDE, 'checkpoints'] = True
-        for group_id in self.notes_data[self.notes_data['note_type'] == NoteType.SLIDE].groupId.unique():
-            group = self.notes_data[
-                (self.notes_data['groupId'] != 0) & (self.notes_data['groupId'] == group_id)]
-            self.notes_data.loc[group.iloc[-1].name, 'checkpoints'] = False
-            self.notes_data.loc[group.iloc[0].name, 'checkpoints'] = False
+        self.base_score = DIFF_MULTIPLIERS[self.live.level] * self.total_appeal / self.note_count
+        self.helen_base_score = DIFF_MULTIPLIERS[self.live.level] * self.total_appeal / self.note_count
 
     def simulate(self, times=100, appeals=None, extra_bonus=None, support=None, perfect_play=False,
                  chara_bonus_set=None, chara_bonus_value=0, special_option=None, special_value=None,
                  doublelife=False, perfect_only=True, abuse=False, output=False, auto=False, mirror=False,
-                 time_offset=0):
+                 time_offset=0, seed=None, processes=None, batch=True, target_se=None, target_ci_width=None,
+                 percentile=None, confidence=0.95, keep_scores=False, histogram_bin_width=None, stratified=False,
+                 antithetic=False, reuse_trials=False):
+        """
+        :param seed: base seed of the random trials, trial i draws from a generator seeded with seed + i.
+        The same seed gives the same result regardless of the number of processes.
+        :param processes: number of worker processes to spread the random trials over,
+        defaults to SIMULATION_PROCESSES. 1 runs all trials in the current process.
+        :param batch: run perfect-only trials with the batch engine, which gives the same scores as running every trial
+        through the state machine.
+        :param target_se: stop once the standard error of the mean score (and of the percentile, if given) is at most
+        this. times becomes the maximum number of trials.
+        :param target_ci_width: stop once the confidence interval of the mean score (and of the percentile, if given)
+        is at most this wide. times becomes the maximum number of trials.
+        :param percentile: percentile in [0, 100] whose confidence interval is reported and held to the targets
+        :param confidence: confidence level of the reported intervals
+        :param keep_scores: keep every trial score to fill in the result deltas. Only the aggregated statistics are
+        kept otherwise and the deltas are None.
+        :param histogram_bin_width: width in points of the bins of the result histogram, None to skip it
+        :param stratified: Latin hypercube sampling of the activations, every block of STRATIFIED_BLOCK_TRIALS trials
+        draws each activation once from every stratum of [0, 1)
+        :param antithetic: pair every odd trial with the trial before it, using the mirrored note jitter
+        Both keep the mean score unbiased. The intervals then use the effective sample size of the result.
+        :param reuse_trials: keep the bonuses of every trial, and answer a later simulation that only differs in total
+        appeal (appeals, support or appeal bonuses) by rescaling them instead of running the trials again. Scores are
+        the same as running them. A seed of None reuses the trials whatever their seed.
+        """
         start = time.time()
         logger.debug("Unit: {}".format(self.live.unit))
         logger.debug("Song: {} - {} - Lv {}".format(self.live.music_name, self.live.difficulty, self.live.level))
@@ -148,7 +344,12 @@ class Simulator:
                                  perfect_play=perfect_play,
                                  chara_bonus_set=chara_bonus_set, chara_bonus_value=chara_bonus_value,
                                  special_option=special_option, special_value=special_value,
-                                 doublelife=doublelife, perfect_only=perfect_only, abuse=abuse)
+                                 doublelife=doublelife, perfect_only=perfect_only, abuse=abuse,
+                                 seed=seed, processes=processes, batch=batch,
+                                 target_se=target_se, target_ci_width=target_ci_width, percentile=percentile,
+                                 confidence=confidence, keep_scores=keep_scores,
+                                 histogram_bin_width=histogram_bin_width, stratified=stratified,
+                                 antithetic=antithetic, reuse_trials=reuse_trials)
             if output:
                 self.save_to_file(res.perfect_score_array, res.abuse_data)
         else:
@@ -201,26 +402,86 @@ class Simulator:
                   special_value=None,
                   doublelife=False,
                   perfect_only=True,
-                  abuse=False
+                  abuse=False,
+                  seed=None,
+                  processes=None,
+                  batch=True,
+                  target_se=None,
+                  target_ci_width=None,
+                  percentile=None,
+                  confidence=0.95,
+                  keep_scores=False,
+                  histogram_bin_width=None,
+                  stratified=False,
+                  antithetic=False,
+                  reuse_trials=False
                   ):
 
         self._setup_simulator(appeals=appeals, support=support, extra_bonus=extra_bonus,
                               chara_bonus_set=chara_bonus_set, chara_bonus_value=chara_bonus_value,
                               special_option=special_option, special_value=special_value)
         grand = self.live.is_grand
-
-        results = self._simulate_internal(times=times, grand=grand, fail_simulate=not perfect_play,
-                                          doublelife=doublelife, perfect_only=perfect_only, abuse=abuse)
-
-        perfect_score, perfect_score_array, random_simulation_results, full_roll_chance, abuse_score, abuse_data = results
-
+        self.stratified = stratified
+        self.antithetic = antithetic
+        if perfect_play:
+            block_size = None
+        elif stratified:
+            block_size = STRATIFIED_BLOCK_TRIALS
+        elif antithetic:
+            block_size = 2
+        else:
+            block_size = None
+        aggregator = ScoreAggregator(histogram_bin_width=histogram_bin_width, keep_scores=keep_scores,
+                                     block_size=block_size)
+
+        # Simulations of a support sweep only differ in total appeal, so the bonuses of earlier trials are rescaled
+        if not reuse_trials or abuse or target_se is not None or target_ci_width is not None \
+                or (times + 1) * self.note_count > TRIAL_BONUS_CACHE_VALUES:
+            bonus_key = None
+            trial_bonuses = None
+        else:
+            bonus_key = self._get_bonus_key(times, perfect_play, doublelife, perfect_only)
+            trial_bonuses = get_trial_bonuses(bonus_key, seed)
+        if trial_bonuses is not None:
+            seed = trial_bonuses.seed
+        elif seed is None and not perfect_play:
+            seed = int(np.random.randint(0, 2 ** 31))
+        # Kept to replay trials of this simulation
+        self.seed = seed
+        self.doublelife = doublelife
+        self.perfect_only = perfect_only
+
+        if trial_bonuses is not None:
+            logger.debug("Rescaled the bonuses of {} cached trials".format(len(trial_bonuses.trial_bonuses)))
+            perfect_score_array = trial_bonuses.get_perfect_scores(self.base_score)
+            if not perfect_play:
+                aggregator.add_all(trial_bonuses.get_trial_scores(self.base_score), np.arange(times))
+            results = (int(perfect_score_array.sum()), perfect_score_array.tolist(), aggregator,
+                       trial_bonuses.full_roll_chance, 0, None)
+        else:
+            bonuses = list() if bonus_key is not None else None
+            results = self._simulate_internal(times=times, grand=grand, fail_simulate=not perfect_play,
+                                              doublelife=doublelife, perfect_only=perfect_only, abuse=abuse,
+                                              seed=seed, processes=processes, batch=batch,
+                                              target_se=target_se, target_ci_width=target_ci_width,
+                                              percentile=percentile, confidence=confidence,
+                                              aggregator=aggregator, bonuses=bonuses)
+            if bonus_key is not None:
+                put_trial_bonuses(bonus_key, TrialBonuses(seed, self.weight_range, bonuses[0], results[3],
+                                                          np.array(bonuses[1:]).reshape(-1, self.note_count)))
+
+        perfect_score, perfect_score_array, aggregator, full_roll_chance, abuse_score, abuse_data = results
+
+        confidence_interval = None
+        percentile_interval = None
         if perfect_play:
             base = perfect_score
             deltas = np.zeros(1)
+            aggregator.add(perfect_score)
         else:
-            score_array = np.array([_[0] for _ in random_simulation_results])
-            base = int(score_array.mean())
-            deltas = score_array - base
+            base = int(aggregator.mean)
+            deltas = np.array(aggregator.scores) - base if keep_scores else None
+            confidence_interval, percentile_interval = get_confidence_intervals(aggregator, confidence, percentile)
 
         total_fans = 0
         if grand:
@@ -235,11 +496,16 @@ class Simulator:
         logger.debug("Support: {}".format(int(self.live.get_support())))
         logger.debug("Support team: {}".format(self.live.print_support_team()))
         logger.debug("Perfect: {}".format(int(perfect_score)))
-        logger.debug("Mean: {}".format(int(base + np.round(deltas.mean()))))
-        logger.debug("Median: {}".format(int(base + np.round(np.median(deltas)))))
-        logger.debug("Max: {}".format(int(base + deltas.max())))
-        logger.debug("Min: {}".format(int(base + deltas.min())))
-        logger.debug("Deviation: {}".format(int(np.round(np.std(deltas)))))
+        logger.debug("Mean: {}".format(int(np.round(aggregator.mean))))
+        logger.debug("Median: {}".format(int(np.round(aggregator.percentile(50)))))
+        logger.debug("Max: {}".format(int(aggregator.max)))
+        logger.debug("Min: {}".format(int(aggregator.min)))
+        logger.debug("Deviation: {}".format(int(np.round(aggregator.std))))
+        if confidence_interval is not None:
+            logger.debug("Trials: {}, mean {:.0%} interval: {:.0f} - {:.0f}".format(
+                aggregator.count, confidence, *confidence_interval))
+            if block_size is not None:
+                logger.debug("Effective sample size: {:.0f}".format(aggregator.effective_sample_size))
         return SimulationResult(
             total_appeal=self.total_appeal,
             perfect_score=perfect_score,
@@ -250,17 +516,71 @@ class Simulator:
             full_roll_chance=full_roll_chance,
             fans=total_fans,
             abuse_score=int(abuse_score),
-            abuse_data=abuse_data
+            abuse_data=abuse_data,
+            trials=aggregator.count,
+            confidence_interval=confidence_interval,
+            percentile_interval=percentile_interval,
+            aggregator=aggregator,
+            seed=seed
         )
 
-    def _simulate_internal(self, grand, times, fail_simulate=False, doublelife=False, perfect_only=True, abuse=False,
-                           auto=False, time_offset=0):
-        impl = StateMachine(
+    def _get_bonus_key(self, times, perfect_play, doublelife, perfect_only):
+        """
+        Everything the bonuses of a simulation depend on. Appeals only change them through motif skills and through
+        life and skill bonuses, which show up in the start life, the motif values and the probabilities.
+        """
+        live = self.live
+        cards = tuple((card.card_id, card.color, card.skill.skill_type, card.skill.duration, card.skill.interval,
+                       card.skill.offset, card.skill.values)
+                      for card in live.unit.all_cards())
+        motifs = tuple((unit.motif_vocal_trimmed, unit.motif_dance_trimmed, unit.motif_visual_trimmed)
+                       for unit in live.unit.all_units)
+        if self.probabilities is None:
+            probabilities = tuple(live.get_probability(idx) for idx in range(len(live.unit.all_cards())))
+        else:
+            probabilities = tuple(self.probabilities)
+        return (self.chart, live.is_grand, live.color, cards, motifs, probabilities,
+                live.get_start_life(doublelife=doublelife), live.get_start_life(doublelife=True),
+                self.left_inclusive, self.right_inclusive, self.force_encore_amr_cache_to_encore_unit,
+                self.force_encore_magic_to_encore_unit, self.allow_encore_magic_to_escape_max_agg,
+                times, perfect_play, doublelife, perfect_only, self.stratified, self.antithetic)
+
+    def replay_trial(self, trial, seed=None):
+        """
+        Run a single trial of the last simulation again. Trials only depend on the base seed and their index, so the
+        replay gives the same score without any per trial data kept from the simulation, e.g. the min and max trials
+        of its aggregator.
+        :param trial: trial index
+        :param seed: base seed of the trials, defaults to the one of the last simulation
+        :return: per note trace in hit order
+        """
+        if seed is None:
+            seed = self.seed
+        assert seed is not None, "No random simulation to replay"
+        impl = self._create_state_machine(self.live.is_grand, self.doublelife)
+        jitter_uniforms, activation_uniforms = self._draw_trial_uniforms(seed, trial)
+        impl.reset_machine(perfect_play=False, perfect_only=self.perfect_only,
+                           jitter_uniforms=jitter_uniforms, activation_uniforms=activation_uniforms)
+        impl.simulate_impl()
+        return pd.DataFrame({
+            "note": impl.note_idx_stack,
+            "time": np.array(impl.note_time_stack) / 1E6,
+            "delta": np.array(impl.note_time_deltas) / 1E6,
+            "judgement": impl.judgements,
+            "combo": impl.combos,
+            "score_bonus": impl.score_bonuses,
+            "combo_bonus": impl.combo_bonuses,
+            "life": impl.lives,
+            "score": impl.get_note_scores(),
+        })
+
+    def _create_state_machine(self, grand, doublelife):
+        return StateMachine(
             grand=grand,
             difficulty=self.live.difficulty,
             doublelife=doublelife,
             live=self.live,
-            notes_data=self.notes_data,
+            chart=self.chart,
             left_inclusive=self.left_inclusive,
             right_inclusive=self.right_inclusive,
             base_score=self.base_score,
@@ -268,9 +588,84 @@ class Simulator:
             weights=self.weight_range,
             force_encore_amr_cache_to_encore_unit=self.force_encore_amr_cache_to_encore_unit,
             force_encore_magic_to_encore_unit=self.force_encore_magic_to_encore_unit,
-            allow_encore_magic_to_escape_max_agg=self.allow_encore_magic_to_escape_max_agg
+            allow_encore_magic_to_escape_max_agg=self.allow_encore_magic_to_escape_max_agg,
+            use_fast_paths=self.use_fast_paths,
+            probabilities=self.probabilities
         )
 
+    def _draw_trial_uniforms(self, seed, trial):
+        rng = np.random.default_rng(seed + trial)
+        jitter_uniforms = rng.random(self.note_count)
+        activation_uniforms = rng.random((len(self.live.unit.all_cards()), self._get_activation_columns()))
+        if self.antithetic and trial % 2 == 1:
+            jitter_uniforms = 1 - np.random.default_rng(seed + trial - 1).random(self.note_count)
+        if self.stratified:
+            block, position = divmod(trial, STRATIFIED_BLOCK_TRIALS)
+            activation_uniforms = (self._get_strata(seed, block, activation_uniforms.shape)[position]
+                                   + activation_uniforms) / STRATIFIED_BLOCK_TRIALS
+        return jitter_uniforms, activation_uniforms
+
+    def _get_activation_columns(self):
+        """
+        :return: columns of the activation draws, one per activation index of the skill with the shortest interval
+        """
+        return max((int((self.song_duration - 3) // card.skill.interval)
+                    for card in self.live.unit.all_cards() if card.skill.interval > 0), default=0) + 1
+
+    def _get_strata(self, seed, block, shape):
+        """
+        :return: stratum of every activation draw for every trial of a block, each draw has every stratum once
+        """
+        if self.strata is None or self.strata[0] != (seed, block):
+            rng = np.random.default_rng((seed, block))
+            strata = np.broadcast_to(np.arange(STRATIFIED_BLOCK_TRIALS), shape + (STRATIFIED_BLOCK_TRIALS,))
+            strata = rng.permuted(strata, axis=-1)
+            self.strata = ((seed, block), np.moveaxis(strata, -1, 0))
+        return self.strata[1]
+
+    def _get_batch_engine(self, impl, perfect_only, batch):
+        if batch and perfect_only and BatchTrialEngine.supports(self.live):
+            return BatchTrialEngine(self, impl)
+        return None
+
+    def _simulate_trials(self, impl, trials, seed, perfect_only, engine=None, bonuses=None):
+        """
+        :param bonuses: list to append the final bonus multipliers of every trial to, None to skip them
+        """
+        if engine is not None:
+            return engine.run(trials, seed, bonuses)
+        scores = list()
+        for trial in trials:
+            jitter_uniforms, activation_uniforms = self._draw_trial_uniforms(seed, trial)
+            impl.reset_machine(perfect_play=False, perfect_only=perfect_only,
+                               jitter_uniforms=jitter_uniforms, activation_uniforms=activation_uniforms)
+            scores.append(impl.simulate_impl()[0])
+            if bonuses is not None:
+                bonuses.append(impl.get_final_bonus())
+        return scores
+
+    def _simulate_trials_parallel(self, grand, trials, seed, doublelife, perfect_only, processes, aggregator,
+                                  batch=False, bonuses=None):
+        pool = get_process_pool(processes)
+        futures = [pool.submit(_simulate_trials_worker, self, grand, chunk, seed, doublelife, perfect_only, batch,
+                               aggregator.copy_empty(), bonuses is not None)
+                   for chunk in split_trials(trials, processes)]
+        # Merged in trial order so kept scores stay in order
+        for future in futures:
+            chunk_aggregator, chunk_bonuses = future.result()
+            aggregator.merge(chunk_aggregator)
+            if bonuses is not None:
+                bonuses.extend(chunk_bonuses)
+
+    def _simulate_internal(self, grand, times, fail_simulate=False, doublelife=False, perfect_only=True, abuse=False,
+                           auto=False, time_offset=0, seed=None, processes=None, batch=False, target_se=None,
+                           target_ci_width=None, percentile=None, confidence=0.95, aggregator=None, bonuses=None):
+        """
+        :param bonuses: list to append the final bonus multipliers of the perfect play and then of every trial to,
+        None to skip them
+        """
+        impl = self._create_state_machine(grand, doublelife)
+
         if auto:
             impl.reset_machine(time_offset=time_offset, special_offset=self.special_offset, auto=True)
             return impl.simulate_impl_auto()
@@ -279,12 +674,37 @@ class Simulator:
         perfect_score, perfect_score_array = impl.simulate_impl()
         logger.debug("Perfect scores: " + " ".join(map(str, impl.get_note_scores())))
         full_roll_chance = impl.get_full_roll_chance()
+        if bonuses is not None:
+            bonuses.append(impl.get_final_bonus())
 
-        scores = list()
+        if aggregator is None:
+            aggregator = ScoreAggregator()
         if fail_simulate:
-            for _ in range(times):
-                impl.reset_machine(perfect_play=False, perfect_only=perfect_only)
-                scores.append(impl.simulate_impl())
+            if seed is None:
+                seed = int(np.random.randint(0, 2 ** 31))
+            if processes is None:
+                processes = SIMULATION_PROCESSES
+            engine = self._get_batch_engine(impl, perfect_only, batch)
+
+            def run_trials(trials):
+                if processes > 1 and len(trials) > 1:
+                    self._simulate_trials_parallel(grand, trials, seed, doublelife, perfect_only, processes,
+                                                   aggregator, batch, bonuses)
+                else:
+                    aggregator.add_all(self._simulate_trials(impl, trials, seed, perfect_only, engine, bonuses),
+                                       trials)
+
+            if target_se is None and target_ci_width is None:
+                run_trials(range(times))
+            else:
+                # Trial i always uses seed + i, so stopping early gives the same scores as asking for fewer trials
+                while aggregator.count < times:
+                    run_trials(range(aggregator.count, min(times, aggregator.count + ADAPTIVE_BATCH_TRIALS)))
+                    if self._targets_met(aggregator, target_se, target_ci_width, percentile, confidence):
+                        break
+                logger.debug("Ran {} trials to reach the target".format(aggregator.count))
+            if engine is None:
+                logger.debug("Bonus memo: {} hits, {} misses".format(*impl.get_memo_stats()))
 
         abuse_result_score = 0
         abuse_data: AbuseData = None
@@ -293,7 +713,20 @@ class Simulator:
             abuse_result_score, abuse_data = impl.simulate_impl(skip_activation_initialization=True)
             logger.debug("Total abuse: {}".format(int(abuse_result_score)))
             logger.debug("Abuse deltas: " + " ".join(map(str, abuse_data.score_delta)))
-        return perfect_score, perfect_score_array, scores, full_roll_chance, abuse_result_score, abuse_data
+        return perfect_score, perfect_score_array, aggregator, full_roll_chance, abuse_result_score, abuse_data
+
+    @staticmethod
+    def _targets_met(aggregator, target_se, target_ci_width, percentile, confidence):
+        if aggregator.count < 2:
+            return False
+        z = NormalDist().inv_cdf(0.5 + confidence / 2)
+        intervals = [_ for _ in get_confidence_intervals(aggregator, confidence, percentile) if _ is not None]
+        widths = [high - low for low, high in intervals]
+        if target_se is not None and any(width / (2 * z) > target_se for width in widths):
+            return False
+        if target_ci_width is not None and any(width > target_ci_width for width in widths):
+            return False
+        return True
 
     def _simulate_auto(self,
                        appeals=None,
@@ -308,12 +741,7 @@ class Simulator:
                        doublelife=False
                        ):
 
-        if time_offset >= 200:
-            self.special_offset = 0
-        elif 125 >= time_offset > 100:
-            self.special_offset = 0.075
-        elif time_offset > 125:
-            self.special_offset = 0.2 - time_offset / 1000
+        self.special_offset = get_auto_special_offset(time_offset, self.special_offset)
 
         # Pump dummy notes to check for intervals where notes fail
         self._setup_simulator(appeals=appeals, support=support, extra_bonus=extra_bonus,
@@ -331,7 +759,7 @@ class Simulator:
         logger.debug("Support: {}".format(int(self.live.get_support())))
         logger.debug("Support team: {}".format(self.live.print_support_team()))
         logger.debug("Auto score: {}".format(auto_score))
-        logger.debug("Perfects/Misses: {}/{}".format(perfects, len(self.notes_data) - perfects))
+        logger.debug("Perfects/Misses: {}/{}".format(perfects, self.note_count - perfects))
         logger.debug("Max Combo: {}".format(max_combo))
         logger.debug("Lowest Life: {}".format(lowest_life))
         logger.debug("Lowest Life Time: {}".format(lowest_life_time))
@@ -342,10 +770,172 @@ class Simulator:
             total_life=self.live.get_life(),
             score=auto_score,
             perfects=perfects,
-            misses=len(self.notes_data) - perfects,
+            misses=self.note_count - perfects,
             max_combo=max_combo,
             lowest_life=lowest_life,
             lowest_life_time=(lowest_life_time // 1000) / 1000,
             all_100=all_100
         )
         return ret
+
+    def estimate(self, appeals=None, extra_bonus=None, support=None, chara_bonus_set=None, chara_bonus_value=0,
+                 special_option=None, special_value=None, doublelife=False, max_subsets=4096):
+        """
+        Expected score and approximate variance of random perfect-only simulations, computed from the activation
+        probabilities instead of running trials. Meant for ranking many units, simulate gives the actual distribution.
+        :param max_subsets: most activation outcomes evaluated per segment of notes when there are too many to
+        evaluate all of them
+        """
+        start = time.time()
+        self._setup_simulator(appeals=appeals, support=support, extra_bonus=extra_bonus,
+                              chara_bonus_set=chara_bonus_set, chara_bonus_value=chara_bonus_value,
+                              special_option=special_option, special_value=special_value)
+        impl = self._create_state_machine(self.live.is_grand, doublelife)
+        impl.reset_machine(perfect_play=True, perfect_only=True)
+        perfect_score, _ = impl.simulate_impl()
+        estimator = ExpectedScoreEstimator(self, impl, max_subsets=max_subsets)
+        expected_score, variance = estimator.estimate()
+        logger.debug("Expected: {:.0f}, deviation: {:.0f}, exact: {}, run time: {:04.3f}s".format(
+            expected_score, np.sqrt(variance), estimator.exact, time.time() - start))
+        return EstimationResult(
+            total_appeal=self.total_appeal,
+            perfect_score=perfect_score,
+            expected_score=expected_score,
+            variance=variance,
+            exact=estimator.exact
+        )
+
+    def simulate_reweighted(self, probabilities, proposal=None, times=1000, min_effective_trials=None, confidence=0.95,
+                            **kwargs):
+        """
+        Score distributions for several activation probability vectors, e.g. of different skill potentials, from the
+        trials of a single simulation. The trials are run with the proposal probabilities and weighted by the
+        likelihood ratio of their activation rolls. Vectors that leave fewer than min_effective_trials effective
+        trials, or that the proposal cannot cover, are simulated on their own.
+        :param probabilities: activation probability of every card for every vector, as given by live.get_probability
+        :param proposal: probabilities to run the trials with, defaults to the mean of the vectors
+        :param min_effective_trials: defaults to a tenth of the trials
+        :param kwargs: passed to simulate, except the stopping targets and keep_scores, as every trial score is kept
+        :return: ReweightedSimulationResult of every vector
+        """
+        assert not kwargs.get("perfect_play") and "target_se" not in kwargs and "target_ci_width" not in kwargs \
+               and "keep_scores" not in kwargs
+        probabilities = np.array(probabilities, dtype=float)
+        proposal = probabilities.mean(axis=0) if proposal is None else np.array(proposal, dtype=float)
+        if min_effective_trials is None:
+            min_effective_trials = times / 10
+        base = self._simulate_with_probabilities(proposal, times, **kwargs)
+        scores = np.array(base.aggregator.scores)
+        successes, attempts = self._get_activation_counts(base.seed, times, proposal)
+
+        results = list()
+        for variant in probabilities:
+            weights = self._get_likelihood_ratios(successes, attempts, variant, proposal)
+            if weights is not None and 1 / np.sum(weights ** 2) >= min_effective_trials:
+                results.append(ReweightedSimulationResult(
+                    total_appeal=base.total_appeal,
+                    perfect_score=base.perfect_score,
+                    probabilities=variant,
+                    scores=scores,
+                    weights=weights,
+                    full_roll_chance=float(np.prod(variant[variant > 0] ** attempts[variant > 0])),
+                    confidence=confidence
+                ))
+                continue
+            logger.debug("Simulating probabilities {} on their own".format(variant))
+            result = self._simulate_with_probabilities(variant, times, **kwargs)
+            results.append(ReweightedSimulationResult(
+                total_appeal=result.total_appeal,
+                perfect_score=result.perfect_score,
+                probabilities=variant,
+                scores=np.array(result.aggregator.scores),
+                weights=np.full(times, 1 / times),
+                full_roll_chance=result.full_roll_chance,
+                confidence=confidence,
+                resimulated=True
+            ))
+        return results
+
+    def _simulate_with_probabilities(self, probabilities, times, **kwargs):
+        self.probabilities = probabilities
+        try:
+            return self.simulate(times=times, keep_scores=True, **kwargs)
+        finally:
+            self.probabilities = None
+
+    def _get_activation_counts(self, seed, times, probabilities):
+        """
+        :return: activations that succeed for every trial and card, and activations rolled for every card
+        """
+        unit_offset = 3 if self.live.is_grand else 1
+        columns = list()
+        for card in self.live.unit.all_cards():
+            skill_times = int((self.song_duration - 3) // card.skill.interval)
+            columns.append(np.arange(card.skill.offset + 1, skill_times + 1, unit_offset))
+        attempts = np.array([len(_) for _ in columns])
+        successes = np.zeros((times, len(columns)), dtype=int)
+        for trial in range(times):
+            _, activation_uniforms = self._draw_trial_uniforms(seed, trial)
+            for idx, card_columns in enumerate(columns):
+                successes[trial, idx] = np.count_nonzero(activation_uniforms[idx, card_columns] <= probabilities[idx])
+        return successes, attempts
+
+    @staticmethod
+    def _get_likelihood_ratios(successes, attempts, probabilities, proposal):
+        """
+        :return: normalized likelihood ratio of every trial, None if the proposal does not cover the probabilities
+        """
+        changed = probabilities != proposal
+        # Cards that never roll, or always succeed, under the proposal cannot tell how other probabilities would roll
+        if np.any(changed & ((proposal <= 0) | (proposal >= 1) | (probabilities <= 0))):
+            return None
+        successes = successes[:, changed]
+        failures = attempts[changed] - successes
+        p = probabilities[changed]
+        q = proposal[changed]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log_weights = np.where(successes > 0, successes * np.log(p / q), 0).sum(axis=1) \
+                          + np.where(failures > 0, failures * np.log((1 - p) / (1 - q)), 0).sum(axis=1)
+        if not np.isfinite(log_weights).any():
+            return None
+        weights = np.exp(log_weights - log_weights.max())
+        return weights / weights.sum()
+
+    def simulate_auto_sweep(self, offsets, appeals=None, extra_bonus=None, support=None, chara_bonus_set=None,
+                            chara_bonus_value=0, special_option=None, special_value=None, mirror=False,
+                            doublelife=False, processes=None):
+        """
+        Autoplay at every time offset, same as calling simulate(auto=True, time_offset=offset) for each of them on a
+        new simulator, but the chart and unit are set up once and each process reuses one state machine.
+        :param offsets: time offsets in ms
+        :param processes: number of worker processes to spread the offsets over, defaults to SIMULATION_PROCESSES
+        :return: DataFrame indexed by offset with score, perfects, misses, max_combo, lowest_life, lowest_life_time
+        and all_100 columns
+        """
+        start = time.time()
+        offsets = list(offsets)
+        self._setup_simulator(appeals=appeals, support=support, extra_bonus=extra_bonus,
+                              chara_bonus_set=chara_bonus_set, chara_bonus_value=chara_bonus_value,
+                              special_option=special_option, special_value=special_value, mirror=mirror)
+        grand = self.live.is_grand
+        if processes is None:
+            processes = SIMULATION_PROCESSES
+        if processes > 1 and len(offsets) > 1:
+            pool = get_process_pool(processes)
+            futures = [pool.submit(_simulate_auto_worker, self, grand, doublelife, chunk.tolist(),
+                                   self.special_offset)
+                       for chunk in np.array_split(np.array(offsets), min(processes, len(offsets)))]
+            rows = [row for future in futures for row in future.result()]
+        else:
+            rows = _simulate_auto_worker(self, grand, doublelife, offsets, self.special_offset)
+        logger.debug("Total run time for {} offsets: {:04.2f}s".format(len(offsets), time.time() - start))
+        return pd.DataFrame(rows, index=pd.Index(offsets, name="offset"),
+                            columns=["score", "perfects", "misses", "max_combo", "lowest_life", "lowest_life_time",
+                                     "all_100"])
+
+    def _simulate_auto_offset(self, impl, time_offset, special_offset):
+        impl.reset_machine(time_offset=time_offset, special_offset=get_auto_special_offset(time_offset, special_offset),
+                           auto=True)
+        note_scores, perfects, max_combo, lowest_life, lowest_life_time, all_100 = impl.simulate_impl_auto()
+        return (int(note_scores.sum()), perfects, self.note_count - perfects, max_combo, lowest_life,
+                (lowest_life_time // 1000) / 1000, all_100)
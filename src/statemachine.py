@@ -1,15 +1,16 @@
-import copy
-from bisect import bisect
+from heapq import heappop, heappush
 from math import ceil
 from random import random
 from typing import Dict, Union, List, Tuple
 
 import cython
 import numpy as np
-import pandas as pd
 
+from compiledchart import CompiledChart
+from settings import BONUS_MEMO_SIZE
 from logic.live import BaseLive
-from logic.skill import Skill
+from logic.skill import ActiveSkill, Skill, FLAG_AMR, FLAG_ALTERNATE, FLAG_MUTUAL, FLAG_REFRAIN, FLAG_SPARKLE, \
+    FLAG_GUARD, FLAG_CC, FLAG_OD, FLAG_OL, FLAG_ENCORE, FLAG_MAGIC
 from static.color import Color
 from static.judgement import Judgement
 from static.note_type import NoteType
@@ -17,6 +18,21 @@ from static.skill import get_sparkle_bonus
 from static.song_difficulty import PERFECT_TAP_RANGE, GREAT_TAP_RANGE, Difficulty, FLICK_DRAIN, NONFLICK_DRAIN
 
 
+def jitter_note_times(chart, jitter_uniforms, random_range):
+    """
+    Shift the notes of a chart by up to random_range seconds each way, without moving checkpoints before their time.
+    jitter_uniforms can be a 1-D array for one trial or a 2-D array with one row per trial.
+    :return: jittered note times and their deltas, both in microseconds
+    """
+    sec = chart.sec
+    checkpoints = chart.checkpoints_array
+    temp = sec + jitter_uniforms * 2 * random_range - random_range
+    temp[..., checkpoints] = np.maximum(temp[..., checkpoints], sec[checkpoints])
+    note_time_deltas = ((temp - sec) * 1E6).astype(np.int64)
+    note_time_stack = (temp * 1E6).astype(np.int64)
+    return note_time_stack, note_time_deltas
+
+
 class AbuseData:
     def __init__(self, score_delta, window_l, window_r, judgements):
         self.score_delta = score_delta
@@ -62,7 +78,7 @@ class UnitCacheBonus:
 
     def update(self, skill: Skill):
         # Do not update on alternate, mutual, refrain, boosters
-        if skill.is_alternate or skill.is_mutual or skill.is_refrain or skill.boost:
+        if skill.flags & FLAG_AMR or skill.boost:
             return
         if skill.act is not None:
             self.tap = max(self.tap, skill.values[0])
@@ -89,16 +105,16 @@ class UnitCacheBonus:
 
     def update_AMR(self, skill: Skill):
         # Do not update on skills that are not alternate, mutual, refrain
-        if skill.is_alternate:
+        if skill.flags & FLAG_ALTERNATE:
             self.alt_tap = ceil((self.tap - 100) * skill.values[1] / 1000)
             self.alt_flick = ceil((self.flick - 100) * skill.values[1] / 1000)
             self.alt_long = ceil((self.longg - 100) * skill.values[1] / 1000)
             self.alt_slide = ceil((self.slide - 100) * skill.values[1] / 1000)
             return
-        if skill.is_mutual:
+        if skill.flags & FLAG_MUTUAL:
             self.alt_combo = ceil((self.combo - 100) * skill.values[1] / 1000)
             return
-        if skill.is_refrain:
+        if skill.flags & FLAG_REFRAIN:
             self.ref_tap = max(self.ref_tap, self.tap - 100)
             self.ref_flick = max(self.ref_flick, self.flick - 100)
             self.ref_long = max(self.ref_long, self.longg - 100)
@@ -118,7 +134,9 @@ class StateMachine:
     difficulty: Difficulty
     doublelife: bool
     live: BaseLive
-    notes_data: pd.DataFrame
+    chart: CompiledChart
+    note_count: int
+    song_duration: float
     base_score: float
     helen_base_score: float
 
@@ -143,7 +161,9 @@ class StateMachine:
 
     skill_times: List[int]
     skill_indices: List[int]
-    skill_queue: Dict[int, Union[Skill, List[Skill]]]
+    note_cursor: int
+    skill_cursor: int
+    skill_queue: Dict[int, Union[ActiveSkill, List[ActiveSkill]]]
     reference_skills: List[Skill]
 
     life: int
@@ -153,10 +173,14 @@ class StateMachine:
     score_bonuses: List[int]
     combo_bonuses: List[int]
     judgements: List[Judgement]
+    lives: List[int]
     note_scores: np.ndarray
+    final_bonus: np.ndarray
     np_score_bonuses: np.ndarray
     np_combo_bonuses: np.ndarray
     cache_perfect_score_array: np.ndarray
+    cache_perfect_score_bonuses: List[int]
+    cache_perfect_combo_bonuses: List[int]
 
     last_activated_skill: List[int]
     last_activated_time: List[int]
@@ -168,18 +192,27 @@ class StateMachine:
     cache_support_bonus: int
     cache_score_bonus: int
     cache_combo_bonus: int
-    cache_magics: Dict[int, Union[Skill, List[Skill]]]
-    cache_non_magics: Dict[int, Union[Skill, List[Skill]]]
+    cache_magics: Dict[int, Union[ActiveSkill, List[ActiveSkill]]]
+    cache_non_magics: Dict[int, Union[ActiveSkill, List[ActiveSkill]]]
     cache_ls: Dict[int, int]
     cache_act: Dict[int, int]
     cache_alt: Dict[int, int]
     cache_mut: Dict[int, int]
     cache_ref: Dict[int, Tuple[int, int]]
     cache_enc: Dict[int, int]
+    cache_structure: tuple
+
+    # Bonus phase results by active skill structure (and v0/v1 for score/combo), kept across trials
+    boost_memo: Dict[tuple, tuple]
+    life_support_memo: Dict[tuple, tuple]
+    score_combo_memo: Dict[tuple, tuple]
+    memo_hits: int
+    memo_misses: int
 
     abuse: bool
     cache_hps: List[int]
     is_abuse: List[bool]
+    abuse_replay: List[bool]
     note_time_deltas_backup: List[int]
     note_idx_stack_backup: List[int]
     is_abuse_backup: List[bool]
@@ -187,15 +220,21 @@ class StateMachine:
     unit_caches: List[UnitCacheBonus]
     full_roll_chance: float
     has_cc: bool
+    activation_uniforms: np.ndarray
 
     auto: bool
     time_offset: int
     special_offset: int
     finish_pos: List[int]
     status: List[int]
-    delayed: List[bool]
     being_held: Dict[int, bool]
-    group_ids: List[int]
+    # Notes left to hit as [time, sequence, note index, delayed, group ID, alive] entries. Removed entries are only
+    # marked as not alive and skipped when they reach the top of a heap.
+    auto_queue: List[list]
+    auto_queue_size: int
+    auto_queue_sequence: int
+    auto_group_entries: Dict[int, List[list]]
+    auto_lane_queues: Dict[int, List[list]]
     lowest_life: int
     lowest_life_time: int
 
@@ -203,11 +242,26 @@ class StateMachine:
     force_encore_magic_to_encore_unit: bool
     allow_encore_magic_to_escape_max_agg: bool
 
-    def __init__(self, grand, difficulty, doublelife, live, notes_data, left_inclusive, right_inclusive, base_score,
+    # Skill composition of the unit, the specialized paths skip the phases it does not need
+    use_fast_paths: bool
+    has_magic: bool
+    has_encore: bool
+    has_amr: bool
+    has_sparkle: bool
+    has_act: bool
+    has_motif: bool
+    has_activation_checks: bool
+
+    def __init__(self, grand, difficulty, doublelife, live, chart, left_inclusive, right_inclusive, base_score,
                  helen_base_score, weights,
                  force_encore_amr_cache_to_encore_unit=False,
                  force_encore_magic_to_encore_unit=False,
-                 allow_encore_magic_to_escape_max_agg=False):
+                 allow_encore_magic_to_escape_max_agg=False,
+                 use_fast_paths=True,
+                 probabilities=None):
+        """
+        :param probabilities: activation probability of every card, instead of the ones of the live
+        """
         self.left_inclusive = left_inclusive
         self.right_inclusive = right_inclusive
         self.force_encore_amr_cache_to_encore_unit = force_encore_amr_cache_to_encore_unit
@@ -218,31 +272,28 @@ class StateMachine:
         self.difficulty = difficulty
         self.doublelife = doublelife
         self.live = live
-        self.notes_data = notes_data
+        self.chart = chart
+        self.note_count = chart.note_count
+        self.song_duration = chart.song_duration
         self.base_score = base_score
         self.helen_base_score = helen_base_score
 
         self.unit_offset = 3 if grand else 1
-        self.weights = weights
-
-        self._note_type_stack = self.notes_data.note_type.to_list()
-        self._note_idx_stack = self.notes_data.index.to_list()
-        self._special_note_types = list()
-        for _, note in self.notes_data.iterrows():
-            temp = list()
-            if note.is_flick:
-                temp.append(NoteType.FLICK)
-            if note.is_long:
-                temp.append(NoteType.LONG)
-            if note.is_slide:
-                temp.append(NoteType.SLIDE)
-            self._special_note_types.append(temp)
-        self.checkpoints = self.notes_data["checkpoints"].to_list()
+        # Copied because abuse appends the dummy notes to these
+        self.weights = list(weights)
+
+        self._note_type_stack = self.chart.note_types
+        self._note_idx_stack = list(range(self.note_count))
+        self._special_note_types = self.chart.special_note_types
+        self.checkpoints = self.chart.checkpoints.copy()
 
         self.probabilities = list()
         for unit_idx, unit in enumerate(self.live.unit.all_units):
             for card_idx, card in enumerate(unit.all_cards()):
-                self.probabilities.append(self.live.get_probability(unit_idx * 5 + card_idx))
+                if probabilities is None:
+                    self.probabilities.append(self.live.get_probability(unit_idx * 5 + card_idx))
+                else:
+                    self.probabilities.append(probabilities[unit_idx * 5 + card_idx])
                 card.skill.set_original_unit_idx(unit_idx)
 
         self._sparkle_bonus_ssr = get_sparkle_bonus(8, self.grand)
@@ -261,25 +312,60 @@ class StateMachine:
             for card in self.live.unit.all_cards()
         ])
 
+        # The general path handles every composition and stays the reference for the specialized one
+        self.use_fast_paths = use_fast_paths
+        skills = [card.skill for card in self.live.unit.all_cards()]
+        self.has_magic = any(skill.is_magic for skill in skills)
+        self.has_encore = any(skill.is_encore for skill in skills)
+        self.has_amr = any(skill.is_alternate or skill.is_mutual or skill.is_refrain for skill in skills)
+        self.has_sparkle = any(skill.is_sparkle for skill in skills)
+        self.has_act = any(skill.act is not None for skill in skills)
+        self.has_motif = any(skill.is_motif for skill in skills)
+        self.has_activation_checks = self.has_encore or self.has_amr or any(
+            skill.is_ol or skill.is_spike or skill.is_focus for skill in skills)
+
+        self.boost_memo = dict()
+        self.life_support_memo = dict()
+        self.score_combo_memo = dict()
+        self.memo_hits = 0
+        self.memo_misses = 0
+
         # Abuse stuff
         self.abuse = False
         self.cache_hps = list()
-        self.is_abuse = [False] * len(self.notes_data)
+        self.is_abuse = [False] * self.note_count
+        self.abuse_replay = list()
         self.cache_perfect_score_array = None
+        self.cache_perfect_score_bonuses = None
+        self.cache_perfect_combo_bonuses = None
 
     def get_note_scores(self):
         return self.note_scores
 
+    def get_final_bonus(self):
+        """
+        Judgement, score and combo bonus multiplier of every note of the last trial, scores are only these times the
+        base score and the note weights.
+        """
+        return self.final_bonus
+
     def get_full_roll_chance(self):
         return self.full_roll_chance
 
     def reset_machine(self, perfect_play=True, perfect_only=True, abuse=False, time_offset=0, special_offset=0,
-                      auto=False):
+                      auto=False, jitter_uniforms=None, activation_uniforms=None):
+        """
+        Prepare the machine for a new trial.
+        :param jitter_uniforms: uniform [0, 1) draws, one per note, used to jitter note timings in random trials
+        :param activation_uniforms: uniform [0, 1) draws indexed by (card index, activation index), used to decide
+        whether a skill activation with probability < 1 succeeds
+        """
 
         self.fail_simulate = not perfect_play
         self.perfect_only = perfect_only
         self.abuse = abuse
         self.auto = auto
+        self.activation_uniforms = activation_uniforms
 
         # List of all skill objects. Should not mutate. Original sets.
         self.reference_skills = [None]
@@ -293,6 +379,10 @@ class StateMachine:
         # Positive = activation, negative = deactivation.
         # E.g. 4 means the skill in slot 4 (counting from 1) activation, -4 means its deactivation
         self.skill_indices = list()
+        # Position of the next skill event and the next note to be handled. Consumed events are left in place, and
+        # deactivations of skills that did not activate are left as 0 and skipped by the cursor.
+        self.skill_cursor = 0
+        self.note_cursor = 0
 
         # Transient values of a state
         self.skill_queue = dict()  # What skills are currently active
@@ -304,8 +394,10 @@ class StateMachine:
         self.score_bonuses = list()
         self.combo_bonuses = list()
         self.judgements = list()
+        self.lives = list()  # Life after each handled note
 
         self.note_scores = None
+        self.final_bonus = None
         self.np_score_bonuses = None
         self.np_combo_bonuses = None
 
@@ -342,21 +434,26 @@ class StateMachine:
         if self.auto:
             self.time_offset = int(time_offset * 1E3)
             self.special_offset = int(special_offset * 1E6)
-            self.finish_pos = self.notes_data["finishPos"].map(int).to_list()
-            self.status = self.notes_data["status"].map(int).to_list()
-            self.group_ids = self.notes_data["groupId"].map(int).to_list()
-            self.delayed = [False] * len(self.notes_data)
+            self.finish_pos = self.chart.finish_pos
+            self.status = self.chart.status
             self.being_held = dict()
-            self.judgements = [Judgement.PERFECT for _ in range(len(self.notes_data))]
-            self.combos = [0] * len(self.notes_data)
-            self.score_bonuses = [0] * len(self.notes_data)
-            self.combo_bonuses = [0] * len(self.notes_data)
+            self.auto_queue = list()
+            self.auto_queue_size = 0
+            self.auto_queue_sequence = 0
+            self.auto_group_entries = dict()
+            self.auto_lane_queues = dict()
+            for note_idx, (note_time, group_id) in enumerate(zip(self.chart.note_times, self.chart.group_ids)):
+                self._push_auto_note(note_time, note_idx, False, group_id)
+            self.judgements = [Judgement.PERFECT for _ in range(self.note_count)]
+            self.combos = [0] * self.note_count
+            self.score_bonuses = [0] * self.note_count
+            self.combo_bonuses = [0] * self.note_count
             self.lowest_life = 9000
             self.lowest_life_time = -1
 
         # Initializing note data
         if abuse or perfect_play:
-            self.note_time_stack = self.notes_data.sec.map(lambda x: int(x * 1E6)).to_list()
+            self.note_time_stack = self.chart.note_times.copy()
             self.note_time_deltas = [0] * len(self.note_time_stack)
             self.note_type_stack = self._note_type_stack.copy()
             self.note_idx_stack = self._note_idx_stack.copy()
@@ -368,12 +465,9 @@ class StateMachine:
             random_range = PERFECT_TAP_RANGE[self.difficulty] / 2E6 \
                 if perfect_only else GREAT_TAP_RANGE[self.difficulty] / 2E6
 
-            temp = self.notes_data.sec + np.random.random(len(self.notes_data)) * 2 * random_range - random_range
-            temp[self.notes_data["checkpoints"]] = np.maximum(
-                temp[self.notes_data["checkpoints"]],
-                self.notes_data.loc[self.notes_data["checkpoints"], "sec"])
-            temp_note_time_deltas = (temp - self.notes_data.sec).map(lambda x: int(x * 1E6))
-            temp_note_time_stack = temp.map(lambda x: int(x * 1E6))
+            if jitter_uniforms is None:
+                jitter_uniforms = np.random.random(self.note_count)
+            temp_note_time_stack, temp_note_time_deltas = jitter_note_times(self.chart, jitter_uniforms, random_range)
             sorted_indices = np.argsort(temp_note_time_stack)
             self.note_time_stack = temp_note_time_stack[sorted_indices].tolist()
             self.note_time_deltas = temp_note_time_deltas[sorted_indices].tolist()
@@ -382,88 +476,98 @@ class StateMachine:
             self.special_note_types = [self._special_note_types[_] for _ in sorted_indices]
 
     def _helper_fill_abuse_dummies(self):
+        """
+        Add dummy notes at every offset that can change the judgement of a note: the judgement window edges and the
+        skill activations/deactivations (+-1 microsecond) inside the window.
+        """
         # Abuse should be the last stage of a simulation pipeline
-        assert len(self.checkpoints) == len(self.notes_data)
+        assert len(self.checkpoints) == self.note_count
 
-        def get_range(note_type_internal, special_note_types_internal, checkpoint_internal):
+        def get_category(note_type_internal, special_note_types_internal, checkpoint_internal):
             if note_type_internal == NoteType.TAP:
-                l_g = -GREAT_TAP_RANGE[self.live.difficulty]
-                l_p = -PERFECT_TAP_RANGE[self.live.difficulty]
-                r_g = GREAT_TAP_RANGE[self.live.difficulty]
-                r_p = PERFECT_TAP_RANGE[self.live.difficulty]
-                return (l_g, r_g), (l_g, l_p, r_p, r_g)
+                return 0
             elif NoteType.FLICK in special_note_types_internal and NoteType.SLIDE in special_note_types_internal:
-                l_p = -150000
-                r_p = 150000
-                return (l_p, r_p), (l_p, r_p)
+                return 1
             elif note_type_internal == NoteType.FLICK or note_type_internal == NoteType.LONG:
-                l_g = -180000
-                l_p = -150000
-                r_g = 180000
-                r_p = 150000
-                return (l_g, r_g), (l_g, l_p, r_p, r_g)
+                return 2
             elif not checkpoint_internal:
-                l_p = -200000
-                r_p = 200000
-                return (l_p, r_p), (l_p, r_p)
+                return 3
             else:
-                r_p = 200000
-                return (0, r_p), (r_p,)
-
-        for note_time, note_time_delta, note_type, note_idx, special_note_types, checkpoint, weight in zip(
-                self.note_time_stack[:],
-                self.note_time_deltas[:],
-                self.note_type_stack[:],
-                self.note_idx_stack[:],
-                self.special_note_types[:],
-                self.checkpoints[:],
-                self.weights[:]
-        ):
-            boundaries, deltas = get_range(note_type, special_note_types, checkpoint)
+                return 4
+
+        l_g = -GREAT_TAP_RANGE[self.live.difficulty]
+        l_p = -PERFECT_TAP_RANGE[self.live.difficulty]
+        r_g = GREAT_TAP_RANGE[self.live.difficulty]
+        r_p = PERFECT_TAP_RANGE[self.live.difficulty]
+        # Judgement window and judgement boundaries of each category
+        category_boundaries = np.array([(l_g, r_g), (-150000, 150000), (-180000, 180000), (-200000, 200000),
+                                        (0, 200000)], dtype=np.int64)
+        category_deltas = [(l_g, l_p, r_p, r_g), (-150000, 150000), (-180000, -150000, 150000, 180000),
+                           (-200000, 200000), (200000,)]
+        category_offsets = list()
+        for deltas in category_deltas:
+            offsets = list()
             for delta in deltas:
-                dummy_range = [delta]
+                offsets.append(delta)
                 if self.has_cc and delta != 0:
-                    dummy_range.append(delta // 2)
-                for _ in dummy_range:
-                    self.note_time_stack.append(note_time + _)
-                    self.note_time_deltas.append(_)
-                    self.note_type_stack.append(note_type)
-                    self.note_idx_stack.append(note_idx)
-                    self.special_note_types.append(special_note_types)
-                    self.checkpoints.append(checkpoint)
-                    self.is_abuse.append(True)
-                    self.weights.append(weight)
-            left, right = boundaries
-            left = note_time + left
-            right = note_time + right
-            for skill_time in self.skill_times:
-                for d in [-1, 0, 1]:
-                    test_skill_time = skill_time + d
-                    if test_skill_time > right:
-                        break
-                    if test_skill_time < left:
-                        continue
-                    if test_skill_time == note_time:
-                        continue
-                    delta = test_skill_time - note_time
-                    self.note_time_stack.append(test_skill_time)
-                    self.note_time_deltas.append(delta)
-                    self.note_type_stack.append(note_type)
-                    self.note_idx_stack.append(note_idx)
-                    self.special_note_types.append(special_note_types)
-                    self.checkpoints.append(checkpoint)
-                    self.is_abuse.append(True)
-                    self.weights.append(weight)
-
-        sorted_indices = np.argsort(self.note_time_stack)
-        self.note_time_stack = [self.note_time_stack[_] for _ in sorted_indices]
-        self.note_time_deltas = [self.note_time_deltas[_] for _ in sorted_indices]
-        self.note_type_stack = [self.note_type_stack[_] for _ in sorted_indices]
-        self.note_idx_stack = [self.note_idx_stack[_] for _ in sorted_indices]
-        self.special_note_types = [self.special_note_types[_] for _ in sorted_indices]
-        self.checkpoints = [self.checkpoints[_] for _ in sorted_indices]
-        self.is_abuse = [self.is_abuse[_] for _ in sorted_indices]
-        self.weights = [self.weights[_] for _ in sorted_indices]
+                    offsets.append(delta // 2)
+            category_offsets.append(offsets)
+        width = max(map(len, category_offsets))
+        offset_table = np.zeros((5, width), dtype=np.int64)
+        offset_mask = np.zeros((5, width), dtype=bool)
+        for category, offsets in enumerate(category_offsets):
+            offset_table[category, :len(offsets)] = offsets
+            offset_mask[category, :len(offsets)] = True
+
+        note_count = len(self.note_time_stack)
+        note_times = np.array(self.note_time_stack, dtype=np.int64)
+        categories = np.array([get_category(note_type, special_note_types, checkpoint)
+                               for note_type, special_note_types, checkpoint in zip(self.note_type_stack,
+                                                                                    self.special_note_types,
+                                                                                    self.checkpoints)], dtype=int)
+
+        # Dummies at the judgement boundaries
+        boundary_mask = offset_mask[categories]
+        boundary_sources = np.broadcast_to(np.arange(note_count)[:, None], boundary_mask.shape)[boundary_mask]
+        boundary_deltas = offset_table[categories][boundary_mask]
+
+        # Dummies around the skill times in the judgement window, found by bisecting the sorted skill times
+        skill_times = np.array(self.skill_times, dtype=np.int64)
+        left = note_times + category_boundaries[categories, 0]
+        right = note_times + category_boundaries[categories, 1]
+        lo = np.searchsorted(skill_times, left - 1, side='left')
+        hi = np.searchsorted(skill_times, right + 1, side='right')
+        counts = np.maximum(hi - lo, 0)
+        skill_sources = np.repeat(np.arange(note_count), counts)
+        skill_positions = lo[skill_sources] + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        candidates = skill_times[skill_positions][:, None] + np.array([-1, 0, 1])
+        skill_sources = np.broadcast_to(skill_sources[:, None], candidates.shape)
+        valid = np.logical_and(candidates >= left[skill_sources], candidates <= right[skill_sources])
+        valid = np.logical_and(valid, candidates != note_times[skill_sources])
+        skill_sources = skill_sources[valid]
+        skill_deltas = candidates[valid] - note_times[skill_sources]
+
+        sources = np.concatenate([np.arange(note_count), boundary_sources, skill_sources])
+        kinds = np.repeat([0, 1, 2], [note_count, len(boundary_sources), len(skill_sources)])
+        times = np.concatenate([note_times, note_times[boundary_sources] + boundary_deltas,
+                                note_times[skill_sources] + skill_deltas])
+        deltas = np.concatenate([np.array(self.note_time_deltas, dtype=np.int64), boundary_deltas, skill_deltas])
+        # Sorted by time, ties keep the notes first and then the dummies grouped by note
+        sorted_indices = np.lexsort((np.arange(len(sources)), kinds, sources, kinds > 0, times))
+        sources = sources[sorted_indices].tolist()
+        is_dummy = (kinds[sorted_indices] > 0).tolist()
+
+        self.note_time_stack = times[sorted_indices].tolist()
+        self.note_time_deltas = deltas[sorted_indices].tolist()
+        self.note_type_stack = [self.note_type_stack[_] for _ in sources]
+        self.note_idx_stack = [self.note_idx_stack[_] for _ in sources]
+        self.special_note_types = [self.special_note_types[_] for _ in sources]
+        self.checkpoints = [self.checkpoints[_] for _ in sources]
+        self.is_abuse = [dummy or self.is_abuse[source] for dummy, source in zip(is_dummy, sources)]
+        self.weights = [self.weights[_] for _ in sources]
+        # Only dummies of notes with a skill time in their window can be in a different skill state than the note
+        has_skill_in_window = (counts > 0).tolist()
+        self.abuse_replay = [dummy and has_skill_in_window[source] for dummy, source in zip(is_dummy, sources)]
 
         self.note_time_deltas_backup = self.note_time_deltas.copy()
         self.note_idx_stack_backup = self.note_idx_stack.copy()
@@ -486,16 +590,20 @@ class StateMachine:
                 iterating_order.append((card_idx, card))
             iterating_order = _cache_magic + iterating_order + _cache_cached_classes
             for card_idx, card in iterating_order:
-                skill = copy.copy(card.skill)
+                skill = card.skill
                 idx = unit_idx * 5 + card_idx
                 self.reference_skills[idx + 1] = skill
                 if self.probabilities[idx] == 0:
                     continue
-                times = int((self.notes_data.iloc[-1].sec - 3) // skill.interval)
+                times = int((self.song_duration - 3) // skill.interval)
                 skill_range = list(range(skill.offset + 1, times + 1, self.unit_offset))
                 for act_idx in skill_range:
                     if self.probabilities[idx] < 1 and self.fail_simulate:
-                        if random() > self.probabilities[idx]:
+                        if self.activation_uniforms is None:
+                            roll = random()
+                        else:
+                            roll = self.activation_uniforms[idx, act_idx]
+                        if roll > self.probabilities[idx]:
                             continue
                     act = act_idx * skill.interval
                     deact = act_idx * skill.interval + skill.duration
@@ -513,22 +621,25 @@ class StateMachine:
     def simulate_impl(self, skip_activation_initialization=False) -> Tuple[int, object]:
         if not skip_activation_initialization:
             self.initialize_activation_arrays()
+        note_count = len(self.note_time_stack)
         while True:
+            has_skill = self.skill_cursor < len(self.skill_times)
+            has_note = self.note_cursor < note_count
             # Terminal condition: No more skills and no more notes
-            if len(self.skill_times) == 0 and len(self.note_time_stack) == 0:
+            if not has_skill and not has_note:
                 break
 
-            if len(self.skill_times) == 0:
+            if not has_skill:
                 self.handle_note()
-            elif len(self.note_time_stack) == 0:
+            elif not has_note:
                 self.handle_skill()
-            elif self.note_time_stack[0] < self.skill_times[0]:
+            elif self.note_time_stack[self.note_cursor] < self.skill_times[self.skill_cursor]:
                 self.handle_note()
-            elif self.skill_times[0] < self.note_time_stack[0]:
+            elif self.skill_times[self.skill_cursor] < self.note_time_stack[self.note_cursor]:
                 self.handle_skill()
             else:
-                if (self.skill_indices[0] > 0 and self.left_inclusive) or \
-                        (self.skill_indices[0] < 0 and not self.right_inclusive):
+                if (self.skill_indices[self.skill_cursor] > 0 and self.left_inclusive) or \
+                        (self.skill_indices[self.skill_cursor] < 0 and not self.right_inclusive):
                     self.handle_skill()
                 else:
                     self.handle_note()
@@ -553,6 +664,7 @@ class StateMachine:
             final_bonus = judgement_multipliers
             final_bonus *= self.np_score_bonuses
             final_bonus[1:] *= self.np_combo_bonuses[1:]
+        self.final_bonus = final_bonus
 
         self.note_scores = np.round(
             self.base_score
@@ -562,6 +674,8 @@ class StateMachine:
 
         if not self.fail_simulate and not self.abuse:
             self.cache_perfect_score_array = self.note_scores.copy()
+            self.cache_perfect_score_bonuses = self.score_bonuses.copy()
+            self.cache_perfect_combo_bonuses = self.combo_bonuses.copy()
 
         if self.abuse:
             assert self.cache_perfect_score_array is not None
@@ -572,28 +686,28 @@ class StateMachine:
     def simulate_impl_auto(self):
         self.initialize_activation_arrays()
         while True:
+            has_skill = self.skill_cursor < len(self.skill_times)
             # Terminal condition: No more skills and no more notes
-            if len(self.skill_times) == 0 and len(self.note_time_stack) == 0:
+            if not has_skill and self.auto_queue_size == 0:
                 break
 
-            if len(self.skill_times) == 0:
+            if not has_skill:
                 self.handle_note_auto()
-            elif len(self.note_time_stack) == 0:
-                temp = self.skill_times[0]
+                continue
+            skill_time = self.skill_times[self.skill_cursor]
+            if self.auto_queue_size == 0:
                 self.handle_skill()
-                self.break_hold(temp)
-            elif self.note_time_stack[0] < self.skill_times[0]:
+                self.break_hold(skill_time)
+            elif self._peek_auto_time() < skill_time:
                 self.handle_note_auto()
-            elif self.skill_times[0] < self.note_time_stack[0]:
-                temp = self.skill_times[0]
+            elif skill_time < self._peek_auto_time():
                 self.handle_skill()
-                self.break_hold(temp)
+                self.break_hold(skill_time)
             else:
-                if (self.skill_indices[0] > 0 and self.left_inclusive) or \
-                        (self.skill_indices[0] < 0 and not self.right_inclusive):
-                    temp = self.skill_times[0]
+                if (self.skill_indices[self.skill_cursor] > 0 and self.left_inclusive) or \
+                        (self.skill_indices[self.skill_cursor] < 0 and not self.right_inclusive):
                     self.handle_skill()
-                    self.break_hold(temp)
+                    self.break_hold(skill_time)
                 else:
                     self.handle_note_auto()
 
@@ -606,13 +720,14 @@ class StateMachine:
         if any(mask):
             final_bonus[mask] *= self.np_combo_bonuses[mask]
         final_bonus *= self.np_score_bonuses
-        self.weights = [
+        # Not written back to self.weights so the machine can be reset for another offset
+        weights = [
             0 if combo == 0 else self.weights[combo - 1] for combo in self.combos
         ]
 
         self.note_scores = np.round(
             self.base_score
-            * np.array(self.weights)
+            * np.array(weights)
             * final_bonus
         )
 
@@ -645,40 +760,60 @@ class StateMachine:
             self.lowest_life = self.life
             self.lowest_life_time = skill_time
 
+    def _push_auto_note(self, note_time, note_idx, delayed, group_id):
+        # The sequence keeps notes at the same time in insertion order, later ones after earlier ones
+        entry = [note_time, self.auto_queue_sequence, note_idx, delayed, group_id, True]
+        self.auto_queue_sequence += 1
+        self.auto_queue_size += 1
+        heappush(self.auto_queue, entry)
+        heappush(self.auto_lane_queues.setdefault(self.finish_pos[note_idx], list()), entry)
+        self.auto_group_entries.setdefault(group_id, list()).append(entry)
+
+    def _remove_auto_note(self, entry):
+        entry[5] = False
+        self.auto_queue_size -= 1
+
+    def _peek_auto_time(self):
+        while not self.auto_queue[0][5]:
+            heappop(self.auto_queue)
+        return self.auto_queue[0][0]
+
+    def _pop_auto_note(self):
+        while True:
+            entry = heappop(self.auto_queue)
+            if entry[5]:
+                self._remove_auto_note(entry)
+                return entry
+
     def _handle_slide_break(self, group_id):
         if group_id not in self.being_held or not self.being_held[group_id]:
-            remove_indices = list()
+            entries = sorted(entry for entry in self.auto_group_entries.get(group_id, list()) if entry[5])
+            self.auto_group_entries[group_id] = entries
             last_was_slide = True
-            for idx, (check_note_idx, check_group_id) in enumerate(zip(self.note_idx_stack, self.group_ids)):
+            for entry in entries:
+                check_note_idx = entry[2]
                 check_note_type = self.note_type_stack[check_note_idx]
-                if check_group_id == group_id:
-                    if check_note_type is NoteType.SLIDE or last_was_slide:
-                        self.judgements[check_note_idx] = Judgement.MISS
-                        remove_indices.append(idx)
-                    if last_was_slide and check_note_type is not NoteType.SLIDE:
-                        last_was_slide = False
-            for idx in reversed(remove_indices):
-                self.note_idx_stack.pop(idx)
-                self.note_time_stack.pop(idx)
-                self.delayed.pop(idx)
-                self.group_ids.pop(idx)
+                if check_note_type is NoteType.SLIDE or last_was_slide:
+                    self.judgements[check_note_idx] = Judgement.MISS
+                    self._remove_auto_note(entry)
+                if last_was_slide and check_note_type is not NoteType.SLIDE:
+                    last_was_slide = False
 
     def _handle_long_break(self, neg_finish_pos, is_long_start=False):
         if neg_finish_pos in self.being_held or is_long_start:
-            for idx, check_note_idx in enumerate(self.note_idx_stack):
-                if self.finish_pos[check_note_idx] == -neg_finish_pos:
-                    break
-            self.note_idx_stack.pop(idx)
-            self.note_time_stack.pop(idx)
-            self.delayed.pop(idx)
-            self.group_ids.pop(idx)
-            self.judgements[check_note_idx] = Judgement.MISS
+            lane_queue = self.auto_lane_queues.get(-neg_finish_pos, list())
+            while lane_queue and not lane_queue[0][5]:
+                heappop(lane_queue)
+            if lane_queue:
+                entry = lane_queue[0]
+            else:
+                # Nothing left on the lane, the last note in the queue is the one dropped
+                entry = max(entry for entry in self.auto_queue if entry[5])
+            self._remove_auto_note(entry)
+            self.judgements[entry[2]] = Judgement.MISS
 
     def handle_note_auto(self):
-        note_idx = self.note_idx_stack.pop(0)
-        note_time = self.note_time_stack.pop(0)
-        delayed = self.delayed.pop(0)
-        group_id = self.group_ids.pop(0)
+        note_time, _, note_idx, delayed, group_id, _ = self._pop_auto_note()
         note_type = self.note_type_stack[note_idx]
         is_checkpoint = self.checkpoints[note_idx]
         finish_pos = self.finish_pos[note_idx]
@@ -693,11 +828,7 @@ class StateMachine:
             new_note_time = note_time + self.time_offset
             if note_type != NoteType.TAP:
                 new_note_time += self.special_offset
-            insert_idx = bisect(self.note_time_stack, new_note_time)
-            self.note_time_stack.insert(insert_idx, new_note_time)
-            self.note_idx_stack.insert(insert_idx, note_idx)
-            self.delayed.insert(insert_idx, True)
-            self.group_ids.insert(insert_idx, group_id)
+            self._push_auto_note(new_note_time, note_idx, True, group_id)
             return
 
         if self.has_skill_change:
@@ -740,11 +871,7 @@ class StateMachine:
             new_note_time = note_time + self.time_offset
             if note_type != NoteType.TAP:
                 new_note_time += self.special_offset
-            insert_idx = bisect(self.note_time_stack, new_note_time)
-            self.note_time_stack.insert(insert_idx, new_note_time)
-            self.note_idx_stack.insert(insert_idx, note_idx)
-            self.delayed.insert(insert_idx, True)
-            self.group_ids.insert(insert_idx, group_id)
+            self._push_auto_note(new_note_time, note_idx, True, group_id)
             return
         else:
             score_bonus = 0
@@ -766,11 +893,11 @@ class StateMachine:
             self.lowest_life_time = note_time
 
     def _handle_abuse_results(self):
-        left_windows = [2E9] * len(self.notes_data)
-        right_windows = [-2E9] * len(self.notes_data)
+        left_windows = [2E9] * self.note_count
+        right_windows = [-2E9] * self.note_count
         max_score = self.cache_perfect_score_array.copy()
-        is_abuses = [False] * len(self.notes_data)
-        judgements = [Judgement.PERFECT] * len(self.notes_data)
+        is_abuses = [False] * self.note_count
+        judgements = [Judgement.PERFECT] * self.note_count
         for _, (delta, note_idx, score, is_abuse, judgement) in enumerate(zip(
                 self.note_time_deltas_backup,
                 self.note_idx_stack_backup,
@@ -794,8 +921,11 @@ class StateMachine:
         return sum(max_score), abuse_data
 
     def handle_skill(self):
+        if self.use_fast_paths:
+            self._handle_skill_specialized()
+            return
         self.has_skill_change = True
-        if self.skill_indices[0] > 0:
+        if self.skill_indices[self.skill_cursor] > 0:
             if not self._expand_encore():
                 return
             self._expand_magic()
@@ -805,12 +935,42 @@ class StateMachine:
             self._evaluate_ls()
             self._cache_skill_data()
             self._cache_AMR()
-            self.skill_indices.pop(0)
-            self.skill_times.pop(0)
         else:
-            self.skill_queue.pop(-self.skill_indices[0])
-            self.skill_indices.pop(0)
-            self.skill_times.pop(0)
+            self.skill_queue.pop(-self.skill_indices[self.skill_cursor])
+        self._advance_skill_cursor()
+
+    def _handle_skill_specialized(self):
+        """
+        Same as the general path, without the steps for skill types the unit does not have.
+        """
+        self.has_skill_change = True
+        if self.skill_indices[self.skill_cursor] > 0:
+            if self.has_encore and not self._expand_encore():
+                return
+            if self.has_magic or self.has_encore:
+                self._expand_magic()
+            self._handle_skill_activation()
+            if self.has_motif:
+                self._evaluate_motif()
+            if self.has_sparkle:
+                self._evaluate_ls()
+            # Unit caches are only read by alternate, mutual and refrain
+            if self.has_amr:
+                self._cache_skill_data()
+                self._cache_AMR()
+        else:
+            self.skill_queue.pop(-self.skill_indices[self.skill_cursor])
+        self._advance_skill_cursor()
+
+    def _advance_skill_cursor(self):
+        self.skill_cursor += 1
+        while self.skill_cursor < len(self.skill_indices) and self.skill_indices[self.skill_cursor] == 0:
+            self.skill_cursor += 1
+
+    def _cancel_deactivation(self, skill_id):
+        # First index of -skill_id should be the correct value because a skill cannot activate twice before
+        # deactivating once
+        self.skill_indices[self.skill_indices.index(-skill_id, self.skill_cursor)] = 0
 
     def handle_note(self):
         if self.abuse:
@@ -819,10 +979,11 @@ class StateMachine:
             self._handle_note_no_abuse()
 
     def _handle_note_no_abuse(self):
-        note_time = self.note_time_stack.pop(0)
-        note_delta = self.note_time_deltas.pop(0)
-        note_type = self.note_type_stack.pop(0)
-        note_idx = self.note_idx_stack.pop(0)
+        cursor = self.note_cursor
+        self.note_cursor += 1
+        note_delta = self.note_time_deltas[cursor]
+        note_type = self.note_type_stack[cursor]
+        note_idx = self.note_idx_stack[cursor]
         self.combo += 1
         self.combos.append(self.combo)
         score_bonus, combo_bonus = self.evaluate_bonuses(self.special_note_types[note_idx])
@@ -832,16 +993,23 @@ class StateMachine:
             self.judgements.append(Judgement.PERFECT)
         self.score_bonuses.append(score_bonus)
         self.combo_bonuses.append(combo_bonus)
+        self.lives.append(self.life)
         self.has_skill_change = False
 
     def _handle_note_abuse(self):
-        note_time = self.note_time_stack.pop(0)
-        note_delta = self.note_time_deltas.pop(0)
-        note_type = self.note_type_stack.pop(0)
-        note_idx = self.note_idx_stack.pop(0)
-        special_note_types = self.special_note_types.pop(0)
-        is_checkpoint = self.checkpoints.pop(0)
-        is_abuse = self.is_abuse.pop(0)
+        cursor = self.note_cursor
+        self.note_cursor += 1
+        note_delta = self.note_time_deltas[cursor]
+        note_type = self.note_type_stack[cursor]
+        note_idx = self.note_idx_stack[cursor]
+        special_note_types = self.special_note_types[cursor]
+        is_checkpoint = self.checkpoints[cursor]
+        is_abuse = self.is_abuse[cursor]
+
+        if self.use_fast_paths and not self.abuse_replay[cursor]:
+            self._handle_note_abuse_cached(note_delta, note_type, note_idx, special_note_types, is_checkpoint,
+                                           is_abuse)
+            return
 
         if not is_abuse:
             self.combo += 1
@@ -860,22 +1028,40 @@ class StateMachine:
         self.combo_bonuses.append(combo_bonus)
         self.has_skill_change = False
 
+    def _handle_note_abuse_cached(self, note_delta, note_type, note_idx, special_note_types, is_checkpoint, is_abuse):
+        """
+        Notes and dummies with no skill time in the note's judgement window are in the same skill state as the note
+        was in the perfect play, so the bonuses from the perfect play are reused and only the judgement is evaluated.
+        """
+        if not is_abuse:
+            self.combo += 1
+            # Dummies do not heal, so life after the note is the same as in the perfect play
+            self.life = self.cache_hps[note_idx]
+            judgement = Judgement.PERFECT
+        else:
+            judgement = self.evaluate_judgement(note_delta, note_type, special_note_types,
+                                                abuse_check=True, is_checkpoint=is_checkpoint)
+        self.combos.append(self.combo)
+        self.judgements.append(judgement)
+        self.score_bonuses.append(self.cache_perfect_score_bonuses[note_idx])
+        self.combo_bonuses.append(self.cache_perfect_combo_bonuses[note_idx])
+
     def evaluate_judgement(self, note_delta, note_type, special_note_types,
                            abuse_check=False, is_checkpoint=False) -> Judgement:
         def check_skill(func):
             for _, skills in self.skill_queue.items():
-                if isinstance(skills, Skill) and func(skills):
+                if isinstance(skills, ActiveSkill) and func(skills):
                     return True
                 for skill in skills:
                     if func(skill):
                         return True
             return False
 
-        has_cc = self.has_cc and check_skill(lambda skill: skill.is_cc)
-        has_od = self.has_od and check_skill(lambda skill: skill.is_od)
+        has_cc = self.has_cc and check_skill(lambda skill: skill.flags & FLAG_CC)
+        has_od = self.has_od and check_skill(lambda skill: skill.flags & FLAG_OD)
         # Short circuit OL check if not dealing with OD
         # Just ignore the other cases of combo saving skills since they are not meta
-        has_ol = has_od and self.has_ol and check_skill(lambda skill: skill.is_ol)
+        has_ol = has_od and self.has_ol and check_skill(lambda skill: skill.flags & FLAG_OL)
         if abuse_check:
             if note_type == NoteType.TAP:
                 l_g = GREAT_TAP_RANGE[self.live.difficulty]
@@ -935,6 +1121,8 @@ class StateMachine:
                 return Judgement.GREAT
 
     def evaluate_bonuses(self, special_note_types, skip_healing=False, fixed_life=None):
+        if self.use_fast_paths:
+            return self._evaluate_bonuses_specialized(special_note_types, skip_healing, fixed_life)
         if self.has_skill_change:
             self.separate_magics_non_magics()
         magics = self.cache_magics
@@ -954,6 +1142,35 @@ class StateMachine:
         score_bonus, combo_bonus = self._evaluate_bonuses_phase_score_combo(magics, non_magics, max_boosts, sum_boosts)
         return score_bonus, combo_bonus
 
+    def _evaluate_bonuses_specialized(self, special_note_types, skip_healing=False, fixed_life=None):
+        """
+        Same as the general path, without the phases for skill types the unit does not have.
+        """
+        if self.has_skill_change:
+            if self.has_magic or self.has_encore:
+                self.separate_magics_non_magics()
+            else:
+                self._cache_magics_non_magics(dict(), dict(self.skill_queue))
+        magics = self.cache_magics
+        non_magics = self.cache_non_magics
+        max_boosts, sum_boosts = self._evaluate_bonuses_phase_boost(magics, non_magics)
+        life_bonus, support_bonus = self._evaluate_bonuses_phase_life_support(magics, non_magics, max_boosts,
+                                                                              sum_boosts)
+        if not skip_healing:
+            self.life += life_bonus
+            self.life = min(self.max_life, self.life)  # Cap life
+        if not self.fail_simulate and not self.abuse:
+            self.cache_hps.append(self.life)
+        if self.has_sparkle:
+            self._helper_evaluate_ls(fixed_life)
+        if self.has_act:
+            self._helper_evaluate_act(special_note_types)
+        if self.has_amr:
+            self._helper_evaluate_alt_mutual_ref(special_note_types)
+        self._helper_normalize_score_combo_bonuses()
+        score_bonus, combo_bonus = self._evaluate_bonuses_phase_score_combo(magics, non_magics, max_boosts, sum_boosts)
+        return score_bonus, combo_bonus
+
     def separate_magics_non_magics(self):
         magics = dict()
         non_magics = dict()
@@ -965,15 +1182,41 @@ class StateMachine:
                 magics[skill_idx] = skills
             else:
                 non_magics[skill_idx] = skills
+        self._cache_magics_non_magics(magics, non_magics)
+
+    def _cache_magics_non_magics(self, magics, non_magics):
         self.cache_magics = magics
         self.cache_non_magics = non_magics
+        # Everything the bonus phases read from the queue except v0/v1, which the note helpers change
+        self.cache_structure = tuple(
+            (skill_idx, skill_idx in magics,
+             # Skills are unhashable, they are alive as long as the live is, so their IDs are stable
+             (id(skills.skill),) if isinstance(skills, ActiveSkill) else tuple(id(skill.skill) for skill in skills))
+            for skill_idx, skills in self.skill_queue.items())
+
+    def _get_memo(self, memo, key):
+        value = memo.get(key)
+        if value is None:
+            self.memo_misses += 1
+        else:
+            self.memo_hits += 1
+        return value
+
+    @staticmethod
+    def _set_memo(memo, key, value):
+        if len(memo) >= BONUS_MEMO_SIZE:
+            memo.pop(next(iter(memo)))
+        memo[key] = value
+
+    def get_memo_stats(self):
+        return self.memo_hits, self.memo_misses
 
     def _check_guard(self):
         for _, skills in self.skill_queue.items():
-            if isinstance(skills, Skill) and skills.is_guard:
+            if isinstance(skills, ActiveSkill) and skills.flags & FLAG_GUARD:
                 return True
             for skill in skills:
-                if skill.is_guard:
+                if skill.flags & FLAG_GUARD:
                     return True
         return False
 
@@ -992,7 +1235,7 @@ class StateMachine:
             trimmed_life = self.life // 10
         for idx, skills in self.skill_queue.items():
             for skill in skills:
-                if skill.is_sparkle:
+                if skill.flags & FLAG_SPARKLE:
                     if skill.values[0] == 1:
                         skill.v1 = self._sparkle_bonus_ssr[trimmed_life] - 100
                     else:
@@ -1032,11 +1275,14 @@ class StateMachine:
     def _helper_evaluate_alt_mutual_ref(self, special_note_types):
         for idx, skills in self.skill_queue.items():
             for skill in skills:
+                flags = skill.flags
+                if not flags & FLAG_AMR:
+                    continue
                 if self.force_encore_amr_cache_to_encore_unit:
                     unit_idx = (idx - 1) // 5
                 else:
                     unit_idx = skill.original_unit_idx
-                if skill.is_alternate:
+                if flags & FLAG_ALTERNATE:
                     skill.v1 = skill.values[0] - 100
                     skill.v0 = self.unit_caches[unit_idx].alt_tap
                     if NoteType.FLICK in special_note_types:
@@ -1050,7 +1296,7 @@ class StateMachine:
                     self.cache_alt[idx] = skill.v0
                     skill.normalized = True
                     continue
-                if skill.is_mutual:
+                if flags & FLAG_MUTUAL:
                     skill.v0 = skill.values[0] - 100
                     skill.v1 = self.unit_caches[unit_idx].alt_combo
                     if idx not in self.cache_mut or self.cache_mut[idx] != skill.v1:
@@ -1058,7 +1304,7 @@ class StateMachine:
                     self.cache_mut[idx] = skill.v1
                     skill.normalized = True
                     continue
-                if skill.is_refrain:
+                if flags & FLAG_REFRAIN:
                     skill.v0 = self.unit_caches[unit_idx].ref_tap
                     if NoteType.FLICK in special_note_types:
                         skill.v0 = max(skill.v0, self.unit_caches[unit_idx].ref_tap)
@@ -1074,9 +1320,13 @@ class StateMachine:
                     skill.normalized = True
                     continue
 
-    def _evaluate_bonuses_phase_boost(self, magics: Dict[int, List[Skill]], non_magics: Dict[int, List[Skill]]):
+    def _evaluate_bonuses_phase_boost(self, magics: Dict[int, List[ActiveSkill]], non_magics: Dict[int, List[ActiveSkill]]):
         if not self.has_skill_change:
             return self.cache_max_boosts, self.cache_sum_boosts
+        memo = self._get_memo(self.boost_memo, self.cache_structure)
+        if memo is not None:
+            self.cache_max_boosts, self.cache_sum_boosts = memo
+            return memo
 
         magic_boosts = [
             # Score, Combo, Life, Support
@@ -1105,8 +1355,8 @@ class StateMachine:
 
         for non_magic_idx, skills in non_magics.items():
             assert len(skills) == 1 \
-                   or self.reference_skills[non_magic_idx].is_encore \
-                   and self.reference_skills[self.cache_enc[non_magic_idx]].is_magic
+                   or self.reference_skills[non_magic_idx].flags & FLAG_ENCORE \
+                   and self.reference_skills[self.cache_enc[non_magic_idx]].flags & FLAG_MAGIC
             for skill in skills:
                 if not skill.boost:
                     continue
@@ -1132,12 +1382,17 @@ class StateMachine:
                 sum_boosts[i][j] /= 1000
         self.cache_max_boosts = max_boosts
         self.cache_sum_boosts = sum_boosts
+        self._set_memo(self.boost_memo, self.cache_structure, (max_boosts, sum_boosts))
         return max_boosts, sum_boosts
 
-    def _evaluate_bonuses_phase_life_support(self, magics: Dict[int, List[Skill]], non_magics: Dict[int, List[Skill]],
+    def _evaluate_bonuses_phase_life_support(self, magics: Dict[int, List[ActiveSkill]], non_magics: Dict[int, List[ActiveSkill]],
                                              max_boosts, sum_boosts):
         if not self.has_skill_change:
             return self.cache_life_bonus, self.cache_support_bonus
+        memo = self._get_memo(self.life_support_memo, self.cache_structure)
+        if memo is not None:
+            self.cache_life_bonus, self.cache_support_bonus = memo
+            return memo
         temp_life_results = dict()
         temp_support_results = dict()
         for magic_idx, skills in magics.items():
@@ -1160,8 +1415,8 @@ class StateMachine:
                                                           ceil(skill.v3 + boost_dict[color][3]))
         for non_magic_idx, skills in non_magics.items():
             assert len(skills) == 1 \
-                   or self.reference_skills[non_magic_idx].is_encore \
-                   and self.reference_skills[self.cache_enc[non_magic_idx]].is_magic
+                   or self.reference_skills[non_magic_idx].flags & FLAG_ENCORE \
+                   and self.reference_skills[self.cache_enc[non_magic_idx]].flags & FLAG_MAGIC
             for skill in skills:
                 if skill.boost:
                     continue
@@ -1203,12 +1458,21 @@ class StateMachine:
             unit_support_bonuses.append(agg_func((unified_magic_support, unified_non_magic_support)))
         self.cache_life_bonus = max(unit_life_bonuses)
         self.cache_support_bonus = max(unit_support_bonuses)
+        self._set_memo(self.life_support_memo, self.cache_structure, (self.cache_life_bonus, self.cache_support_bonus))
         return self.cache_life_bonus, self.cache_support_bonus
 
-    def _evaluate_bonuses_phase_score_combo(self, magics: Dict[int, List[Skill]], non_magics: Dict[int, List[Skill]],
+    def _evaluate_bonuses_phase_score_combo(self, magics: Dict[int, List[ActiveSkill]], non_magics: Dict[int, List[ActiveSkill]],
                                             max_boosts, sum_boosts):
         if not self.has_skill_change:
             return self.cache_score_bonus, self.cache_combo_bonus
+        memo_key = (self.cache_structure, tuple(value
+                                                for skills in self.skill_queue.values()
+                                                for skill in ((skills,) if isinstance(skills, ActiveSkill) else skills)
+                                                for value in (skill.v0, skill.v1)))
+        memo = self._get_memo(self.score_combo_memo, memo_key)
+        if memo is not None:
+            self.cache_score_bonus, self.cache_combo_bonus = memo
+            return memo
         temp_score_results = dict()
         temp_combo_results = dict()
         for magic_idx, skills in magics.items():
@@ -1239,8 +1503,8 @@ class StateMachine:
                 temp_combo_results[magic_idx] = 0
         for non_magic_idx, skills in non_magics.items():
             assert len(skills) == 1 \
-                   or self.reference_skills[non_magic_idx].is_encore \
-                   and self.reference_skills[self.cache_enc[non_magic_idx]].is_magic
+                   or self.reference_skills[non_magic_idx].flags & FLAG_ENCORE \
+                   and self.reference_skills[self.cache_enc[non_magic_idx]].flags & FLAG_MAGIC
             for skill in skills:
                 if skill.boost:
                     continue
@@ -1310,22 +1574,23 @@ class StateMachine:
         max_combo_bonus = max(unit_combo_bonuses)
         self.cache_score_bonus = max_score_bonus if max_score_bonus > 0 else min_score_bonus
         self.cache_combo_bonus = max_combo_bonus if max_combo_bonus > 0 else min_combo_bonus
+        self._set_memo(self.score_combo_memo, memo_key, (self.cache_score_bonus, self.cache_combo_bonus))
         return self.cache_score_bonus, self.cache_combo_bonus
 
     def _expand_magic(self):
-        skill = copy.deepcopy(self.reference_skills[self.skill_indices[0]])
+        skill = self.reference_skills[self.skill_indices[self.skill_cursor]]
         if skill.is_magic or \
-                (skill.is_encore and self.skill_queue[self.skill_indices[0]].is_magic):
+                (skill.is_encore and self.skill_queue[self.skill_indices[self.skill_cursor]].is_magic):
             if skill.is_magic or self.force_encore_magic_to_encore_unit:
-                unit_idx = (self.skill_indices[0] - 1) // 5
+                unit_idx = (self.skill_indices[self.skill_cursor] - 1) // 5
             else:
-                unit_idx = (self.cache_enc[self.skill_indices[0]] - 1) // 5
-            self.skill_queue[self.skill_indices[0]] = list()
+                unit_idx = (self.cache_enc[self.skill_indices[self.skill_cursor]] - 1) // 5
+            self.skill_queue[self.skill_indices[self.skill_cursor]] = list()
             iterating_order = list()
             _cache_cached_classes = list()
             for idx in range(unit_idx * 5, unit_idx * 5 + 5):
                 idx = idx + 1
-                copied_skill = copy.deepcopy(self.reference_skills[idx])
+                copied_skill = ActiveSkill(self.reference_skills[idx])
                 # Skip skills that cannot activate
                 if self.reference_skills[idx].probability == 0:
                     continue
@@ -1340,7 +1605,7 @@ class StateMachine:
                         continue
                     # Or the skill for encore to copy is magic as well, skip
                     # Do not allow magic-encore-magic
-                    copied_skill = copy.deepcopy(self.reference_skills[copied_skill])
+                    copied_skill = ActiveSkill(self.reference_skills[copied_skill])
                     if copied_skill.is_magic:
                         continue
                     # Else let magic copy the encored skill instead
@@ -1350,30 +1615,26 @@ class StateMachine:
                 iterating_order.append(copied_skill)
             iterating_order = iterating_order + _cache_cached_classes
             for _ in iterating_order:
-                self.skill_queue[self.skill_indices[0]].append(_)
+                self.skill_queue[self.skill_indices[self.skill_cursor]].append(_)
 
     def _expand_encore(self):
-        skill = self.reference_skills[self.skill_indices[0]]
+        skill = self.reference_skills[self.skill_indices[self.skill_cursor]]
         if skill.is_encore:
             last_encoreable_skill = self._get_last_encoreable_skill()
             if last_encoreable_skill is None:
-                pop_skill_index = self.skill_indices.index(-self.skill_indices[0])
-                self.skill_times.pop(pop_skill_index)
-                self.skill_indices.pop(pop_skill_index)
-                self.skill_indices.pop(0)
-                self.skill_times.pop(0)
+                self._cancel_deactivation(self.skill_indices[self.skill_cursor])
+                self._advance_skill_cursor()
                 return False
-            encore_copy: Skill = copy.deepcopy(self.reference_skills[last_encoreable_skill])
-            encore_copy.interval = skill.interval
-            encore_copy.duration = skill.duration
-            self.skill_queue[self.skill_indices[0]] = encore_copy
-            self.cache_enc[self.skill_indices[0]] = last_encoreable_skill
+            # Timings were already laid out from the encore itself, the copy only needs the values
+            encore_copy = ActiveSkill(self.reference_skills[last_encoreable_skill])
+            self.skill_queue[self.skill_indices[self.skill_cursor]] = encore_copy
+            self.cache_enc[self.skill_indices[self.skill_cursor]] = last_encoreable_skill
         return True
 
     def _get_last_encoreable_skill(self):
         if len(self.last_activated_skill) == 0:
             return None
-        if self.skill_times[0] > self.last_activated_time[-1]:
+        if self.skill_times[self.skill_cursor] > self.last_activated_time[-1]:
             return self.last_activated_skill[-1]
         elif len(self.last_activated_time) == 1:
             return None
@@ -1382,7 +1643,7 @@ class StateMachine:
 
     def _evaluate_motif(self):
         skills_to_check = self._helper_get_current_skills()
-        unit_idx = (self.skill_indices[0] - 1) // 5
+        unit_idx = (self.skill_indices[self.skill_cursor] - 1) // 5
         for skill in skills_to_check:
             if skill.is_motif:
                 skill.v0 = self.live.unit.all_units[unit_idx].convert_motif(skill.skill_type, self.grand)
@@ -1406,22 +1667,22 @@ class StateMachine:
         for skill in skills_to_check:
             if skill.is_alternate or skill.is_mutual or skill.is_refrain:
                 if self.force_encore_amr_cache_to_encore_unit:
-                    unit_idx = (self.skill_indices[0] - 1) // 5
+                    unit_idx = (self.skill_indices[self.skill_cursor] - 1) // 5
                 else:
                     unit_idx = skill.original_unit_idx
                 self.unit_caches[unit_idx].update_AMR(skill)
 
     def _helper_get_current_skills(self):
-        if self.skill_indices[0] not in self.skill_queue:
+        if self.skill_indices[self.skill_cursor] not in self.skill_queue:
             return []
-        skills_to_check = self.skill_queue[self.skill_indices[0]]
-        if isinstance(skills_to_check, Skill):
+        skills_to_check = self.skill_queue[self.skill_indices[self.skill_cursor]]
+        if isinstance(skills_to_check, ActiveSkill):
             skills_to_check = [skills_to_check]
         return skills_to_check
 
     def _cache_skill_data(self):
         skills_to_check = self._helper_get_current_skills()
-        unit_idx = (self.skill_indices[0] - 1) // 5
+        unit_idx = (self.skill_indices[self.skill_cursor] - 1) // 5
         for skill in skills_to_check:
             self.unit_caches[unit_idx].update(skill)
 
@@ -1432,37 +1693,33 @@ class StateMachine:
             :type replace: True if new skill activates after the cached skill, False if same time
             :type skill_time: encore time to check for skills before that
             """
-            if self.reference_skills[self.skill_indices[0]].is_encore:
+            if self.reference_skills[self.skill_indices[self.skill_cursor]].is_encore:
                 return
             if replace:
-                self.last_activated_skill.append(self.skill_indices[0])
+                self.last_activated_skill.append(self.skill_indices[self.skill_cursor])
                 self.last_activated_time.append(skill_time)
             else:
-                self.last_activated_skill[-1] = min(self.last_activated_skill[-1], self.skill_indices[0])
+                self.last_activated_skill[-1] = min(self.last_activated_skill[-1], self.skill_indices[self.skill_cursor])
 
         # If skill is still not queued after self._expand_magic and self._expand_encore
-        if self.skill_indices[0] not in self.skill_queue:
-            self.skill_queue[self.skill_indices[0]] = copy.deepcopy(self.reference_skills[self.skill_indices[0]])
+        if self.skill_indices[self.skill_cursor] not in self.skill_queue:
+            self.skill_queue[self.skill_indices[self.skill_cursor]] = ActiveSkill(self.reference_skills[self.skill_indices[self.skill_cursor]])
 
-        # Pop deactivation out if skill cannot activate
+        # Cancel the deactivation if skill cannot activate
         if not self._can_activate():
-            skill_id = self.skill_indices[0]
-            self.skill_queue.pop(self.skill_indices[0])
-            # First index of -skill_id should be the correct value because a skill cannot activate twice before deactivating once
-            pop_skill_index = self.skill_indices.index(-skill_id)
-            # Pop the deactivation first to avoid messing up the index
-            self.skill_times.pop(pop_skill_index)
-            self.skill_indices.pop(pop_skill_index)
-            # Don't need to pop the activation because it will be pop in the outer sub
+            skill_id = self.skill_indices[self.skill_cursor]
+            self.skill_queue.pop(self.skill_indices[self.skill_cursor])
+            self._cancel_deactivation(skill_id)
+            # The activation is consumed by the outer sub
             return
 
         # Update last activated skill for encore
         # If new skill is strictly after cached last skill, just replace it
-        if len(self.last_activated_time) == 0 or self.last_activated_time[-1] < self.skill_times[0]:
-            update_last_activated_skill(replace=True, skill_time=self.skill_times[0])
-        elif self.last_activated_time[-1] == self.skill_times[0]:
+        if len(self.last_activated_time) == 0 or self.last_activated_time[-1] < self.skill_times[self.skill_cursor]:
+            update_last_activated_skill(replace=True, skill_time=self.skill_times[self.skill_cursor])
+        elif self.last_activated_time[-1] == self.skill_times[self.skill_cursor]:
             # Else update taking skill index order into consideration
-            update_last_activated_skill(replace=False, skill_time=self.skill_times[0])
+            update_last_activated_skill(replace=False, skill_time=self.skill_times[self.skill_cursor])
 
     def _handle_ol_drain(self, life_requirement):
         if self.life > life_requirement:
@@ -1489,15 +1746,19 @@ class StateMachine:
         """
         Checks if a (list of) queued skill(s) can activate or not.
         """
-        skills_to_check = self.skill_queue[self.skill_indices[0]]
-        if isinstance(skills_to_check, Skill):
+        skills_to_check = self.skill_queue[self.skill_indices[self.skill_cursor]]
+        if isinstance(skills_to_check, ActiveSkill):
             skills_to_check = [skills_to_check]
+        if self.use_fast_paths and not self.has_activation_checks:
+            # Nothing in the unit can fail to activate once its activation roll succeeded
+            self.skill_queue[self.skill_indices[self.skill_cursor]] = skills_to_check
+            return len(skills_to_check) > 0
         has_failed = False
         to_be_removed = list()
         for skill in skills_to_check:
 
             if self.force_encore_amr_cache_to_encore_unit:
-                unit_idx = (self.skill_indices[0] - 1) // 5
+                unit_idx = (self.skill_indices[self.skill_cursor] - 1) // 5
             else:
                 unit_idx = skill.original_unit_idx
 
@@ -1523,10 +1784,10 @@ class StateMachine:
                 to_be_removed.append(skill)
                 continue
             if skill.is_focus:
-                if not self._check_focus_activation(unit_idx=(self.skill_indices[0] - 1) // 5, skill=skill):
+                if not self._check_focus_activation(unit_idx=(self.skill_indices[self.skill_cursor] - 1) // 5, skill=skill):
                     to_be_removed.append(skill)
                 continue
         for skill in to_be_removed:
             skills_to_check.remove(skill)
-        self.skill_queue[self.skill_indices[0]] = skills_to_check
+        self.skill_queue[self.skill_indices[self.skill_cursor]] = skills_to_check
         return len(skills_to_check) > 0
@@ -2,6 +2,7 @@ from collections import OrderedDict
 
 import customlogger as logger
 from db import db
+from masterdata import master_data
 
 SKILL_BASE = {
     1: {"id": 1, "name": "SCORE Bonus", "keywords": ["su"], "color": (227, 98, 91)},
@@ -70,14 +71,10 @@ db.cachedb.commit()
 
 logger.debug("chihiro.skill_keywords created.")
 
-SPARKLE_BONUS_SSR = OrderedDict({_[0]: _[1] for idx, _ in
-                     enumerate(db.masterdb.execute_and_fetchall("SELECT life_value / 10, type_01_value FROM skill_life_value ORDER BY life_value"))})
-SPARKLE_BONUS_SR = OrderedDict({_[0]: _[1] for idx, _ in
-                    enumerate(db.masterdb.execute_and_fetchall("SELECT life_value / 10, type_02_value FROM skill_life_value ORDER BY life_value"))})
-SPARKLE_BONUS_SSR_GRAND = OrderedDict({_[0]: _[1] for idx, _ in enumerate(
-    db.masterdb.execute_and_fetchall("SELECT life_value / 10, type_01_value FROM skill_life_value_grand ORDER BY life_value"))})
-SPARKLE_BONUS_SR_GRAND = OrderedDict({_[0]: _[1] for idx, _ in enumerate(
-    db.masterdb.execute_and_fetchall("SELECT life_value / 10, type_02_value FROM skill_life_value_grand ORDER BY life_value"))})
+SPARKLE_BONUS_SSR = OrderedDict({_[0]: _[1] for _ in master_data.fetch_all("skill_life_value")})
+SPARKLE_BONUS_SR = OrderedDict({_[0]: _[2] for _ in master_data.fetch_all("skill_life_value")})
+SPARKLE_BONUS_SSR_GRAND = OrderedDict({_[0]: _[1] for _ in master_data.fetch_all("skill_life_value_grand")})
+SPARKLE_BONUS_SR_GRAND = OrderedDict({_[0]: _[2] for _ in master_data.fetch_all("skill_life_value_grand")})
 
 for d in [SPARKLE_BONUS_SSR, SPARKLE_BONUS_SR, SPARKLE_BONUS_SSR_GRAND, SPARKLE_BONUS_SR_GRAND]:
     c_v = 0
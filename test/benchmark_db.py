@@ -0,0 +1,101 @@
+"""
+Benchmarks for concurrent reads of master.db and a copy of the owned cards of chihiro.db, the way simulations,
+searches and card table refreshes read them from the thread pool.
+Not collected by the test suite, run with: python -m unittest test/benchmark_db.py
+"""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+os.environ["DEBUG_MODE"] = "1"
+import customlogger as logger
+from db import db
+from db.db import CustomDB
+
+THREADS = (1, 2, 4, 8)
+QUERIES = 2000
+
+
+def read_card(card_id, cachedb):
+    # Same rows as Card.from_id and Skill.from_id
+    card_data = db.masterdb.execute_and_fetchone("SELECT * FROM card_data WHERE id = ?", [card_id], out_dict=True)
+    db.masterdb.execute_and_fetchone(
+        """
+        SELECT skill_data.*,
+            card_data.attribute,
+            probability_type.probability_max,
+            available_time_type.available_time_max
+        FROM card_data, skill_data, probability_type, available_time_type
+        WHERE skill_data.id = ? AND
+            card_data.skill_id = ? AND
+            probability_type.probability_type = skill_data.probability_type AND
+            available_time_type.available_time_type = skill_data.available_time_type
+        """,
+        params=[card_data['skill_id'], card_data['skill_id']])
+    cachedb.execute_and_fetchall("SELECT number FROM owned_card WHERE card_id = ?", [card_id])
+
+
+class BenchmarkDB(unittest.TestCase):
+    def setUp(self):
+        # Writes go to a temporary database, never to the profile in chihiro.db
+        self.directory = tempfile.TemporaryDirectory()
+        self.cachedb = CustomDB(str(Path(self.directory.name) / "chihiro.db"), wal=True)
+        self.cachedb.execute("CREATE TABLE owned_card (card_id INTEGER PRIMARY KEY, number INTEGER)")
+        with self.cachedb.transaction():
+            for card_id, number in db.cachedb.execute_and_fetchall("SELECT card_id, number FROM owned_card"):
+                self.cachedb.execute("INSERT INTO owned_card VALUES (?, ?)", [card_id, number])
+
+    def tearDown(self):
+        self.cachedb.close()
+        self.directory.cleanup()
+
+    def _run(self, threads, card_ids, lock=None):
+        def work(card_id):
+            if lock is None:
+                read_card(card_id, self.cachedb)
+            else:
+                with lock:
+                    read_card(card_id, self.cachedb)
+
+        start = time.time()
+        with ThreadPoolExecutor(threads) as executor:
+            list(executor.map(work, card_ids))
+        return len(card_ids) / (time.time() - start)
+
+    def test_concurrent_reads(self):
+        card_ids = [_[0] for _ in db.masterdb.execute_and_fetchall("SELECT id FROM card_data")]
+        card_ids = (card_ids * (QUERIES // len(card_ids) + 1))[:QUERIES]
+        # One lock around every read, as all queries shared a single connection
+        global_lock = threading.Lock()
+        results = dict()
+        for threads in THREADS:
+            pooled = self._run(threads, card_ids)
+            serialized = self._run(threads, card_ids, global_lock)
+            results[threads] = pooled
+            logger.info("{} threads: {:.0f} cards/s, {:.0f} cards/s with one lock, {:.2f}x".format(
+                threads, pooled, serialized, pooled / serialized))
+        self.assertGreater(results[max(THREADS)], results[1] * 0.8)
+
+    def test_read_during_write(self):
+        card_ids = [_[0] for _ in db.masterdb.execute_and_fetchall("SELECT id FROM card_data LIMIT 100")]
+        idle = self._run(4, card_ids * 10)
+        self.cachedb.execute("CREATE TABLE benchmark_writes (x INTEGER)")
+        stop = threading.Event()
+
+        def write():
+            while not stop.is_set():
+                with self.cachedb.transaction():
+                    self.cachedb.execute("INSERT INTO benchmark_writes VALUES (1)")
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            writing = self._run(4, card_ids * 10)
+        finally:
+            stop.set()
+            writer.join()
+        logger.info("4 threads: {:.0f} cards/s, {:.0f} cards/s while writing".format(idle, writing))
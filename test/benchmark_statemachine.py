@@ -0,0 +1,95 @@
+"""
+Benchmarks for the state machine event loop on the longest charts in the local cache.
+Not collected by the test suite, run with: python -m unittest test/benchmark_statemachine.py
+"""
+import os
+import time
+import unittest
+
+import pyximport
+
+pyximport.install(language_level=3)
+
+os.environ["DEBUG_MODE"] = "1"
+import customlogger as logger
+from db import db
+from logic.grandlive import GrandLive
+from logic.grandunit import GrandUnit
+from logic.live import Live
+from logic.unit import Unit
+from simulator import Simulator
+from static.song_difficulty import Difficulty
+
+WIDE_UNIT = [100936, 100708, 100914, 100584, 100456, 100964]
+GRAND_UNITS = [[100946, 100774, 100882, 200978, 300896],
+               [100750, 101016, 100886, 100982, 100628],
+               [100972, 100964, 100904, 100918, 100944]]
+
+
+def get_longest_charts(grand, limit=3):
+    return db.cachedb.execute_and_fetchall(
+        """
+        SELECT live_id, difficulty, Tap + Long + Flick + Slide AS notes FROM live_detail_cache
+        WHERE difficulty {} (21, 22)
+        ORDER BY notes DESC LIMIT ?
+        """.format("IN" if grand else "NOT IN"), [limit])
+
+
+def drain_with_pop(stacks):
+    while stacks[0]:
+        for stack in stacks:
+            stack.pop(0)
+
+
+def drain_with_cursor(stacks):
+    cursor = 0
+    while cursor < len(stacks[0]):
+        for stack in stacks:
+            _ = stack[cursor]
+        cursor += 1
+
+
+class BenchmarkStateMachine(unittest.TestCase):
+    def _get_simulator(self, live_id, difficulty, grand):
+        if grand:
+            live = GrandLive()
+            live.set_music(score_id=live_id, difficulty=Difficulty(difficulty))
+            live.set_unit(GrandUnit(*[Unit.from_list(_, custom_pots=(10, 10, 10, 10, 10)) for _ in GRAND_UNITS]))
+        else:
+            live = Live()
+            live.set_music(score_id=live_id, difficulty=Difficulty(difficulty))
+            live.set_unit(Unit.from_list(WIDE_UNIT, custom_pots=(10, 10, 10, 10, 10)))
+        return Simulator(live)
+
+    def _benchmark(self, grand):
+        for live_id, difficulty, notes in get_longest_charts(grand):
+            sim = self._get_simulator(live_id, difficulty, grand)
+            start = time.time()
+            sim.simulate(times=100, appeals=300000, seed=0)
+            trials = time.time() - start
+            start = time.time()
+            sim.simulate(perfect_play=True, abuse=True, appeals=300000)
+            abuse = time.time() - start
+            logger.info("Live {} difficulty {} ({} notes): {:.2f} ms/trial, abuse {:.2f} s".format(
+                live_id, difficulty, notes, trials * 10, abuse))
+
+            # Compare draining the abuse event stacks, which are the largest ones, with pop(0) and with a cursor
+            impl = sim._create_state_machine(grand, doublelife=False)
+            impl.reset_machine(perfect_play=True, abuse=True, perfect_only=False)
+            stacks = [impl.note_time_stack, impl.note_time_deltas, impl.note_type_stack, impl.note_idx_stack,
+                      impl.special_note_types, impl.checkpoints, impl.is_abuse]
+            start = time.time()
+            drain_with_cursor(stacks)
+            cursor = time.time() - start
+            start = time.time()
+            drain_with_pop([_.copy() for _ in stacks])
+            pop = time.time() - start
+            logger.info("{} events: pop(0) {:.2f} ms, cursor {:.2f} ms, {:.1f}x".format(
+                len(stacks[0]), pop * 1000, cursor * 1000, pop / cursor))
+            self.assertLess(cursor, pop)
+
+    def test_wide(self):
+        self._benchmark(grand=False)
+
+    def test_grand(self):
+        self._benchmark(grand=True)
@@ -1,6 +1,7 @@
 import unittest
 
 from logic.card import Card
+from logic.card_factory import card_factory
 from static.color import Color
 
 
@@ -13,3 +14,19 @@ class TestCard(unittest.TestCase):
         self.assertEqual(uzu3.total, 15928)
         self.assertEqual(uzu3.color, Color.CUTE)
         self.assertEqual(str(uzu3), "uzuki3")
+
+    def test_factory(self):
+        card_ids = [100448, 100448, 200978]
+        custom_pots = (10, 10, 10, 10, 10)
+        cards = card_factory.get_cards(card_ids, custom_pots)
+        for card_id, card in zip(card_ids, cards):
+            expected = Card.from_id(card_id, custom_pots=custom_pots)
+            self.assertEqual(card, expected)
+            self.assertEqual((card.vo, card.vi, card.da, card.li), (expected.vo, expected.vi, expected.da, expected.li))
+            self.assertEqual(card.skill.probability, expected.skill.probability)
+            self.assertEqual(card.star, expected.star)
+        self.assertIsNot(cards[0], cards[1])
+        self.assertIsNot(cards[0].skill, cards[1].skill)
+        cards[0].set_skill_offset(2)
+        self.assertEqual(cards[1].skill.offset, 0)
+        self.assertEqual(card_factory.get_card(100448).total, Card.from_id(100448).total)
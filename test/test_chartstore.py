@@ -0,0 +1,29 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+import pandas as pd
+
+from chartstore import ChartStore
+from logic.live import Live
+from static.song_difficulty import Difficulty
+
+
+class TestChartStore(unittest.TestCase):
+    def test_round_trip(self):
+        charts = dict()
+        for score_id, difficulty in [(637, Difficulty.MPLUS), (637, Difficulty.MASTER), (637, Difficulty.DEBUT)]:
+            live = Live()
+            live.set_music(score_id=score_id, difficulty=difficulty)
+            charts[(score_id, difficulty.value)] = (live.notes, live.duration)
+        with tempfile.TemporaryDirectory() as path:
+            store = ChartStore(Path(path))
+            self.assertFalse(store.exists())
+            store.write(charts)
+            self.assertListEqual(sorted(store.keys()), sorted(charts.keys()))
+            for key, (notes_data, duration) in charts.items():
+                stored_notes, stored_duration = store.get(*key)
+                pd.testing.assert_frame_equal(stored_notes, notes_data)
+                self.assertEqual(stored_duration, duration)
+            self.assertIsNone(store.get(637, Difficulty.PIANO.value))
+            store.close()
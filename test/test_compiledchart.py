@@ -0,0 +1,40 @@
+import unittest
+
+import numpy as np
+
+from compiledchart import get_compiled_chart
+from logic.grandlive import GrandLive
+from logic.live import Live
+from static.note_type import NoteType
+from static.song_difficulty import Difficulty
+
+
+class TestCompiledChart(unittest.TestCase):
+    def test_cached(self):
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS)
+        chart = get_compiled_chart(live)
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS)
+        self.assertIs(get_compiled_chart(live), chart)
+        self.assertEqual(chart.note_count, len(live.notes))
+        self.assertEqual(len(chart.weights), chart.note_count)
+        self.assertEqual(chart.weights[0], 1.0)
+        self.assertEqual(chart.weights[-1], 2.0)
+
+    def test_mirror(self):
+        live = GrandLive()
+        live.set_music(music_name="Starry-Go-Round", difficulty=Difficulty.PIANO)
+        chart = get_compiled_chart(live)
+        mirrored = get_compiled_chart(live, mirror=True)
+        self.assertIsNot(chart, mirrored)
+        expected = 16 - (np.array(chart.finish_pos) + np.array(chart.status) - 1)
+        self.assertListEqual(mirrored.finish_pos, expected.tolist())
+        # Mirroring does not touch the live's notes
+        self.assertListEqual(live.notes['finishPos'].to_list(), chart.finish_pos)
+
+    def test_checkpoints(self):
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS)
+        chart = get_compiled_chart(live)
+        for idx in np.flatnonzero(chart.checkpoints_array):
+            self.assertIs(chart.note_types[idx], NoteType.SLIDE)
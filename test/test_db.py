@@ -0,0 +1,55 @@
+import gc
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from db.db import CustomDB
+
+
+class TestCustomDB(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db = CustomDB(str(Path(self.directory.name) / "test.db"), wal=True)
+        self.db.execute("CREATE TABLE test (x INTEGER UNIQUE)")
+
+    def tearDown(self):
+        self.db.close()
+        self.directory.cleanup()
+
+    def _write_from_thread(self, value):
+        def write():
+            self.db.execute("INSERT INTO test VALUES (?)", [value])
+            self.db.commit()
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        thread.join(5)
+        return not thread.is_alive()
+
+    def test_thread_connections_closed(self):
+        threads = [threading.Thread(target=self.db.execute_and_fetchall, args=("SELECT * FROM test",))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+        self.assertEqual(len(self.db._holders), 1)
+
+    def test_failed_write(self):
+        self.db.execute("INSERT INTO test VALUES (1)")
+        with self.assertRaises(Exception):
+            self.db.execute("INSERT INTO test VALUES (1)")
+        self.assertTrue(self._write_from_thread(2))
+        self.assertListEqual(self.db.execute_and_fetchall("SELECT x FROM test"), [(2,)])
+
+    def test_transaction(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                self.db.execute("INSERT INTO test VALUES (1)")
+                raise ValueError
+        with self.db.transaction():
+            self.db.execute("INSERT INTO test VALUES (2)")
+        self.assertTrue(self._write_from_thread(3))
+        self.assertListEqual(self.db.execute_and_fetchall("SELECT x FROM test ORDER BY x"), [(2,), (3,)])
@@ -3,6 +3,7 @@ import unittest
 from exceptions import NoLiveFoundException
 from logic.card import Card
 from logic.live import Live
+from logic.music_index import music_index
 from logic.unit import Unit
 from static.song_difficulty import Difficulty
 
@@ -42,3 +43,10 @@ class TestLive(unittest.TestCase):
         live = Live()
         self.assertRaises(NoLiveFoundException, lambda: live.set_music(music_name="印象", difficulty=Difficulty.TRICK))
         self.assertRaises(NoLiveFoundException, lambda: live.set_music(music_name="not found", difficulty=Difficulty.REGULAR))
+
+    def test_music_name_index(self):
+        exact = music_index.find("Starry-Go-Round", Difficulty.MPLUS.value)
+        self.assertGreater(len(exact), 0)
+        self.assertListEqual(music_index.find(" starry-go-round ", Difficulty.MPLUS.value), exact)
+        self.assertListEqual(music_index.find("Starry-Go-Rownd", Difficulty.MPLUS.value), exact)
+        self.assertListEqual(music_index.find("not found", Difficulty.REGULAR.value), [])
@@ -0,0 +1,33 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from db import db
+from masterdata import MasterData, QUERIES
+from settings import MASTERDB_PATH
+
+
+class TestMasterData(unittest.TestCase):
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as path:
+            snapshot_path = Path(path) / "master.snapshot"
+            master_data = MasterData(snapshot_path, MASTERDB_PATH)
+            self.assertListEqual(master_data.fetch_all("skill_life_value"),
+                                 db.masterdb.execute_and_fetchall(QUERIES["skill_life_value"]))
+            self.assertTrue(snapshot_path.exists())
+            leader_data = db.masterdb.execute_and_fetchone("SELECT * FROM leader_skill_data WHERE id = 1",
+                                                           out_dict=True)
+            self.assertDictEqual(master_data.get("leader_skill_data", 1), dict(leader_data))
+            self.assertEqual(master_data.get("potential_value_vo", 10)["value_rare_7"],
+                             db.masterdb.execute_and_fetchone(
+                                 "SELECT value_rare_7 FROM potential_value_vo WHERE potential_level = 10")[0])
+
+            # Loaded from the file by another instance, rebuilt once it is stale
+            other = MasterData(snapshot_path, MASTERDB_PATH)
+            self.assertEqual(other.get("master_hash"), master_data.get("master_hash"))
+            other.data["master_hash"] = "stale"
+            other._write(other.data)
+            master_data.close()
+            self.assertNotEqual(master_data.get("master_hash"), "stale")
+            self.assertEqual(MasterData(snapshot_path, MASTERDB_PATH).get("master_hash"),
+                             master_data.get("master_hash"))
@@ -0,0 +1,65 @@
+import unittest
+
+import numpy as np
+
+from scoreaggregator import ScoreAggregator
+
+
+class TestScoreAggregator(unittest.TestCase):
+    def setUp(self):
+        self.scores = np.random.default_rng(0).normal(1000000, 20000, 5000).astype(int)
+
+    def test_moments(self):
+        aggregator = ScoreAggregator()
+        for chunk in np.array_split(self.scores, 7):
+            aggregator.add_all(chunk)
+        self.assertEqual(aggregator.count, len(self.scores))
+        self.assertEqual(int(aggregator.mean), int(self.scores.mean()))
+        self.assertAlmostEqual(aggregator.std, self.scores.std(), delta=1E-6 * self.scores.std())
+        self.assertEqual(aggregator.min, self.scores.min())
+        self.assertEqual(aggregator.max, self.scores.max())
+
+    def test_merge(self):
+        left = ScoreAggregator(histogram_bin_width=1000, keep_scores=True)
+        right = left.copy_empty()
+        left.add_all(self.scores[:1234])
+        right.add_all(self.scores[1234:])
+        left.merge(right)
+        self.assertListEqual(left.scores, self.scores.tolist())
+        self.assertAlmostEqual(left.variance, self.scores.var(), delta=1E-6 * self.scores.var())
+        edges, counts = left.histogram()
+        self.assertEqual(counts.sum(), len(self.scores))
+        self.assertListEqual(counts.tolist(), np.histogram(self.scores, edges)[0].tolist())
+
+    def test_quantile(self):
+        aggregator = ScoreAggregator(relative_accuracy=1E-4)
+        aggregator.add_all(self.scores)
+        for percentile in [1, 10, 50, 75, 90, 99]:
+            exact = np.percentile(self.scores, percentile, method="lower")
+            self.assertLessEqual(abs(aggregator.percentile(percentile) - exact), 2E-4 * exact)
+        self.assertEqual(aggregator.percentile(0), self.scores.min())
+        self.assertEqual(aggregator.percentile(100), self.scores.max())
+
+    def test_effective_sample_size(self):
+        independent = ScoreAggregator(block_size=50)
+        trials = np.arange(len(self.scores))
+        for chunk in np.array_split(trials, 7):
+            independent.add_all(self.scores[chunk], chunk)
+        self.assertAlmostEqual(independent.effective_sample_size / len(self.scores), 1, delta=0.5)
+        # Pairs that cancel out around the mean give the mean no variance at all within a block
+        paired = ScoreAggregator(block_size=2)
+        mirrored = np.stack([self.scores[:2500], 2000000 - self.scores[:2500]], axis=1).ravel()
+        paired.add_all(mirrored, trials)
+        self.assertEqual(paired.effective_sample_size, np.inf)
+        self.assertEqual(ScoreAggregator().effective_sample_size, 0)
+
+    def test_trials(self):
+        aggregator = ScoreAggregator(keep_scores=True)
+        trials = np.arange(len(self.scores))
+        for chunk in np.array_split(trials, 7):
+            aggregator.add_all(self.scores[chunk], chunk)
+        self.assertEqual(aggregator.min_trial, self.scores.argmin())
+        self.assertEqual(aggregator.max_trial, self.scores.argmax())
+        self.assertEqual(aggregator.quantile_trial(0), self.scores.argmin())
+        self.assertEqual(self.scores[aggregator.quantile_trial(0.5)], np.percentile(self.scores, 50, method="nearest"))
+        self.assertIsNone(ScoreAggregator().min_trial)
@@ -1,6 +1,7 @@
 import os
 import unittest
 
+import numpy as np
 import pyximport
 
 from logic.card import Card
@@ -13,7 +14,8 @@ pyximport.install(language_level=3)
 os.environ["DEBUG_MODE"] = "1"
 import customlogger as logger
 from logic.unit import Unit
-from simulator import Simulator
+from bonuscache import clear_trial_bonuses
+from simulator import Simulator, simulate_paired
 from static.song_difficulty import Difficulty
 
 logger.print_debug()
@@ -189,6 +191,20 @@ class TestAuto(unittest.TestCase):
         sim = Simulator(live, special_offset=0.075)
         self.assertEqual(sim.simulate(auto=True, appeals=451228, time_offset=218, mirror=True).score, 936614)
 
+    def test_sweep(self):
+        unit = Unit.from_list([200946, 200058, 100076, 100396, 300530, 200294], custom_pots=(0, 0, 0, 0, 10))
+        live = Live()
+        live.set_music(music_name="Trust me", difficulty=Difficulty.MASTER)
+        live.set_unit(unit)
+        offsets = [0, 90, 110, 120, 150, 220]
+        sweep = Simulator(live, special_offset=0.075).simulate_auto_sweep(offsets, appeals=277043, processes=2)
+        self.assertEqual(sweep.loc[120, "score"], 561672)
+        for offset in offsets:
+            res = Simulator(live, special_offset=0.075).simulate(auto=True, appeals=277043, time_offset=offset)
+            self.assertEqual(sweep.loc[offset, "score"], res.score)
+            self.assertEqual(sweep.loc[offset, "misses"], res.misses)
+            self.assertEqual(sweep.loc[offset, "lowest_life"], res.lowest_life)
+
 
 class TestAbuse(unittest.TestCase):
     def test_wide(self):
@@ -235,3 +251,172 @@ class TestAbuse(unittest.TestCase):
         sim = Simulator(live)
         res = sim.simulate(appeals=243551, perfect_play=True, abuse=True)
         self.assertEqual(res.abuse_score - res.perfect_score, 47441)
+
+    def test_cached_replay(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 10, 10))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        general = Simulator(live, use_fast_paths=False).simulate(appeals=243551, perfect_play=True, abuse=True)
+        cached = Simulator(live).simulate(appeals=243551, perfect_play=True, abuse=True)
+        self.assertEqual(general.abuse_score, cached.abuse_score)
+        self.assertListEqual(general.abuse_data.score_delta.tolist(), cached.abuse_data.score_delta.tolist())
+        self.assertListEqual(general.abuse_data.window_l, cached.abuse_data.window_l)
+        self.assertListEqual(general.abuse_data.window_r, cached.abuse_data.window_r)
+
+
+class TestRandom(unittest.TestCase):
+    def test_parallel(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        serial = Simulator(live).simulate(times=40, appeals=243551, seed=1, processes=1, keep_scores=True)
+        parallel = Simulator(live).simulate(times=40, appeals=243551, seed=1, processes=4, keep_scores=True)
+        self.assertEqual(serial.base, parallel.base)
+        self.assertListEqual(serial.deltas.tolist(), parallel.deltas.tolist())
+
+    def test_batch(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        state_machine = Simulator(live).simulate(times=200, appeals=243551, seed=1, batch=False, keep_scores=True)
+        batch = Simulator(live).simulate(times=200, appeals=243551, seed=1, batch=True, keep_scores=True)
+        self.assertEqual(state_machine.base, batch.base)
+        self.assertListEqual(state_machine.deltas.tolist(), batch.deltas.tolist())
+
+    def test_bonus_memo(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        sim = Simulator(live)
+        sim.simulate(times=1, appeals=243551, batch=False)
+
+        def create_state_machine():
+            impl = sim._create_state_machine(False, False)
+            impl.reset_machine(perfect_play=True, perfect_only=True)
+            impl.simulate_impl()
+            return impl
+
+        impl = create_state_machine()
+        scores = sim._simulate_trials(impl, range(20), 1, True)
+        hits, misses = impl.get_memo_stats()
+        self.assertGreater(hits, 0)
+        fresh = [sim._simulate_trials(create_state_machine(), [trial], 1, True)[0] for trial in range(20)]
+        self.assertListEqual(scores, fresh)
+
+    def test_fast_paths(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        general = Simulator(live, use_fast_paths=False).simulate(times=40, appeals=243551, seed=1, perfect_only=False,
+                                                                 batch=False, keep_scores=True)
+        fast = Simulator(live).simulate(times=40, appeals=243551, seed=1, perfect_only=False, batch=False,
+                                        keep_scores=True)
+        self.assertEqual(general.perfect_score, fast.perfect_score)
+        self.assertListEqual(general.deltas.tolist(), fast.deltas.tolist())
+
+    def test_target_se(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        adaptive = Simulator(live).simulate(times=2000, appeals=243551, seed=1, target_se=1000, percentile=10)
+        self.assertLessEqual(adaptive.trials, 2000)
+        low, high = adaptive.confidence_interval
+        self.assertLess(low, adaptive.aggregator.mean)
+        self.assertLess(adaptive.aggregator.mean, high)
+        self.assertIsNotNone(adaptive.percentile_interval)
+        fixed = Simulator(live).simulate(times=adaptive.trials, appeals=243551, seed=1)
+        self.assertEqual(fixed.base, adaptive.base)
+
+    def test_estimate(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        estimate = Simulator(live).estimate(appeals=243551)
+        random = Simulator(live).simulate(times=500, appeals=243551, seed=1)
+        self.assertEqual(estimate.perfect_score, random.perfect_score)
+        self.assertAlmostEqual(estimate.expected_score / random.aggregator.mean, 1, delta=0.01)
+        self.assertGreater(estimate.std, 0)
+
+    def test_paired(self):
+        unit = [100936, 100708, 100914, 100584, 100456, 100964]
+        lives = list()
+        for cards in (unit, unit, [100936, 100708, 100914, 100584, 100964, 100964]):
+            live = Live()
+            live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+            live.set_unit(Unit.from_list(cards, custom_pots=(10, 5, 0, 0, 0)))
+            lives.append(live)
+        paired = simulate_paired([Simulator(live) for live in lives], times=100, appeals=243551, seed=1)
+        self.assertListEqual(paired.differences[1].tolist(), [0] * 100)
+        self.assertEqual(paired.confidence_intervals[1], (0, 0))
+        low, high = paired.confidence_intervals[2]
+        self.assertLessEqual(low, paired.mean_differences[2])
+        self.assertLessEqual(paired.mean_differences[2], high)
+        self.assertAlmostEqual(paired.results[2].aggregator.mean - paired.results[0].aggregator.mean,
+                               paired.mean_differences[2])
+
+    def test_stratified(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        plain = Simulator(live).simulate(times=500, appeals=243551, seed=1)
+        stratified = Simulator(live).simulate(times=500, appeals=243551, seed=1, stratified=True, antithetic=True)
+        self.assertEqual(plain.effective_sample_size, 500)
+        self.assertGreater(stratified.effective_sample_size, 0)
+        self.assertAlmostEqual(stratified.aggregator.mean / plain.aggregator.mean, 1, delta=0.01)
+        batch = Simulator(live).simulate(times=200, appeals=243551, seed=1, stratified=True, batch=True,
+                                         keep_scores=True)
+        state_machine = Simulator(live).simulate(times=200, appeals=243551, seed=1, stratified=True, batch=False,
+                                                 keep_scores=True)
+        self.assertListEqual(batch.deltas.tolist(), state_machine.deltas.tolist())
+
+    def test_replay_trial(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        simulator = Simulator(live)
+        result = simulator.simulate(times=100, appeals=243551, seed=1, stratified=True)
+        self.assertEqual(result.seed, 1)
+        for trial, score in [(result.aggregator.min_trial, result.min_score),
+                             (result.aggregator.max_trial, result.max_score)]:
+            trace = simulator.replay_trial(trial)
+            self.assertEqual(len(trace), len(live.notes))
+            self.assertEqual(trace.score.sum(), score)
+
+    def test_reuse_trials(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        clear_trial_bonuses()
+        Simulator(live).simulate(times=100, support=100000, seed=1, keep_scores=True, reuse_trials=True)
+        rescaled = Simulator(live).simulate(times=100, support=120000, seed=1, keep_scores=True, reuse_trials=True)
+        clear_trial_bonuses()
+        fresh = Simulator(live).simulate(times=100, support=120000, seed=1, keep_scores=True)
+        self.assertEqual(rescaled.perfect_score, fresh.perfect_score)
+        self.assertListEqual(rescaled.aggregator.scores, fresh.aggregator.scores)
+
+    def test_reweighted(self):
+        unit = Unit.from_list([100936, 100708, 100914, 100584, 100456, 100964], custom_pots=(10, 5, 0, 0, 0))
+        live = Live()
+        live.set_music(score_id=637, difficulty=Difficulty.MPLUS, event=True)
+        live.set_unit(unit)
+        probabilities = np.array([live.get_probability(idx) for idx in range(5)])
+        variants = [probabilities, np.clip(probabilities * 1.02, 0, 1)]
+        simulator = Simulator(live)
+        results = simulator.simulate_reweighted(variants, proposal=probabilities, times=500, appeals=243551, seed=1)
+        plain = Simulator(live).simulate(times=500, appeals=243551, seed=1)
+        self.assertAlmostEqual(results[0].mean, plain.aggregator.mean, delta=1E-3)
+        self.assertAlmostEqual(results[0].effective_sample_size, 500)
+        simulator.probabilities = variants[1]
+        fresh = simulator.simulate(times=500, appeals=243551, seed=2)
+        self.assertAlmostEqual(results[1].mean / fresh.aggregator.mean, 1, delta=0.01)
+        self.assertGreater(results[1].mean, results[0].mean)
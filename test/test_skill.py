@@ -1,6 +1,7 @@
+import pickle
 import unittest
 
-from logic.skill import Skill
+from logic.skill import ActiveSkill, Skill, FLAG_MAGIC, FLAG_AMR
 from logic.unit import Unit
 
 
@@ -62,6 +63,37 @@ class TestSkill(unittest.TestCase):
         assert sym_9s_hi.boost
 
 
+    def test_active_skill(self):
+        su_4s_hi = Skill.from_id(300327)
+        active = ActiveSkill(su_4s_hi)
+        active.v0 -= 100
+        active.normalized = True
+        self.assertEqual(active.v0, 17)
+        self.assertEqual(su_4s_hi.v0, 117)
+        self.assertFalse(hasattr(su_4s_hi, "normalized"))
+        self.assertEqual(active.duration, su_4s_hi.duration)
+        self.assertEqual(active.values, su_4s_hi.values)
+        self.assertEqual(active, su_4s_hi)
+
+    def test_flags(self):
+        magic = Skill(values=[1, 0, 0, 0], skill_type=41)
+        self.assertTrue(magic.flags & FLAG_MAGIC)
+        self.assertFalse(magic.flags & FLAG_AMR)
+        self.assertTrue(magic.is_magic)
+        self.assertFalse(magic.is_encore)
+        self.assertEqual(magic.values, (1, 0, 0, 0))
+        self.assertEqual(magic.v0, 1)
+
+    def test_pickle(self):
+        sb_10s_hi = Skill.from_id(100479)
+        sb_10s_hi.set_original_unit_idx(2)
+        unpickled = pickle.loads(pickle.dumps(sb_10s_hi))
+        self.assertEqual(unpickled, sb_10s_hi)
+        self.assertEqual(unpickled.values, sb_10s_hi.values)
+        self.assertEqual(unpickled.flags, sb_10s_hi.flags)
+        self.assertEqual(unpickled.original_unit_idx, 2)
+
+
 class TestSkillTrigger(unittest.TestCase):
     def test_syn_all_passion(self):
         unit = Unit.from_query("mio1 mio2 mio3 mio4 rika4")
@@ -73,4 +105,5 @@ class TestSkillTrigger(unittest.TestCase):
 
     def test_princess_mismatch(self):
         unit = Unit.from_query("mio1 mio2 mio3 mio4 rin2")
-        self.assertEqual(unit.get_card(2).skill.probability, 0)
\ No newline at end of file
+        self.assertEqual(unit.get_card(2).skill.probability, 0)
+